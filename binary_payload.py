@@ -0,0 +1,99 @@
+import os
+import struct
+import zlib
+from word128 import WORD_BITS, WORD_BYTES
+
+"""
+二进制载荷格式模块：Data_Library 权重/输出数据的紧凑存储格式
+- 文本格式每行 129 字节（128个'0'/'1'加换行符）只承载 16 字节数据，二进制格式直接存放打包后的128位字，
+  体积约为文本的 1/8
+- 文件布局：16 字节文件头 + 连续的16字节大端序字
+    文件头：魔数 b"TCWB"（4字节）、格式版本（2字节）、字宽位数（2字节）、行数（4字节）、数据区CRC32（4字节）
+- 与文本文件同名、扩展名为 .bin（如 weight_data.bin），同一算子目录存在 .bin 且不早于 .txt 时优先读取，
+  因此同一个库中文本格式与二进制格式的算子可以混用
+"""
+
+BINARY_MAGIC = b"TCWB"
+BINARY_VERSION = 1
+BINARY_SUFFIX = ".bin"
+TEXT_SUFFIX = ".txt"
+# 文件头：魔数、版本、字宽位数、行数、CRC32（大端序）
+BINARY_HEADER = struct.Struct(">4sHHII")
+# 已提示过“文本比二进制新”的二进制载荷路径（每个文件只提示一次）
+_stale_warned = set()
+
+
+def is_binary_payload(path: str) -> bool:
+    return path.endswith(BINARY_SUFFIX)
+
+
+def resolve_payload_path(op_path: str, stem: str) -> str:
+    """
+    返回算子目录下载荷文件的路径：二进制格式（stem.bin）不早于文本格式（stem.txt）或没有文本格式时使用二进制格式，
+    否则为文本格式。转换后又修改过的文本文件以文本为准（与转换工具判断是否需要重新转换的规则一致），并提示重新转换。
+    """
+    binary_path = os.path.join(op_path, stem + BINARY_SUFFIX)
+    text_path = os.path.join(op_path, stem + TEXT_SUFFIX)
+    try:
+        binary_mtime = os.stat(binary_path).st_mtime_ns
+    except OSError:
+        return text_path
+    try:
+        text_mtime = os.stat(text_path).st_mtime_ns
+    except OSError:
+        return binary_path
+    if binary_mtime >= text_mtime:
+        return binary_path
+    if binary_path not in _stale_warned:
+        _stale_warned.add(binary_path)
+        print(f"警告：{text_path} 比二进制载荷 {binary_path} 新，改为读取文本格式（请重新运行 data_library_converter）")
+    return text_path
+
+
+def _read_header(f, path: str):
+    header = f.read(BINARY_HEADER.size)
+    if len(header) != BINARY_HEADER.size:
+        raise ValueError(f"二进制载荷文件头不完整：{path}")
+    magic, version, word_bits, line_count, checksum = BINARY_HEADER.unpack(header)
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"不是二进制载荷文件（魔数不符）：{path}")
+    if version != BINARY_VERSION or word_bits != WORD_BITS:
+        raise ValueError(f"不支持的二进制载荷格式：{path}（版本 {version}，字宽 {word_bits} 位）")
+    return line_count, checksum
+
+
+def binary_line_count(path: str) -> int:
+    """只读取文件头，返回行数（128位字数）"""
+    with open(path, "rb") as f:
+        line_count, _ = _read_header(f, path)
+    return line_count
+
+
+def binary_payload_bytes(path: str) -> int:
+    """返回二进制载荷的数据区字节数（不读取数据）"""
+    return max(0, os.path.getsize(path) - BINARY_HEADER.size)
+
+
+def read_binary_payload(path: str, verify: bool = True) -> bytes:
+    """读取二进制载荷，返回打包的16字节字序列；校验行数与CRC32"""
+    with open(path, "rb") as f:
+        line_count, checksum = _read_header(f, path)
+        words = f.read()
+    if len(words) != line_count * WORD_BYTES:
+        raise ValueError(f"二进制载荷长度与文件头不符：{path}（文件头 {line_count} 行，实际 {len(words) // WORD_BYTES} 行）")
+    if verify and zlib.crc32(words) != checksum:
+        raise ValueError(f"二进制载荷CRC32校验失败：{path}")
+    return words
+
+
+def write_binary_payload(path: str, words: bytes):
+    """原子写入二进制载荷（先写临时文件再替换）"""
+    if len(words) % WORD_BYTES:
+        raise ValueError(f"载荷长度 {len(words)} 不是 {WORD_BYTES} 字节的整数倍")
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, WORD_BITS, len(words) // WORD_BYTES,
+                                zlib.crc32(words))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(words)
+    os.replace(tmp_path, path)
@@ -0,0 +1,34 @@
+from typing import List, Tuple
+
+"""
+激活缓冲区规划模块：按生命周期复用DDR中的特征图缓冲区（可选）
+- 网络按层顺序执行，第 i 层的输出只作为第 i+1 层的输入：第 i 层输出缓冲区的生命周期为 [i, i+1]，
+  网络输入（第一层的输入数据）的生命周期为 [0, 1]，最后一层的输出保留到结束
+- 按层序为各缓冲区做首次适应（first-fit）分配：分配第 i 层输出前，释放生命周期已结束的缓冲区，
+  从激活区起始处找第一个足够大的空闲区间；线性网络下效果相当于两块缓冲区交替使用（乒乓）
+- 激活区大小即峰值占用，替代按层顺序追加全部输出数据所需的空间
+"""
+
+
+def plan_activation_buffers(sizes: List[int]) -> Tuple[List[int], int]:
+    """
+    sizes[0] 为网络输入的行数，sizes[i] 为第 i 层输出的行数（i >= 1）。
+    返回 (各缓冲区在激活区内的偏移, 激活区总行数即峰值占用)。
+    """
+    offsets = []
+    live = []  # 已分配且尚未释放的缓冲区 [(偏移, 行数, 最后使用的层号)]
+    peak = 0
+    for idx, size in enumerate(sizes):
+        # 释放最后使用层号早于当前层的缓冲区（当前层仍要读取上一层的输出）
+        live = [block for block in live if block[2] >= idx]
+        # 首次适应：按偏移顺序查找第一个足够大的空闲区间
+        offset = 0
+        for block_offset, block_size, _ in sorted(live):
+            if block_offset - offset >= size:
+                break
+            offset = max(offset, block_offset + block_size)
+        # 第 idx 个缓冲区由第 idx+1 层读取（最后一层的输出不再释放）
+        live.append((offset, size, idx + 1))
+        offsets.append(offset)
+        peak = max(peak, offset + size)
+    return offsets, peak
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+from typing import List, Dict, Optional, Tuple
+from library_cache import stat_key
+from binary_payload import write_binary_payload, read_binary_payload
+
+"""
+构建缓存模块：按网络层缓存编译产物，支持增量编译
+- 每层的指纹 = 层参数（网络结构JSON中的该层配置）+ 算子库目录指纹（各算子路径与info.json内容），
+  层参数与算子库均未变化时该层的算子匹配结果必然不变
+- 命中时还要校验该层用到的各文件状态（mtime_ns、size）未变化，载荷文件被修改的层会重新生成
+- 阶段一缓存每层各任务的算子路径与激励（打包后的128位字，存为二进制载荷文件）
+- 阶段三缓存每层各数据文件的行数及是否为规范布局；地址由逐层累加重新计算，
+  因此修改某一层只会重新生成该层，其后各层只需重定位地址
+- 缓存位于输出目录的 .build_cache 子目录：索引文件 build_index.json 与各层的激励文件
+"""
+
+BUILD_CACHE_DIR_NAME = ".build_cache"
+BUILD_INDEX_NAME = "build_index.json"
+BUILD_CACHE_VERSION = 1
+# 索引中最多保留的层条目数（按最近使用时间淘汰）
+MAX_BUILD_ENTRIES = 1024
+
+
+class BuildCache:
+    """按层指纹索引的编译产物缓存"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, BUILD_INDEX_NAME)
+        self.hits = 0
+        self.misses = 0
+        self._entries = self._read_index()
+        self._dirty = False
+
+    @classmethod
+    def for_output_dir(cls, output_dir: str) -> "BuildCache":
+        return cls(os.path.join(output_dir, BUILD_CACHE_DIR_NAME))
+
+    def _read_index(self) -> Dict:
+        """读取索引文件，不存在或版本不符时返回空索引"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get("version") != BUILD_CACHE_VERSION:
+            return {}
+        return index.get("entries", {})
+
+    @staticmethod
+    def layer_fingerprint(stage: str, layer: Dict, catalog_fingerprint: str) -> str:
+        """计算单层的指纹（阶段名区分阶段一与阶段三的产物；与层号无关，插入或删除层时其余层仍可命中）"""
+        key = json.dumps([stage, layer, catalog_fingerprint], sort_keys=True, ensure_ascii=False, default=list)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _blob_path(self, fingerprint: str) -> str:
+        return os.path.join(self.cache_dir, fingerprint + ".bin")
+
+    def get(self, fingerprint: str) -> Optional[Tuple[Dict, Optional[bytes]]]:
+        """
+        查找层条目，返回 (产物信息, 打包字内容)；条目不存在、依赖文件状态变化或打包字文件损坏时返回None。
+        """
+        entry = self._entries.get(fingerprint)
+        if entry is not None and all(stat_key(path) == stat for path, stat in entry["file_stats"]):
+            blob = None
+            try:
+                if entry["has_blob"]:
+                    blob = read_binary_payload(self._blob_path(fingerprint))
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                entry["last_used"] = time.time()
+                self._dirty = True
+                self.hits += 1
+                return entry["data"], blob
+        if fingerprint in self._entries:
+            del self._entries[fingerprint]
+            self._dirty = True
+        self.misses += 1
+        return None
+
+    def put(self, fingerprint: str, files: List[str], data: Dict, blob: bytes = None):
+        """登记层条目：files 为该层产物依赖的文件，data 为可JSON序列化的产物信息，blob 为可选的打包字内容"""
+        try:
+            if blob is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                write_binary_payload(self._blob_path(fingerprint), bytes(blob))
+        except OSError as e:
+            print(f"警告：构建缓存写入失败 {self.cache_dir}，错误：{e}")
+            return
+        self._entries[fingerprint] = {
+            "file_stats": [[path, stat_key(path)] for path in dict.fromkeys(files)],
+            "data": data,
+            "has_blob": blob is not None,
+            "last_used": time.time(),
+        }
+        self._dirty = True
+
+    def save(self):
+        """淘汰最久未使用的条目并原子写入索引（写入失败时仅打印警告）"""
+        if not self._dirty:
+            return
+        if len(self._entries) > MAX_BUILD_ENTRIES:
+            ordered = sorted(self._entries.items(), key=lambda item: item[1]["last_used"], reverse=True)
+            for fingerprint, entry in ordered[MAX_BUILD_ENTRIES:]:
+                if entry.get("has_blob"):
+                    try:
+                        os.remove(self._blob_path(fingerprint))
+                    except OSError:
+                        pass
+            self._entries = dict(ordered[:MAX_BUILD_ENTRIES])
+
+        tmp_path = self.index_path + ".tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": BUILD_CACHE_VERSION, "entries": self._entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+        except OSError as e:
+            print(f"警告：构建缓存索引写入失败 {self.index_path}，错误：{e}")
+
+    def summary(self) -> str:
+        return f"构建缓存：共命中 {self.hits} 项，重新生成 {self.misses} 项（每层阶段一、阶段三各一项）"
@@ -0,0 +1,77 @@
+import os
+from word128 import WORD_BYTES, pack_text
+from binary_payload import (BINARY_SUFFIX, TEXT_SUFFIX, BINARY_HEADER, write_binary_payload,
+                            read_binary_payload)
+
+"""
+数据库格式转换工具：将 Data_Library 中的文本格式载荷（weight_data.txt / output_data.txt）
+一次性转换为二进制格式（weight_data.bin / output_data.bin）
+- 逐个算子目录转换，写入后回读校验（行数、CRC32、内容一致）
+- 二进制文件比文本文件新时跳过，可重复执行（增量转换）
+- 默认保留文本文件；remove_text=True 时转换成功后删除文本文件
+- 转换后阶段三自动优先读取二进制格式，未转换的算子仍读取文本格式，两者可以混用
+"""
+
+DATA_DB_ROOT = "Data_Library"
+PAYLOAD_STEMS = ("weight_data", "output_data")
+
+
+def convert_payload(text_path, remove_text=False):
+    """将单个文本载荷转换为二进制格式，返回 (文本字节数, 二进制字节数)；已是最新时返回None"""
+    binary_path = text_path[:-len(TEXT_SUFFIX)] + BINARY_SUFFIX
+    if os.path.exists(binary_path) and os.path.getmtime(binary_path) >= os.path.getmtime(text_path):
+        return None
+
+    with open(text_path, "r", encoding="utf-8") as f:
+        words = pack_text(f.read())
+    write_binary_payload(binary_path, words)
+    # 回读校验
+    if read_binary_payload(binary_path) != words:
+        os.remove(binary_path)
+        raise ValueError(f"二进制载荷回读校验失败：{binary_path}")
+
+    text_bytes = os.path.getsize(text_path)
+    if remove_text:
+        os.remove(text_path)
+    return text_bytes, BINARY_HEADER.size + len(words)
+
+
+def convert_library(db_root=DATA_DB_ROOT, remove_text=False):
+    """转换数据库中所有算子目录的文本载荷，返回转换的文件数"""
+    if not os.path.isdir(db_root):
+        raise FileNotFoundError(f"数据库目录不存在：{os.path.abspath(db_root)}")
+
+    converted, skipped = 0, 0
+    total_text, total_binary = 0, 0
+    for op_dir in sorted(os.listdir(db_root)):
+        op_path = os.path.join(db_root, op_dir)
+        if not os.path.isfile(os.path.join(op_path, "info.json")):
+            continue
+        for stem in PAYLOAD_STEMS:
+            text_path = os.path.join(op_path, stem + TEXT_SUFFIX)
+            if not os.path.exists(text_path):
+                continue
+            result = convert_payload(text_path, remove_text)
+            if result is None:
+                skipped += 1
+                continue
+            text_bytes, binary_bytes = result
+            converted += 1
+            total_text += text_bytes
+            total_binary += binary_bytes
+            print(f"已转换 {text_path}：{text_bytes} 字节 -> {binary_bytes} 字节"
+                  f"（{(binary_bytes - BINARY_HEADER.size) // WORD_BYTES} 行）")
+
+    print(f"转换完成：共转换 {converted} 个文件，跳过 {skipped} 个已是最新的文件")
+    if converted:
+        print(f"文本 {total_text / 1024:.1f} KB -> 二进制 {total_binary / 1024:.1f} KB"
+              f"（压缩为 {total_binary / total_text:.1%}）")
+    return converted
+
+
+def main():
+    convert_library(DATA_DB_ROOT, remove_text=False)
+
+
+if __name__ == "__main__":
+    main()
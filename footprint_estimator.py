@@ -0,0 +1,171 @@
+import os
+import time
+from typing import List, Dict
+from word128 import WORD_BITS, WORD_BYTES
+from operator_catalog import OperatorCatalog, WEIGHTED_OPERATORS
+from library_cache import stat_key, load_line_counts, store_line_counts
+from buffer_planner import plan_activation_buffers
+from stage1_task_generator import TASK_ALIGNMENT, load_network_structure, read_operator_library, place_tasks
+from stage2_control_generator import CONTROL_REGION_LINES, CONTROL_BLOCK_LINES
+from stage3_data_linker import SEPARATOR_COUNT, calculate_input_lines, resolve_layer_ops, load_db_catalog
+
+"""
+编译规模估算模块（试运行）：不生成镜像、不读取任何载荷文件，估算镜像大小与各部分占用
+- 算子匹配与阶段一/三相同（签名索引查表），算子信息来自算子库清单缓存（info.json）
+- 激励指令条数由 op_jili.txt 的文件大小推算（规范布局每行129字节，只做 stat 不读取内容），
+  同一算子只 stat 一次；文件大小不符合规范布局（CRLF换行、多余空白等）时读取文件逐行计数一次，
+  行数按文件状态记入算子库清单，之后的估算直接复用
+- 权重/输出数据行数取自数据库 info.json 中的 weight_data / output_data
+- 任务区按阶段一的放置引擎计算对齐填充，数据区按阶段三的布局规则累加（可选按生命周期复用激活区）
+- 输出逐层明细（任务数、指令行数、权重/输出行数）与汇总（镜像总行数、文本/打包字节数、填充开销、FIFO容量）
+"""
+
+NETWORK_PATH = "network_structure_zengliang999.json"
+OP_LIBRARY_PATH = "Op_Library"
+DATA_DB_ROOT = "Data_Library"
+# FIFO信息区可容纳的任务数（控制块中总控指令区之后的行数）
+FIFO_CAPACITY = CONTROL_BLOCK_LINES - CONTROL_REGION_LINES
+EXCITATION_NAME = "op_jili.txt"
+# 规范布局的激励文件每行字节数（128个'0'/'1'加换行符）
+TEXT_LINE_BYTES = WORD_BITS + 1
+
+
+def excitation_line_count(op_path: str, index: Dict[str, int], line_counts: Dict[str, List] = None,
+                          library_path: str = None) -> int:
+    """
+    返回算子激励的指令条数（结果记入 index，同一算子只处理一次）。
+    文件大小符合规范布局（末行换行符可缺省）时按大小推算；否则读取文件，按与阶段一相同的规则（空白分隔）计数，
+    结果按文件状态记入 line_counts（键为相对 library_path 的路径），文件未变化时直接复用。
+    """
+    count = index.get(op_path)
+    if count is None:
+        excite_path = os.path.join(op_path, EXCITATION_NAME)
+        size = os.path.getsize(excite_path)
+        if size % TEXT_LINE_BYTES in (0, TEXT_LINE_BYTES - 1):
+            count = (size + 1) // TEXT_LINE_BYTES
+        else:
+            key = os.path.relpath(excite_path, library_path) if library_path else excite_path
+            stat = stat_key(excite_path)
+            cached = line_counts.get(key) if line_counts is not None else None
+            if cached is not None and cached[0] == stat:
+                count = cached[1]
+            else:
+                with open(excite_path, "r", encoding="utf-8") as f:
+                    count = len(f.read().split())
+                if line_counts is not None:
+                    line_counts[key] = [stat, count]
+        index[op_path] = count
+    return count
+
+
+def estimate_footprint(network: List[Dict], op_catalog: OperatorCatalog, db_catalog: OperatorCatalog,
+                       alignment: int = TASK_ALIGNMENT, reuse_activations: bool = False,
+                       op_library_path: str = None) -> Dict:
+    """
+    估算整个网络的编译规模，返回 {"layers": 逐层明细, "totals": 汇总}。
+    给出 op_library_path 时，非规范布局激励文件的行数读写该算子库的清单。
+    """
+    excitation_index = {}
+    line_counts = load_line_counts(op_library_path) if op_library_path else {}
+    stored_counts = dict(line_counts)
+    layers = []
+    task_counts = []
+    for layer_idx, layer in enumerate(network, 1):
+        task_ops = resolve_layer_ops(layer, layer_idx, op_catalog)
+        data_ops = resolve_layer_ops(layer, layer_idx, db_catalog)
+        counts = [excitation_line_count(op["op_path"], excitation_index, line_counts, op_library_path)
+                  for op in task_ops]
+        task_counts.extend(counts)
+        has_weights = layer["operator"] in WEIGHTED_OPERATORS
+        layers.append({
+            "layer": layer_idx,
+            "operator": layer["operator"],
+            "tasks": len(task_ops),
+            "task_lines": sum(counts),
+            "weight_lines": sum(op.get("weight_data", 0) for op in data_ops) if has_weights else 0,
+            "output_lines": sum(op.get("output_data", 0) for op in data_ops),
+            "has_weights": has_weights,
+        })
+
+    if op_library_path and line_counts != stored_counts:
+        store_line_counts(op_library_path, line_counts)
+
+    # 任务区：与阶段一相同的对齐放置
+    _, _, task_region_lines = place_tasks(task_counts, alignment)
+    task_body_lines = sum(task_counts)
+
+    # 数据区：任务区与数据区之间5行分隔符 + 输入数据 + 逐层（权重块 + 5行分隔符）与（输出块 + 5行分隔符）
+    input_lines = calculate_input_lines(network[0]) if network else 0
+    weight_region_lines = sum(entry["weight_lines"] + SEPARATOR_COUNT for entry in layers if entry["has_weights"])
+    activation_sizes = [input_lines + SEPARATOR_COUNT] + [entry["output_lines"] + SEPARATOR_COUNT
+                                                          for entry in layers]
+    sequential_activation_lines = sum(activation_sizes)
+    activation_lines = sequential_activation_lines
+    if reuse_activations:
+        _, activation_lines = plan_activation_buffers(activation_sizes)
+    data_region_lines = SEPARATOR_COUNT + activation_lines + weight_region_lines
+
+    total_lines = CONTROL_BLOCK_LINES + task_region_lines + data_region_lines
+    totals = {
+        "tasks": len(task_counts),
+        "fifo_capacity": FIFO_CAPACITY,
+        "control_lines": CONTROL_BLOCK_LINES,
+        "task_region_lines": task_region_lines,
+        "task_body_lines": task_body_lines,
+        "padding_lines": task_region_lines - task_body_lines,
+        "alignment": alignment,
+        "input_lines": input_lines,
+        "weight_lines": sum(entry["weight_lines"] for entry in layers),
+        "output_lines": sum(entry["output_lines"] for entry in layers),
+        "activation_lines": activation_lines,
+        "sequential_activation_lines": sequential_activation_lines,
+        "data_region_lines": data_region_lines,
+        "total_lines": total_lines,
+        "text_bytes": total_lines * (WORD_BITS + 1),
+        "packed_bytes": total_lines * WORD_BYTES,
+    }
+    return {"layers": layers, "totals": totals}
+
+
+def print_footprint(report: Dict):
+    """打印逐层明细与汇总"""
+    print(f"{'层':>5} {'算子':<6} {'任务数':>6} {'指令行数':>10} {'权重行数':>10} {'输出行数':>10}")
+    for entry in report["layers"]:
+        print(f"{entry['layer']:>5} {entry['operator']:<6} {entry['tasks']:>6} {entry['task_lines']:>10} "
+              f"{entry['weight_lines']:>10} {entry['output_lines']:>10}")
+
+    totals = report["totals"]
+    padding_ratio = totals["padding_lines"] / totals["task_region_lines"] if totals["task_region_lines"] else 0
+    print(f"\n任务数：{totals['tasks']}（FIFO容量 {totals['fifo_capacity']}）")
+    if totals["tasks"] > totals["fifo_capacity"]:
+        print(f"警告：任务数超过FIFO信息区容量 {totals['fifo_capacity']}")
+    print(f"控制块：{totals['control_lines']} 行")
+    print(f"任务区：{totals['task_region_lines']} 行（指令 {totals['task_body_lines']} 行，"
+          f"对齐填充 {totals['padding_lines']} 行，占 {padding_ratio:.1%}，对齐粒度 {totals['alignment']}）")
+    print(f"数据区：{totals['data_region_lines']} 行（输入 {totals['input_lines']} 行，权重 {totals['weight_lines']} 行，"
+          f"输出 {totals['output_lines']} 行）")
+    if totals["activation_lines"] != totals["sequential_activation_lines"]:
+        print(f"  激活区复用：{totals['activation_lines']} 行（顺序存放需 {totals['sequential_activation_lines']} 行）")
+    print(f"镜像总计：{totals['total_lines']} 行，文本 {totals['text_bytes'] / 1024 / 1024:.2f} MB，"
+          f"打包 {totals['packed_bytes'] / 1024 / 1024:.2f} MB")
+
+
+def estimate_network(network_path=NETWORK_PATH, op_library_path=OP_LIBRARY_PATH, data_db_root=DATA_DB_ROOT,
+                     alignment=TASK_ALIGNMENT, reuse_activations=False):
+    """加载网络结构与两个算子库（清单缓存），估算并打印编译规模，返回估算结果"""
+    start_time = time.perf_counter()
+    network = load_network_structure(network_path)
+    op_catalog = OperatorCatalog(read_operator_library(op_library_path))
+    db_catalog = load_db_catalog(data_db_root)
+    report = estimate_footprint(network, op_catalog, db_catalog, alignment, reuse_activations, op_library_path)
+    print_footprint(report)
+    print(f"估算耗时：{(time.perf_counter() - start_time) * 1000:.1f} ms（{len(network)} 层）")
+    return report
+
+
+def main():
+    estimate_network(NETWORK_PATH, OP_LIBRARY_PATH, DATA_DB_ROOT)
+
+
+if __name__ == "__main__":
+    main()
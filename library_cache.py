@@ -0,0 +1,134 @@
+import os
+import json
+from typing import List, Dict, Optional
+
+"""
+算子库清单缓存模块：Op_Library / Data_Library 解析结果的磁盘缓存
+- 在算子库根目录的缓存子目录下维护一个清单文件（.toolchain_cache/library_manifest.json），记录每个算子目录的
+  info.json 解析结果及其文件状态（mtime_ns、size）
+- 再次运行时只对库目录和各 info.json 执行 stat，状态未变化的算子直接复用缓存，
+  仅对新增或修改过的算子目录重新解析（增量失效）
+- 库根目录的 mtime 未变化时沿用缓存中的目录列表，省去 os.listdir
+- 清单写入失败（如只读的网络存储）时仅打印警告，不影响正常加载
+- 清单中另可记录算子文件的行数（line_counts，如编译规模估算用到的非规范布局激励文件），按文件状态校验
+"""
+
+# 缓存放在子目录中，写清单只改变子目录的mtime，不会使库根目录的mtime失效
+CACHE_DIR_NAME = ".toolchain_cache"
+MANIFEST_NAME = "library_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def stat_key(path: str) -> Optional[List[int]]:
+    """返回文件状态标识 [mtime_ns, size]，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _read_manifest(manifest_path: str) -> Dict:
+    """读取清单文件，不存在或版本不符时返回空清单"""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest
+
+
+def _write_manifest(manifest_path: str, manifest: Dict):
+    """原子写入清单文件（先写临时文件再替换）"""
+    tmp_path = manifest_path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        print(f"警告：算子库清单写入失败 {manifest_path}，错误：{e}")
+
+
+def load_library(library_path: str, strict: bool = True, use_cache: bool = True) -> List[Dict]:
+    """
+    读取算子库中所有算子信息（含路径），优先使用清单缓存。
+    strict=True 时 info.json 解析失败直接抛出异常（阶段一行为），
+    否则打印警告并跳过该算子（阶段三行为）。
+    """
+    manifest_path = os.path.join(library_path, CACHE_DIR_NAME, MANIFEST_NAME)
+    manifest = _read_manifest(manifest_path) if use_cache else {}
+    cached_entries = manifest.get("entries", {})
+
+    library_stat = stat_key(library_path)
+    if manifest and manifest.get("library_stat") == library_stat:
+        op_dirs = manifest["order"]
+    else:
+        op_dirs = [d for d in os.listdir(library_path) if d != CACHE_DIR_NAME]
+
+    operators = []
+    entries = {}
+    reparsed = 0
+    for op_dir in op_dirs:
+        op_path = os.path.join(library_path, op_dir)
+        dir_stat = stat_key(op_path)
+        if dir_stat is None or not os.path.isdir(op_path):
+            continue
+        info_path = os.path.join(op_path, "info.json")
+        info_stat = stat_key(info_path)
+        cached = cached_entries.get(op_dir)
+        if cached is not None and cached["dir_stat"] == dir_stat and cached["info_stat"] == info_stat:
+            entry = cached
+        else:
+            entry = {"dir_stat": dir_stat, "info_stat": info_stat, "info": None}
+            if info_stat is not None:
+                reparsed += 1
+                try:
+                    with open(info_path, "r", encoding="utf-8") as f:
+                        entry["info"] = json.load(f)
+                except Exception as e:
+                    if strict:
+                        raise
+                    print(f"警告：读取算子信息失败 {op_path}，错误：{str(e)}")
+                    continue
+        entries[op_dir] = entry
+        if entry["info"] is None:
+            continue
+        op_info = dict(entry["info"])
+        # 记录算子路径，用于后续读取激励/权重/输出文件
+        op_info["op_path"] = op_path
+        operators.append(op_info)
+
+    if use_cache and (reparsed or entries.keys() != cached_entries.keys()
+                      or manifest.get("library_stat") != library_stat):
+        # 首次创建缓存子目录会改变库根目录mtime，因此在创建之后再取库目录状态
+        try:
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        except OSError:
+            pass
+        library_stat = stat_key(library_path)
+        _write_manifest(manifest_path, {
+            "version": MANIFEST_VERSION,
+            "library_stat": library_stat,
+            "order": list(entries.keys()),
+            "entries": entries,
+            "line_counts": manifest.get("line_counts", {}),
+        })
+    return operators
+
+
+def load_line_counts(library_path: str) -> Dict[str, List]:
+    """读取清单中记录的文件行数 {相对库根目录的路径: [文件状态, 行数]}，没有清单时返回空表"""
+    manifest = _read_manifest(os.path.join(library_path, CACHE_DIR_NAME, MANIFEST_NAME))
+    return manifest.get("line_counts", {})
+
+
+def store_line_counts(library_path: str, line_counts: Dict[str, List]):
+    """将文件行数写入清单（清单由 load_library 建立，尚不存在时不写）"""
+    manifest_path = os.path.join(library_path, CACHE_DIR_NAME, MANIFEST_NAME)
+    manifest = _read_manifest(manifest_path)
+    if not manifest:
+        return
+    manifest["line_counts"] = line_counts
+    _write_manifest(manifest_path, manifest)
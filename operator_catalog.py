@@ -0,0 +1,228 @@
+import json
+import hashlib
+from typing import List, Dict, Tuple, Optional
+
+"""
+算子目录模块：算子库索引与匹配
+- 在加载算子库时按完整匹配签名（算子类型、输入输出张量尺寸、kernel、stride、padding、
+  输出通道分片、isPrevFC）一次性建立哈希索引，之后每次匹配均为O(1)查表
+- 阶段一（Op_Library）与阶段三（Data_Library）共用同一套签名定义，保证两侧匹配逻辑一致
+- 匹配失败时给出“近似候选”（同类型算子中不匹配字段最少的几个），便于定位算子库缺失项
+- 融合算子（阶段零的融合pass生成）：ConvPool（卷积后接池化）按卷积的方式划分任务，
+  FCChain（两个相连的全连接层）按全连接的方式划分任务，签名在各自基础算子的字段之外加上被融合部分的参数
+"""
+
+# 各类算子参与匹配的字段（顺序即签名中各字段的顺序）
+CONV_FIELDS = ("input_channels", "kernel_size", "stride", "padding", "output_channels",
+               "in_W", "in_H", "out_W", "out_H")
+POOL_FIELDS = ("input_channels", "kernel_size", "stride",
+               "in_W", "in_H", "out_W", "out_H", "output_channels")
+FC_FIELDS = ("in_features", "out_features", "isPrevFC")
+CONVPOOL_FIELDS = CONV_FIELDS + ("pool_kernel_size", "pool_stride")
+FCCHAIN_FIELDS = ("in_features", "hidden_features", "out_features", "isPrevFC")
+
+SIGNATURE_FIELDS = {
+    "Conv": CONV_FIELDS,
+    "Pool": POOL_FIELDS,
+    "FC": FC_FIELDS,
+    "ConvPool": CONVPOOL_FIELDS,
+    "FCChain": FCCHAIN_FIELDS,
+}
+
+# 按输出通道划分任务的卷积类算子、按输出特征划分任务的全连接类算子（均带权重数据）
+CONV_OPERATORS = ("Conv", "ConvPool")
+FC_OPERATORS = ("FC", "FCChain")
+WEIGHTED_OPERATORS = CONV_OPERATORS + FC_OPERATORS
+
+# 近似候选的默认输出个数
+NEAR_MISS_LIMIT = 3
+
+
+def _conv_op_signature(op: Dict, op_type: str = "Conv") -> Tuple:
+    """由算子info.json计算卷积算子签名"""
+    return (op_type,
+            op["input_channels"],
+            tuple(op["kernel_size"]),
+            tuple(op["stride"]),
+            tuple(op.get("padding", [0, 0])),
+            op["output_channels"],
+            op["input_tensor_shape"][0],
+            op["input_tensor_shape"][1],
+            op["output_tensor_shape"][0],
+            op["output_tensor_shape"][1])
+
+
+def _pool_op_signature(op: Dict) -> Tuple:
+    """由算子info.json计算池化算子签名"""
+    in_shape = op.get("input_tensor_shape", [0, 0, 0])
+    out_shape = op.get("output_tensor_shape", [0, 0, 0])
+    return ("Pool",
+            op["input_channels"],
+            tuple(op["kernel_size"]),
+            tuple(op["stride"]),
+            in_shape[0],
+            in_shape[1],
+            out_shape[0],
+            out_shape[1],
+            op.get("output_channels", 0))
+
+
+def _fc_op_signature(op: Dict) -> Tuple:
+    """由算子info.json计算全连接算子签名"""
+    return ("FC",
+            op["in_features"][0],
+            op["out_features"][0],
+            op["isPrevFC"])
+
+
+def _convpool_op_signature(op: Dict) -> Tuple:
+    """由算子info.json计算卷积+池化融合算子签名（output_tensor_shape 为池化后的尺寸）"""
+    return _conv_op_signature(op, "ConvPool") + (tuple(op["pool_kernel_size"]), tuple(op["pool_stride"]))
+
+
+def _fcchain_op_signature(op: Dict) -> Tuple:
+    """由算子info.json计算全连接链融合算子签名"""
+    return ("FCChain",
+            op["in_features"][0],
+            op["hidden_features"][0],
+            op["out_features"][0],
+            op["isPrevFC"])
+
+
+OP_SIGNATURE_BUILDERS = {
+    "Conv": _conv_op_signature,
+    "Pool": _pool_op_signature,
+    "FC": _fc_op_signature,
+    "ConvPool": _convpool_op_signature,
+    "FCChain": _fcchain_op_signature,
+}
+
+
+def layer_signature(layer: Dict, target_out: Optional[int] = None) -> Tuple:
+    """
+    由网络层参数计算匹配签名。
+    target_out 为卷积/全连接层当前任务的输出通道（特征）数，池化层忽略该参数。
+    """
+    if layer["operator"] in CONV_OPERATORS:
+        padding = layer.get("padding", 0)
+        signature = (layer["operator"],
+                     layer["in_channels"],
+                     tuple(layer["kernel"]),
+                     (layer["stride"], layer["stride"]),
+                     (padding, padding),
+                     target_out,
+                     layer["in_W"],
+                     layer["in_H"],
+                     layer["out_W"],
+                     layer["out_H"])
+        if layer["operator"] == "ConvPool":
+            signature += (tuple(layer["pool_kernel"]), (layer["pool_stride"], layer["pool_stride"]))
+        return signature
+    if layer["operator"] == "Pool":
+        return ("Pool",
+                layer["in_channels"],
+                tuple(layer["kernel"]),
+                (layer["stride"], layer["stride"]),
+                layer["in_W"],
+                layer["in_H"],
+                layer["out_W"],
+                layer["out_H"],
+                layer["out_channels"])
+    if layer["operator"] == "FC":
+        return ("FC",
+                layer["in_features"],
+                target_out,
+                layer["isPrevFC"])
+    if layer["operator"] == "FCChain":
+        return ("FCChain",
+                layer["in_features"],
+                layer["hidden_features"],
+                target_out,
+                layer["isPrevFC"])
+    raise ValueError(f"不支持的算子类型：{layer['operator']}")
+
+
+class OperatorCatalog:
+    """
+    算子目录：对算子列表按匹配签名建立哈希索引。
+    同一签名存在多个算子时保留最先加载的一个，与原先线性扫描“取第一个匹配项”的行为一致。
+    """
+
+    def __init__(self, operators: List[Dict]):
+        self.operators = operators
+        self._fingerprint = None
+        self._index = {}
+        self._by_type = {}
+        for op in operators:
+            op_type = op.get("operator_type")
+            builder = OP_SIGNATURE_BUILDERS.get(op_type)
+            if builder is None:
+                continue
+            try:
+                signature = builder(op)
+            except (KeyError, IndexError, TypeError) as e:
+                print(f"警告：算子信息字段不完整，已忽略 {op.get('op_path')}，错误：{e!r}")
+                continue
+            self._index.setdefault(signature, op)
+            self._by_type.setdefault(op_type, []).append((signature, op))
+
+    def __len__(self):
+        return len(self.operators)
+
+    def fingerprint(self) -> str:
+        """
+        算子目录内容的指纹（各算子路径及info.json内容），用于增量编译判断匹配结果是否可能变化。
+        算子的增删或任一info.json的修改都会改变指纹；载荷文件内容的变化不影响匹配，由构建缓存另行按文件状态校验。
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for op in self.operators:
+                digest.update(json.dumps(op, sort_keys=True, ensure_ascii=False, default=list).encode("utf-8"))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def lookup(self, signature: Tuple) -> Optional[Dict]:
+        """按签名查找算子，未找到返回None"""
+        return self._index.get(signature)
+
+    def match_conv(self, layer: Dict, target_out_channels: int) -> Optional[Dict]:
+        """匹配卷积算子"""
+        return self._index.get(layer_signature(layer, target_out_channels))
+
+    def match_pool(self, layer: Dict) -> Optional[Dict]:
+        """匹配池化算子"""
+        return self._index.get(layer_signature(layer))
+
+    def match_fc(self, layer: Dict, target_out_features: int) -> Optional[Dict]:
+        """匹配全连接算子"""
+        return self._index.get(layer_signature(layer, target_out_features))
+
+    def near_misses(self, signature: Tuple, limit: int = NEAR_MISS_LIMIT) -> List[Tuple[Dict, List[str]]]:
+        """
+        返回与给定签名最接近的同类型算子，按不匹配字段数升序排列。
+        每项为 (算子信息, 不匹配字段名列表)。
+        """
+        op_type = signature[0]
+        fields = SIGNATURE_FIELDS[op_type]
+        candidates = []
+        for op_signature, op in self._by_type.get(op_type, []):
+            diff = [name for name, want, have in zip(fields, signature[1:], op_signature[1:]) if want != have]
+            candidates.append((len(diff), op.get("op_path", ""), op, diff))
+        candidates.sort(key=lambda item: (item[0], item[1]))
+        return [(op, diff) for _, _, op, diff in candidates[:limit]]
+
+    def describe_near_misses(self, layer: Dict, target_out: Optional[int] = None) -> str:
+        """生成匹配失败时的近似候选说明文本（附加在错误信息之后）"""
+        signature = layer_signature(layer, target_out)
+        fields = SIGNATURE_FIELDS[signature[0]]
+        misses = self.near_misses(signature)
+        if not misses:
+            return f"\n  算子库中没有任何 {signature[0]} 类型的算子"
+        wanted = dict(zip(fields, signature[1:]))
+        lines = ["\n  近似候选："]
+        for op, diff in misses:
+            have = OP_SIGNATURE_BUILDERS[signature[0]](op)
+            have = dict(zip(fields, have[1:]))
+            detail = ", ".join(f"{name}={have[name]}(需要{wanted[name]})" for name in diff)
+            lines.append(f"    {op.get('op_path', '')}：{len(diff)} 个字段不匹配 -> {detail}")
+        return "\n".join(lines)
@@ -0,0 +1,291 @@
+import os
+import mmap
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from word128 import WORD_BITS, WORD_BYTES, pack_text
+from binary_payload import (is_binary_payload, read_binary_payload, binary_line_count, binary_payload_bytes,
+                            BINARY_HEADER)
+
+"""
+载荷缓存模块：单次运行内的算子文件内容缓存
+- 以文件路径为键缓存 op_jili.txt / weight_data.txt / output_data.txt 打包为128位字后的内容
+- 同一算子目录被多个任务、多个层复用时，文件只读取、打包一次
+- 按字节预算做LRU淘汰，避免大型网络把整个算子库常驻内存
+- 流式写出时只需先知道各文件的行数来规划地址，count_words 逐行计数而不打包、不缓存文件内容
+- 数据库位于网络存储（NFS）时逐个同步读取小文件会串行累积延迟：prefetch 用线程池预先并发读取，
+  iter_words 按顺序交付文件内容的同时保持有限个读取在途，总耗时取决于带宽而非单次延迟
+- 规范布局的文本文件（每行128个'0'/'1'加换行符，共129字节，末行换行符可缺省）经 mmap 分块校验后
+  建立行数索引：行数由文件大小直接得到，写出文本镜像时整段复制文件字节，无需逐行解析、打包再还原
+- 二进制格式（.bin）的载荷直接读取打包好的字，行数取自文件头
+- 增量编译时由构建缓存登记未变化文件的行数与布局（seed_counts），这些文件不再重复统计
+- 每次实际读取文件都按路径记入 read_stats（打开次数、读取字节数），性能分析据此把读取归属到各层，
+  包括预读线程、阶段一工作进程（merge_read_stats 汇总）与阶段四写出时的读取
+"""
+
+# 默认字节预算：256MB
+DEFAULT_BYTE_BUDGET = 256 * 1024 * 1024
+# 默认并发读取线程数
+DEFAULT_IO_WORKERS = 8
+# 规范布局中每行的字节数（128位 + 换行符）
+TEXT_LINE_BYTES = WORD_BITS + 1
+# mmap 分块校验时每块的行数（约1MB）
+CANONICAL_CHECK_LINES = 8192
+# 载荷类型：规范布局的文本文件（可整段复制）/ 打包后的128位字
+PAYLOAD_TEXT = "text"
+PAYLOAD_WORDS = "words"
+
+
+def canonical_line_count(path: str) -> Optional[int]:
+    """
+    用 mmap 分块校验文件是否为规范布局（每行恰为128个'0'/'1'加换行符，末行换行符可缺省），
+    是则返回行数，否则返回None。校验只做分块的字节级比较，不构造逐行字符串。
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        has_final_newline = mm[size - 1:size] == b"\n"
+        padded_size = size if has_final_newline else size + 1
+        if padded_size % TEXT_LINE_BYTES:
+            return None
+        line_count = padded_size // TEXT_LINE_BYTES
+        chunk_bytes = CANONICAL_CHECK_LINES * TEXT_LINE_BYTES
+        for offset in range(0, size, chunk_bytes):
+            chunk = mm[offset:offset + chunk_bytes]
+            # 每行第129个字节必须是换行符，其余字节只能是'0'/'1'
+            newlines = chunk[WORD_BITS::TEXT_LINE_BYTES]
+            if newlines.count(b"\n") != len(newlines) or chunk.count(b"\n") != len(newlines):
+                return None
+            if chunk.translate(None, b"01\n"):
+                return None
+    return line_count
+
+
+def estimate_packed_bytes(path: str) -> int:
+    """根据文件大小估算打包后的字节数（文本每行 128 个字符加换行符打包为 16 字节，二进制格式即数据区大小）"""
+    try:
+        if is_binary_payload(path):
+            return binary_payload_bytes(path)
+        return os.path.getsize(path) * WORD_BYTES // (WORD_BITS + 1)
+    except OSError:
+        return 0
+
+
+class PayloadCache:
+    """带字节预算的LRU文件内容缓存（单次运行内有效，不做失效检查，可被多个读取线程共享）"""
+
+    def __init__(self, byte_budget: int = DEFAULT_BYTE_BUDGET, io_workers: int = DEFAULT_IO_WORKERS):
+        self.byte_budget = byte_budget
+        self.io_workers = io_workers
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> 打包后的字节序列
+        self._counts = {}  # path -> 行数（128位字数）
+        self._canonical = {}  # path -> 规范布局时的行数，非规范布局为None
+        self._digests = {}  # path -> 文件内容的SHA-256
+        self.read_stats = {}  # path -> [打开次数, 读取字节数]
+        self._lock = threading.Lock()
+
+    def record_read(self, path: str, nbytes: int):
+        """记录一次对文件的实际读取（供性能分析按层归属I/O）"""
+        with self._lock:
+            stats = self.read_stats.setdefault(path, [0, 0])
+            stats[0] += 1
+            stats[1] += nbytes
+
+    def merge_read_stats(self, read_stats: Dict[str, list]):
+        """并入其他缓存（如阶段一工作进程内的缓存）记录的读取"""
+        with self._lock:
+            for path, (opens, nbytes) in read_stats.items():
+                stats = self.read_stats.setdefault(path, [0, 0])
+                stats[0] += opens
+                stats[1] += nbytes
+
+    def take_read_stats(self) -> Dict[str, list]:
+        """取出并清空已记录的读取"""
+        with self._lock:
+            read_stats, self.read_stats = self.read_stats, {}
+        return read_stats
+
+    def read_words(self, path: str) -> bytes:
+        """读取'0'/'1'文本文件并打包为连续的16字节字序列（只读bytes），空行被忽略"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # 文件读取与打包在锁外进行，多个线程可同时读取不同文件
+        if is_binary_payload(path):
+            words = read_binary_payload(path)
+            self.record_read(path, BINARY_HEADER.size + len(words))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            self.record_read(path, len(text))
+            words = pack_text(text)
+
+        with self._lock:
+            self._counts[path] = len(words) // WORD_BYTES
+            if len(words) <= self.byte_budget and path not in self._entries:
+                self._entries[path] = words
+                self.used_bytes += len(words)
+                while self.used_bytes > self.byte_budget:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.used_bytes -= len(evicted)
+        return words
+
+    def canonical_count(self, path: str) -> Optional[int]:
+        """返回规范布局文本文件的行数（每个文件只校验一次），非规范布局或二进制格式返回None"""
+        with self._lock:
+            if path in self._canonical:
+                return self._canonical[path]
+        count = None
+        if not is_binary_payload(path):
+            count = canonical_line_count(path)
+            size = os.path.getsize(path)
+            if size:
+                self.record_read(path, size)
+        with self._lock:
+            self._canonical[path] = count
+        return count
+
+    def count_words(self, path: str) -> int:
+        """
+        返回文件中的128位字数（忽略空行）：文件已缓存时由内容长度得到，二进制格式由文件头得到，
+        规范布局时由文件大小得到，否则逐行计数
+        """
+        with self._lock:
+            count = self._counts.get(path)
+            if count is not None:
+                return count
+            entry = self._entries.get(path)
+        if entry is not None:
+            count = len(entry) // WORD_BYTES
+        elif is_binary_payload(path):
+            count = binary_line_count(path)
+            self.record_read(path, BINARY_HEADER.size)
+        elif self.canonical_count(path) is not None:
+            count = self._canonical[path]
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                count = sum(1 for line in f if line.strip())
+            self.record_read(path, os.path.getsize(path))
+        with self._lock:
+            self._counts[path] = count
+        return count
+
+    def digest(self, path: str) -> str:
+        """返回文件内容的SHA-256（经 mmap 分块计算，每个文件只计算一次），用于识别内容相同的载荷"""
+        with self._lock:
+            digest = self._digests.get(path)
+        if digest is not None:
+            return digest
+        sha = hashlib.sha256()
+        size = os.path.getsize(path)
+        if size:
+            self.record_read(path, size)
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                chunk_bytes = CANONICAL_CHECK_LINES * TEXT_LINE_BYTES
+                for offset in range(0, len(mm), chunk_bytes):
+                    sha.update(mm[offset:offset + chunk_bytes])
+        digest = sha.hexdigest()
+        with self._lock:
+            self._digests[path] = digest
+        return digest
+
+    def seed_counts(self, counts: Dict[str, Tuple[int, bool]]):
+        """
+        登记已知的文件行数及是否为规范布局（来自构建缓存，文件状态已校验未变化），
+        之后统计行数、预读与写出时不再读取或校验这些文件。
+        """
+        with self._lock:
+            for path, (count, canonical) in counts.items():
+                self._counts[path] = count
+                self._canonical[path] = count if canonical else None
+
+    def prefetch(self, paths: Iterable[str]) -> int:
+        """
+        用线程池并发预读一批文件（按给定顺序去重），返回预读的文件数。
+        先并发校验各文件是否为规范布局（规范布局的行数由此得到，写出时整段复制，无需打包缓存）；
+        其余文件中按估算大小在字节预算内的读取并缓存内容，超出预算的只统计行数，避免预读结果相互淘汰。
+        """
+        with self._lock:
+            pending = [path for path in dict.fromkeys(paths)
+                       if path not in self._entries and path not in self._counts]
+        if not pending:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.io_workers, len(pending)))) as executor:
+            # 逐个取结果，使读取中的异常（如文件损坏）在此处抛出
+            canonical = list(executor.map(self.canonical_count, pending))
+
+            to_read, to_count = [], []
+            reserved = self.used_bytes
+            for path, count in zip(pending, canonical):
+                if count is not None:
+                    continue
+                size = estimate_packed_bytes(path)
+                if reserved + size <= self.byte_budget:
+                    to_read.append(path)
+                    reserved += size
+                else:
+                    to_count.append(path)
+            for _ in executor.map(self.read_words, to_read):
+                pass
+            for _ in executor.map(self.count_words, to_count):
+                pass
+        return len(pending)
+
+    def _iter_ordered(self, load, paths: Iterable[str]) -> Iterator:
+        """按顺序逐个交付 load(path) 的结果，同时保持最多 io_workers 个读取在途（有界预读）"""
+        paths = iter(paths)
+        if self.io_workers <= 1:
+            for path in paths:
+                yield load(path)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.io_workers) as executor:
+            in_flight = deque()
+            for path in paths:
+                in_flight.append(executor.submit(load, path))
+                if len(in_flight) >= self.io_workers:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def iter_words(self, paths: Iterable[str]) -> Iterator[bytes]:
+        """按顺序逐个交付打包后的文件内容（有界并发预读）"""
+        return self._iter_ordered(self.read_words, paths)
+
+    def load_payload(self, path: str) -> Tuple[str, object]:
+        """
+        为写出文本镜像准备单个文件：已缓存的返回 (PAYLOAD_WORDS, 打包内容)；
+        规范布局的返回 (PAYLOAD_TEXT, 路径)，由写出方整段复制；其余读取并打包。
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None:
+            return PAYLOAD_WORDS, entry
+        if self.canonical_count(path) is not None:
+            return PAYLOAD_TEXT, path
+        return PAYLOAD_WORDS, self.read_words(path)
+
+    def iter_payloads(self, paths: Iterable[str]) -> Iterator[Tuple[str, object]]:
+        """按顺序逐个交付 load_payload 的结果（有界并发预读，校验时同时把文件页读入系统缓存）"""
+        return self._iter_ordered(self.load_payload, paths)
+
+    def read_op_file(self, op_path: str, filename: str) -> bytes:
+        """读取算子目录下的指定文件"""
+        return self.read_words(os.path.join(op_path, filename))
+
+    def summary(self) -> str:
+        """缓存命中统计（用于日志）"""
+        return (f"载荷缓存：命中 {self.hits} 次，读取 {self.misses} 次，"
+                f"占用 {self.used_bytes / 1024:.1f} KB / 预算 {self.byte_budget / 1024 / 1024:.0f} MB")
@@ -0,0 +1,142 @@
+import json
+import mmap
+import os
+from typing import List, Dict, Optional, Tuple, Iterator
+from word128 import WordBuffer, SEPARATOR_BYTES, unpack_text, unpack_hex, swap_word_bytes
+from payload_cache import PayloadCache, PAYLOAD_TEXT
+
+"""
+流水线镜像模块：各阶段之间在内存中传递的编译镜像
+- 阶段一写入地址对齐后的任务区及结构化任务表
+- 阶段二在任务区前拼接1536行控制块，并生成任务地址映射表
+- 阶段三在末尾追加数据区，并生成数据地址映射表；
+  流式模式下数据区只记录布局（各数据段的来源），写出时才逐段读取，不在内存中拼接
+  写出文本时规范布局的数据文件经 mmap 整段复制，不经过解析与打包
+- 阶段四直接在镜像上修改存储控制器地址字段
+- 中间文件仅作为可选的调试输出，完整编译只在最后写一次可执行文件
+- 可执行文件可输出为'0'/'1'文本、二进制镜像（每行16字节，无文件头，大端或小端序）
+  或十六进制文本（每行32个十六进制字符，可由 $readmemh 直接加载），均由内存中的打包字直接写出
+"""
+
+# 128bit全1分隔符的文本形式（含换行符）
+SEPARATOR_TEXT = b"1" * 128 + b"\n"
+
+# 二进制镜像的字节序
+BYTEORDER_BIG = "big"
+BYTEORDER_LITTLE = "little"
+
+# 数据区布局中的数据段类型
+SEGMENT_SEPARATORS = "separators"  # 值为全1分隔符行数
+SEGMENT_WORDS = "words"  # 值为已打包的字节序列（如随机输入数据）
+SEGMENT_FILE = "file"  # 值为'0'/'1'文本文件路径，写出时才经载荷缓存读取
+
+
+def copy_text_file(src_path: str, f) -> int:
+    """将规范布局的文本文件经 mmap 整段写入输出，缺少末尾换行符时补齐，返回读取的字节数"""
+    size = os.path.getsize(src_path)
+    if size == 0:
+        return 0
+    with open(src_path, "rb") as src, mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        f.write(mm)
+        if mm[-1:] != b"\n":
+            f.write(b"\n")
+    return size
+
+
+class PipelineImage:
+    """编译过程中的内存镜像（控制块 + 任务区 + 数据区，均为打包的128位字）"""
+
+    def __init__(self, network: List[Dict]):
+        self.network = network
+        # 完整镜像：阶段一后仅含任务区，阶段二后为控制块+任务区，阶段三后再追加数据区
+        self.words: Optional[WordBuffer] = None
+        # 任务表（阶段一生成）：每项记录层号、任务号、算子路径、任务区内起始行和指令条数
+        self.task_table: Optional[List[Dict]] = None
+        # 任务地址映射表（阶段二生成）与数据地址映射表（阶段三生成）
+        self.task_addresses: Dict = {}
+        self.data_addresses: Dict = {}
+        # 流式模式下尚未拼接进 words 的数据区布局 [(段类型, 值), ...]，以及读取数据文件用的载荷缓存
+        self.data_layout: Optional[List[Tuple[str, object]]] = None
+        self.payload_cache: Optional[PayloadCache] = None
+
+    def iter_data_segments(self) -> Iterator[bytes]:
+        """按布局逐段生成数据区内容；数据文件经载荷缓存有界并发预读，只持有少量在途的数据段"""
+        payload_cache = self.payload_cache or PayloadCache()
+        data_layout = self.data_layout or []
+        file_words = payload_cache.iter_words(value for kind, value in data_layout if kind == SEGMENT_FILE)
+        for kind, value in data_layout:
+            if kind == SEGMENT_SEPARATORS:
+                yield SEPARATOR_BYTES * value
+            elif kind == SEGMENT_WORDS:
+                yield value
+            elif kind == SEGMENT_FILE:
+                yield next(file_words)
+            else:
+                raise ValueError(f"未知的数据段类型：{kind}")
+
+    def materialize_data(self):
+        """将流式布局中的数据区拼接到 words 末尾（需要完整镜像时使用）"""
+        if self.data_layout is None:
+            return
+        for segment in self.iter_data_segments():
+            self.words.extend(segment)
+        self.data_layout = None
+
+    def write_text(self, path: str):
+        """
+        将当前镜像序列化为'0'/'1'文本文件；数据区未拼接时逐段读取并写出，内存只与最大数据段成正比。
+        规范布局的数据文件经 mmap 整段复制到输出，不做解析和打包。
+        """
+        with open(path, "wb") as f:
+            for text in self.words.iter_text():
+                f.write(text.encode("ascii"))
+            if self.data_layout is not None:
+                self._write_data_text(f)
+
+    def _write_data_text(self, f):
+        """按布局逐段写出数据区文本"""
+        payload_cache = self.payload_cache or PayloadCache()
+        payloads = payload_cache.iter_payloads(value for kind, value in self.data_layout if kind == SEGMENT_FILE)
+        for kind, value in self.data_layout:
+            if kind == SEGMENT_SEPARATORS:
+                f.write(SEPARATOR_TEXT * value)
+            elif kind == SEGMENT_WORDS:
+                for text in unpack_text(value):
+                    f.write(text.encode("ascii"))
+            elif kind == SEGMENT_FILE:
+                payload_kind, payload = next(payloads)
+                if payload_kind == PAYLOAD_TEXT:
+                    nbytes = copy_text_file(payload, f)
+                    if nbytes:
+                        payload_cache.record_read(payload, nbytes)
+                else:
+                    for text in unpack_text(payload):
+                        f.write(text.encode("ascii"))
+            else:
+                raise ValueError(f"未知的数据段类型：{kind}")
+
+    def iter_packed(self) -> Iterator[bytes]:
+        """按顺序生成整个镜像的打包字（控制+任务区，以及未拼接的数据区各段）"""
+        yield self.words.data
+        if self.data_layout is not None:
+            yield from self.iter_data_segments()
+
+    def write_binary(self, path: str, byteorder: str = BYTEORDER_BIG):
+        """将镜像写出为二进制文件（每行16字节，无文件头）；byteorder 为每个字内部的字节序"""
+        if byteorder not in (BYTEORDER_BIG, BYTEORDER_LITTLE):
+            raise ValueError(f"不支持的字节序：{byteorder}（应为 big 或 little）")
+        with open(path, "wb") as f:
+            for segment in self.iter_packed():
+                f.write(swap_word_bytes(segment) if byteorder == BYTEORDER_LITTLE else segment)
+
+    def write_hex(self, path: str):
+        """将镜像写出为十六进制文本（每行一个128位字，32个十六进制字符，$readmemh 格式）"""
+        with open(path, "w", encoding="ascii") as f:
+            for segment in self.iter_packed():
+                f.writelines(unpack_hex(segment))
+
+    @staticmethod
+    def write_json(data: Dict, path: str):
+        """保存地址映射表为JSON文件"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import resource
+except ImportError:  # 非POSIX平台没有 resource 模块，峰值内存与子进程CPU时间记为0
+    resource = None
+
+"""
+流水线性能分析模块：按阶段、按层记录耗时、内存与I/O
+- 每个区间（span）记录墙钟时间、CPU时间（含已结束的子进程，如阶段一的进程池）、结束时的峰值RSS、
+  读写字节数（/proc/self/io 的 rchar/wchar 与 read_bytes/write_bytes，仅Linux）和打开文件次数
+- 打开文件次数由审计钩子（sys.addaudithook 的 open 事件）统计，钩子在首次启用分析时安装一次
+- 各阶段通过 profile_span 打点；未启用分析时 profile_span 不做任何事，不影响正常编译
+- 区间的I/O计数只覆盖本进程在区间内完成的读写：阶段一进程池在子进程中读取 op_jili.txt，
+  阶段三只统计行数、载荷主要在阶段四写出时读取，这些读取都不在对应的层区间内。
+  因此各层的载荷I/O另行统计：各层通过 profile_layer_files 登记需要读取的文件，
+  报告的 layer_io 按载荷缓存记录的实际读取（read_stats，含工作进程与阶段四）归属到首次登记该文件的层
+- 输出JSON报告（各区间明细 + 按名称汇总），并可输出 Chrome trace 格式（chrome://tracing / Perfetto 打开）
+"""
+
+PROC_IO_PATH = "/proc/self/io"
+# /proc/self/io 中记录的计数项
+IO_COUNTER_KEYS = ("rchar", "wchar", "read_bytes", "write_bytes")
+
+_open_count = 0
+_open_hook_installed = False
+# 当前启用的分析器（由 compile_network 设置），为None时不记录
+_active_profiler = None
+# 报告中对I/O统计口径的说明
+IO_SCOPE_NOTE = ("spans 的 io/file_opens 只统计本进程在区间内的读写，不含阶段一工作进程与阶段四写出时的载荷读取；"
+                 "各层实际读取的载荷见 layer_io（按载荷缓存记录的读取归属到层）")
+
+
+def _count_open(event, args):
+    global _open_count
+    # 读取I/O计数本身打开的 /proc/self/io 不计入
+    if event == "open" and args[0] != PROC_IO_PATH:
+        _open_count += 1
+
+
+def _install_open_counter():
+    """安装统计文件打开次数的审计钩子（审计钩子无法移除，只安装一次）"""
+    global _open_hook_installed
+    if not _open_hook_installed:
+        sys.addaudithook(_count_open)
+        _open_hook_installed = True
+
+
+def read_io_counters() -> Dict[str, int]:
+    """读取当前进程的I/O计数（/proc/self/io），不支持的平台返回全0"""
+    counters = dict.fromkeys(IO_COUNTER_KEYS, 0)
+    try:
+        with open(PROC_IO_PATH, "r", encoding="ascii") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in counters:
+                    counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def cpu_seconds() -> float:
+    """本进程CPU时间加上已结束子进程的CPU时间（秒）"""
+    seconds = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        seconds += children.ru_utime + children.ru_stime
+    return seconds
+
+
+def peak_rss_kb() -> int:
+    """进程迄今为止的峰值常驻内存（KB，Linux下 ru_maxrss 的单位即KB）"""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _snapshot() -> Dict:
+    return {"wall": time.perf_counter(), "cpu": cpu_seconds(), "io": read_io_counters(), "opens": _open_count}
+
+
+class PipelineProfiler:
+    """记录各区间的耗时、内存与I/O，输出JSON报告与 Chrome trace"""
+
+    def __init__(self):
+        _install_open_counter()
+        self.spans = []
+        self.layer_files = {}  # 文件路径 -> (区间名, 层号)，同一文件归属首次登记它的层
+        self.payload_caches = []
+        self._origin = _snapshot()
+
+    def attach_payload_cache(self, payload_cache):
+        """登记记录实际读取的载荷缓存（其 read_stats 用于按层统计载荷I/O）"""
+        self.payload_caches.append(payload_cache)
+
+    def add_layer_files(self, name: str, layer: int, paths: Iterable[str]):
+        """登记某层需要读取的载荷文件"""
+        for path in paths:
+            self.layer_files.setdefault(path, (name, layer))
+
+    def layer_io(self) -> List[Dict]:
+        """按层汇总载荷缓存记录的实际读取（打开次数与读取字节数），未登记到任何层的读取归入层号为None的一项"""
+        entries = {}
+        for payload_cache in self.payload_caches:
+            for path, (opens, nbytes) in payload_cache.read_stats.items():
+                name, layer = self.layer_files.get(path, (None, None))
+                entry = entries.setdefault((name, layer), {"name": name, "layer": layer, "files": 0,
+                                                           "file_opens": 0, "bytes_read": 0})
+                entry["files"] += 1
+                entry["file_opens"] += opens
+                entry["bytes_read"] += nbytes
+        return sorted(entries.values(), key=lambda entry: (entry["name"] is None, entry["name"] or "",
+                                                           entry["layer"] or 0))
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """记录一个区间（可嵌套），args 为附加信息（如层号）"""
+        before = _snapshot()
+        try:
+            yield
+        finally:
+            after = _snapshot()
+            self.spans.append({
+                "name": name,
+                "args": args,
+                "start_ms": (before["wall"] - self._origin["wall"]) * 1000,
+                "wall_ms": (after["wall"] - before["wall"]) * 1000,
+                "cpu_ms": (after["cpu"] - before["cpu"]) * 1000,
+                "peak_rss_kb": peak_rss_kb(),
+                "io": {key: after["io"][key] - before["io"][key] for key in IO_COUNTER_KEYS},
+                "file_opens": after["opens"] - before["opens"],
+                "tid": threading.get_ident(),
+            })
+
+    def report(self) -> Dict:
+        """生成报告：各区间明细、按名称汇总，以及整个分析期间的总计"""
+        summary = {}
+        for span in self.spans:
+            entry = summary.setdefault(span["name"], {"count": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "file_opens": 0,
+                                                      "io": dict.fromkeys(IO_COUNTER_KEYS, 0)})
+            entry["count"] += 1
+            entry["wall_ms"] += span["wall_ms"]
+            entry["cpu_ms"] += span["cpu_ms"]
+            entry["file_opens"] += span["file_opens"]
+            for key in IO_COUNTER_KEYS:
+                entry["io"][key] += span["io"][key]
+
+        now = _snapshot()
+        totals = {
+            "wall_ms": (now["wall"] - self._origin["wall"]) * 1000,
+            "cpu_ms": (now["cpu"] - self._origin["cpu"]) * 1000,
+            "peak_rss_kb": peak_rss_kb(),
+            "io": {key: now["io"][key] - self._origin["io"][key] for key in IO_COUNTER_KEYS},
+            "file_opens": now["opens"] - self._origin["opens"],
+        }
+        return {"totals": totals, "summary": summary, "layer_io": self.layer_io(), "io_note": IO_SCOPE_NOTE,
+                "spans": self.spans}
+
+    def write_report(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+
+    def write_chrome_trace(self, path: str):
+        """输出 Chrome trace 格式（完整事件 ph="X"，时间单位为微秒）"""
+        pid = os.getpid()
+        layer_io = {(entry["name"], entry["layer"]): entry for entry in self.layer_io()}
+        events = []
+        for span in self.spans:
+            args = dict(span["args"])
+            args.update(cpu_ms=round(span["cpu_ms"], 3), peak_rss_kb=span["peak_rss_kb"],
+                        file_opens=span["file_opens"], **span["io"])
+            payload_io = layer_io.get((span["name"], span["args"].get("layer")))
+            if payload_io is not None:
+                args.update(payload_opens=payload_io["file_opens"], payload_bytes=payload_io["bytes_read"])
+            events.append({"name": span["name"], "ph": "X", "pid": pid, "tid": span["tid"],
+                           "ts": round(span["start_ms"] * 1000, 1), "dur": round(span["wall_ms"] * 1000, 1),
+                           "args": args})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+    def print_summary(self):
+        """打印按名称汇总的耗时"""
+        report = self.report()
+        print("\n==== 性能分析 ====")
+        for name, entry in report["summary"].items():
+            print(f"{name:<16} {entry['count']:>5} 次  墙钟 {entry['wall_ms']:>10.1f} ms  CPU {entry['cpu_ms']:>10.1f} ms  "
+                  f"读 {entry['io']['rchar'] / 1024:>10.1f} KB  写 {entry['io']['wchar'] / 1024:>10.1f} KB  "
+                  f"打开文件 {entry['file_opens']:>6} 次")
+        payload_io = {}
+        for entry in report["layer_io"]:
+            name = entry["name"] or "未归属"
+            opens, nbytes = payload_io.get(name, (0, 0))
+            payload_io[name] = (opens + entry["file_opens"], nbytes + entry["bytes_read"])
+        for name, (opens, nbytes) in payload_io.items():
+            print(f"{name:<16} 载荷读取（含工作进程与写出阶段）：{nbytes / 1024:.1f} KB，打开文件 {opens} 次")
+        totals = report["totals"]
+        print(f"总计：墙钟 {totals['wall_ms']:.1f} ms，CPU {totals['cpu_ms']:.1f} ms，峰值内存 {totals['peak_rss_kb'] / 1024:.1f} MB")
+
+
+def activate(profiler: Optional[PipelineProfiler]):
+    """设置当前启用的分析器（None 表示停用）"""
+    global _active_profiler
+    _active_profiler = profiler
+
+
+def profile_layer_files(name: str, layer: int, paths: Iterable[str]):
+    """在当前启用的分析器上登记某层需要读取的载荷文件；未启用分析时不做任何事"""
+    profiler = _active_profiler
+    if profiler is not None:
+        profiler.add_layer_files(name, layer, paths)
+
+
+@contextmanager
+def profile_span(name: str, **args):
+    """在当前启用的分析器上记录一个区间；未启用分析时不做任何事"""
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+    else:
+        with profiler.span(name, **args):
+            yield
@@ -1,70 +1,85 @@
+import os
 import onnx
 import json
+import time
+from onnx import numpy_helper
+from library_cache import load_library
+from operator_catalog import OperatorCatalog, layer_signature, CONV_OPERATORS
+
+# 融合时允许位于两个被融合节点之间的逐元素节点（融合算子内部完成，与不融合时忽略这些节点的处理一致）
+FUSION_PASS_THROUGH_OPS = ('Relu', 'BatchNormalization', 'QuantizeLinear', 'DequantizeLinear', 'Clip', 'Identity')
 
 class ONNXToNetworkStructure:
-    def __init__(self, onnx_model_path):
+    def __init__(self, onnx_model_path, load_external_data=False):
         """
         初始化转换器
 
         Args:
             onnx_model_path: ONNX模型文件路径
+            load_external_data: 是否在加载时读入外部数据文件中的权重。转换只需要图结构与shape，
+                默认不读入，权重由 get_initializer_array 在需要时按张量读取
         """
-        self.model = onnx.load(onnx_model_path)
+        self.model_path = onnx_model_path
+        # 外部数据文件的路径相对于模型文件所在目录
+        self.base_dir = os.path.dirname(os.path.abspath(onnx_model_path))
+        self.model = onnx.load(onnx_model_path, load_external_data=load_external_data)
         self.graph = self.model.graph
         self.network_structure = []
-        self.tensor_shapes = {}  # 存储中间张量的shape信息
+        self.layer_nodes = []  # 与 network_structure 一一对应的ONNX节点（融合层为其中带权重的第一个节点）
+        self.tensor_shapes = {}  # 张量名 -> shape 的索引（由 _build_shape_index 一次性建立）
+        self.initializers = {}  # 张量名 -> initializer（外部数据未读入时只含元信息）
+
+    @staticmethod
+    def _value_info_shape(value_info):
+        """从value_info（或graph的input/output）中取shape，未知维度记为-1；没有shape信息时返回None"""
+        tensor_type = value_info.type.tensor_type
+        if not tensor_type.HasField('shape'):
+            return None
+        return [dim.dim_value if dim.dim_value > 0 else -1 for dim in tensor_type.shape.dim]
+
+    def _build_shape_index(self):
+        """一次性建立 张量名 -> shape 的索引：推断出的value_info、graph的input/output，以及initializer（常量权重）"""
+        self.tensor_shapes = {}
+        for value_infos in (self.graph.value_info, self.graph.input, self.graph.output):
+            for value_info in value_infos:
+                shape = self._value_info_shape(value_info)
+                if shape is not None:
+                    self.tensor_shapes[value_info.name] = shape
+
+        # initializer的dims是确定值；旧版导出的模型中initializer也会出现在input里，已有的shape不覆盖
+        self.initializers = {}
+        for initializer in self.graph.initializer:
+            self.tensor_shapes.setdefault(initializer.name, list(initializer.dims))
+            self.initializers[initializer.name] = initializer
 
     def _get_tensor_shape(self, tensor_name):
-        """获取张量的shape"""
-        if tensor_name in self.tensor_shapes:
-            return self.tensor_shapes[tensor_name]
-
-        # 从graph的value_info中查找
-        for value_info in self.graph.value_info:
-            if value_info.name == tensor_name:
-                shape = [dim.dim_value for dim in value_info.type.tensor_type.shape.dim]
-                self.tensor_shapes[tensor_name] = shape
-                return shape
-
-        # 从graph的input中查找
-        for input_tensor in self.graph.input:
-            if input_tensor.name == tensor_name:
-                shape = [dim.dim_value for dim in input_tensor.type.tensor_type.shape.dim]
-                self.tensor_shapes[tensor_name] = shape
-                return shape
+        """获取张量的shape（查索引，找不到时返回None）"""
+        return self.tensor_shapes.get(tensor_name)
 
-        return None
+    def get_initializer_array(self, tensor_name):
+        """
+        读取某个initializer的权重数据（numpy数组），不存在时返回None。
+        外部数据只在此时读取，且只读取该张量；每次调用都重新读取，由调用方决定是否保留。
+        """
+        initializer = self.initializers.get(tensor_name)
+        if initializer is None:
+            return None
+        return numpy_helper.to_array(initializer, base_dir=self.base_dir)
 
     def _infer_shapes(self):
-        """推断所有张量的shape"""
+        """推断所有张量的shape，并建立张量名索引"""
         # 使用ONNX的shape inference
         try:
             inferred_model = onnx.shape_inference.infer_shapes(self.model)
+            # 推断结果是模型的完整副本，替换原模型以免两份initializer同时驻留内存
+            self.model = inferred_model
             self.graph = inferred_model.graph
-
-            # 提取所有tensor的shape信息
-            for value_info in self.graph.value_info:
-                if value_info.type.tensor_type.HasField('shape'):
-                    shape = [dim.dim_value if dim.dim_value > 0 else -1
-                             for dim in value_info.type.tensor_type.shape.dim]
-                    self.tensor_shapes[value_info.name] = shape
-
-            # 也提取input和output的shape
-            for input_tensor in self.graph.input:
-                if input_tensor.type.tensor_type.HasField('shape'):
-                    shape = [dim.dim_value if dim.dim_value > 0 else -1
-                             for dim in input_tensor.type.tensor_type.shape.dim]
-                    self.tensor_shapes[input_tensor.name] = shape
-
-            for output_tensor in self.graph.output:
-                if output_tensor.type.tensor_type.HasField('shape'):
-                    shape = [dim.dim_value if dim.dim_value > 0 else -1
-                             for dim in output_tensor.type.tensor_type.shape.dim]
-                    self.tensor_shapes[output_tensor.name] = shape
-
         except Exception as e:
+            # 推断失败时仍使用原模型中已有的shape信息
             print(f"Shape inference warning: {e}")
 
+        self._build_shape_index()
+
     def _parse_conv_node(self, node):
         """解析Conv节点"""
         # 获取属性
@@ -187,32 +202,139 @@ class ONNXToNetworkStructure:
 
         return None
 
-    def convert(self):
-        """执行转换"""
-        # 首先推断所有shape
-        self._infer_shapes()
+    @staticmethod
+    def _fuse_pair(first, second):
+        """
+        两个相邻层可融合时返回融合后的层信息：卷积后接池化 -> ConvPool，全连接后接全连接 -> FCChain。
+        融合算子的签名不含池化的padding，带padding的池化不融合。
+        """
+        if first["operator"] == "Conv" and second["operator"] == "Pool" and second.get("padding", 0) == 0:
+            return {
+                "operator": "ConvPool",
+                "in_W": first["in_W"],
+                "in_H": first["in_H"],
+                "in_channels": first["in_channels"],
+                "out_W": second["out_W"],
+                "out_H": second["out_H"],
+                "out_channels": first["out_channels"],
+                "kernel": first["kernel"],
+                "stride": first["stride"],
+                "padding": first["padding"],
+                "pool_kernel": second["kernel"],
+                "pool_stride": second["stride"]
+            }
+        if first["operator"] == "FC" and second["operator"] == "FC" and second["isPrevFC"]:
+            return {
+                "operator": "FCChain",
+                "isPrevFC": first["isPrevFC"],
+                "in_features": first["in_features"],
+                "hidden_features": first["out_features"],
+                "out_features": second["out_features"]
+            }
+        return None
 
-        # 遍历所有节点
+    def _feeds_directly(self, producer, consumer, consumers, graph_outputs):
+        """producer的输出是否只经过逐元素节点到达consumer，且中间结果没有其他使用者、也不是图的输出"""
+        tensor = producer.output[0]
+        while tensor not in graph_outputs:
+            users = consumers.get(tensor, [])
+            if len(users) != 1:
+                return False
+            user = users[0]
+            if user.output[0] == consumer.output[0]:
+                return True
+            if user.op_type not in FUSION_PASS_THROUGH_OPS:
+                return False
+            tensor = user.output[0]
+        return False
+
+    @staticmethod
+    def _fused_available(layer, catalogs):
+        """融合层的每个任务（每10个输出通道/特征一个任务）在所有给定的算子库中都有对应的融合算子"""
+        total_out = layer["out_channels"] if layer["operator"] in CONV_OPERATORS else layer["out_features"]
+        task_outs = [min(10, total_out - start) for start in range(0, total_out, 10)]
+        return all(catalog.lookup(layer_signature(layer, out)) is not None
+                   for catalog in catalogs for out in task_outs)
+
+    def fuse_layers(self, op_catalog, db_catalog=None):
+        """
+        算子融合pass：相邻的 Conv+MaxPool、相连的两个FC（后者 isPrevFC 为真）在数据流上直接相连，
+        且算子库（给出 db_catalog 时还包括数据库）中存在对应的融合算子时，合并为一个融合层，
+        减少任务数与中间结果在DDR中的往返。返回融合后的网络结构。
+        """
+        catalogs = [op_catalog] + ([db_catalog] if db_catalog is not None else [])
+        consumers = {}
         for node in self.graph.node:
-            layer_info = None
-
-            # 处理Conv节点（包括ConvInteger）
-            if node.op_type in ['Conv', 'ConvInteger']:
-                layer_info = self._parse_conv_node(node)
-
-            # 处理MaxPool节点
-            elif node.op_type == 'MaxPool':
-                layer_info = self._parse_pool_node(node)
+            for name in node.input:
+                consumers.setdefault(name, []).append(node)
+        graph_outputs = {output.name for output in self.graph.output}
+
+        fused_structure, fused_nodes = [], []
+        fused_count = 0
+        idx = 0
+        while idx < len(self.network_structure):
+            layer, node = self.network_structure[idx], self.layer_nodes[idx]
+            if idx + 1 < len(self.network_structure):
+                fused = self._fuse_pair(layer, self.network_structure[idx + 1])
+                if (fused is not None
+                        and self._feeds_directly(node, self.layer_nodes[idx + 1], consumers, graph_outputs)
+                        and self._fused_available(fused, catalogs)):
+                    print(f"Fused layers {idx + 1}-{idx + 2} into {fused['operator']}")
+                    fused_structure.append(fused)
+                    fused_nodes.append(node)
+                    fused_count += 1
+                    idx += 2
+                    continue
+            fused_structure.append(layer)
+            fused_nodes.append(node)
+            idx += 1
+
+        print(f"Operator fusion: {fused_count} fused layers, {len(self.network_structure)} -> "
+              f"{len(fused_structure)} layers")
+        self.network_structure, self.layer_nodes = fused_structure, fused_nodes
+        return self.network_structure
 
-            # 处理全连接层（Gemm或MatMulInteger）
-            elif node.op_type in ['Gemm', 'MatMul', 'MatMulInteger']:
-                layer_info = self._parse_fc_node(node)
+    def convert(self, op_catalog=None, db_catalog=None):
+        """
+        执行转换（单次遍历graph.node），打印节点数、提取的层数与转换耗时。
+        给出 op_catalog（算子库的 OperatorCatalog）时执行算子融合pass，见 fuse_layers。
+        """
+        start_time = time.perf_counter()
 
-            # 忽略其他类型的节点（Relu, BatchNorm, Quantize等）
+        # 首先推断所有shape
+        self._infer_shapes()
+        infer_time = time.perf_counter()
+
+        # 节点类型 -> 解析函数；忽略其他类型的节点（Relu, BatchNorm, Quantize等）
+        parsers = {
+            'Conv': self._parse_conv_node,
+            'ConvInteger': self._parse_conv_node,
+            'MaxPool': self._parse_pool_node,
+            'Gemm': self._parse_fc_node,
+            'MatMul': self._parse_fc_node,
+            'MatMulInteger': self._parse_fc_node,
+        }
 
+        # 遍历所有节点
+        node_count = 0
+        for node in self.graph.node:
+            node_count += 1
+            parser = parsers.get(node.op_type)
+            if parser is None:
+                continue
+            layer_info = parser(node)
             if layer_info:
                 self.network_structure.append(layer_info)
+                self.layer_nodes.append(node)
+
+        end_time = time.perf_counter()
+        print(f"Converted {node_count} nodes ({len(self.tensor_shapes)} tensor shapes) into "
+              f"{len(self.network_structure)} layers in {(end_time - start_time) * 1000:.1f} ms "
+              f"(shape inference {(infer_time - start_time) * 1000:.1f} ms, "
+              f"node pass {(end_time - infer_time) * 1000:.1f} ms)")
 
+        if op_catalog is not None:
+            self.fuse_layers(op_catalog, db_catalog)
         return self.network_structure
 
     def save_to_json(self, output_path):
@@ -227,12 +349,14 @@ def main():
     # 使用示例
     onnx_model_path = "Resnet640_cifar10_no_Normalize_int0810.onnx"
     output_json_path = "network_structure_output.json"
+    op_library_path = "Op_Library"
 
     # 创建转换器
     converter = ONNXToNetworkStructure(onnx_model_path)
 
-    # 执行转换0
-    network_structure = converter.convert()
+    # 执行转换（有算子库时，算子库中存在对应融合算子的相邻层会被融合；没有算子库时只做转换）
+    op_catalog = OperatorCatalog(load_library(op_library_path)) if os.path.isdir(op_library_path) else None
+    network_structure = converter.convert(op_catalog)
 
     # 打印结果
     print("Extracted Network Structure:")
@@ -1,23 +1,44 @@
 import os
+import io
 import json
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from operator_catalog import OperatorCatalog, CONV_OPERATORS, FC_OPERATORS
+from library_cache import load_library
+from payload_cache import PayloadCache
+from word128 import WordBuffer, WORD_BYTES, pack_text
+from pipeline_image import PipelineImage
+from storage_config import index_storage_configs
+from build_cache import BuildCache
+from stage2_control_generator import CONTROL_BLOCK_LINES
+from pipeline_profiler import profile_span, profile_layer_files
 
 """
 阶段一模块：任务指令划分与任务地址对齐
 - 加载网络结构配置文件，识别各层参数（卷积、池化、全连接等）
-- 读取算子库中的二进制指令配置，匹配网络层与对应算子
+- 读取算子库中的二进制指令配置，通过算子目录索引匹配网络层与对应算子
 - 按层划分任务：
     - 卷积层按输出通道数划分（每10个通道一个任务）
     - 全连接层按输出特征数划分（每10个特征一个任务）
     - 池化层固定1个任务
-- 生成原始任务指令配置文件（包含128位分隔符）
-- 进行地址对齐处理（按256的倍数对齐各任务起始地址）
-- 输出两个文件：原始版本和地址对齐版本
+- 各层的算子匹配与激励读取互不依赖，可选用进程池并行处理，再按层序拼接（结果与串行一致）
+- 生成原始任务指令配置文件（包含128位分隔符），内部以打包的128位字（WordBuffer）存储
+- 同时生成结构化任务表（层号、任务号、起始行、指令条数、算子路径），供阶段二直接使用，无需再扫描分隔符；
+  任务表中还记录每个算子激励内存储控制器配置块的位置（每个算子只索引一次），供阶段四生成地址修改表
+- 进行地址对齐处理（按256的倍数对齐各任务起始地址，对齐粒度可配置，须整除1536行的控制块）
+- 放置引擎：各任务在任务区中的存放位置可与执行顺序不同（FIFO按任务表顺序记录起始地址，执行顺序不变）。
+  由于每个任务都必须从对齐边界开始，两个任务不能共用一个对齐块，唯一可省的是最后一个任务之后无需填充，
+  因此 reorder=True 时把对齐填充最多的任务放到任务区末尾，并报告放置前后的填充开销
+- 地址对齐后的任务区写入内存镜像（PipelineImage），原始版本和地址对齐版本两个文件仅作为可选的调试输出
+- 增量编译：各层的算子路径与激励按层指纹存入构建缓存，层参数、算子库及激励文件均未变化的层直接复用，
+  只有修改过的层重新匹配、读取（地址对齐始终对全部任务重新计算）
 """
 
 
 # 常量定义
-SEPARATOR = "1" * 128  # 128bit全1分隔符
-SEPARATOR_LINES = [SEPARATOR] * 5  # 任务间固定5行分隔符
+TASK_SEPARATOR_COUNT = 5  # 任务间固定5行128bit全1分隔符
+TASK_CACHE_STAGE = "task"  # 构建缓存中阶段一产物的指纹前缀
+TASK_ALIGNMENT = 256  # 任务起始地址的对齐粒度（行）
 
 
 def load_network_structure(network_path):
@@ -31,262 +52,369 @@ def load_network_structure(network_path):
     return network
 
 
-def read_operator_library(library_path):
-    """读取算子库中所有算子信息（含路径）"""
-    operators = []
-    # 遍历算子库目录下的每个子目录（每个子目录代表一个算子）
-    for op_dir in os.listdir(library_path):
-        op_path = os.path.join(library_path, op_dir)
-        if not os.path.isdir(op_path):
-            continue
-        # 读取算子配置信息（info.json）
-        info_path = os.path.join(op_path, "info.json")
-        if not os.path.exists(info_path):
-            continue
-        with open(info_path, "r", encoding="utf-8") as f:
-            op_info = json.load(f)
-        # 记录算子路径，用于后续读取激励文件
-        op_info["op_path"] = op_path
-        operators.append(op_info)
-    return operators
-
-
-def match_conv_operator(layer, target_out_channels, operators):
-    """匹配卷积算子（按所有相关字段）"""
-    for op in operators:
-        # 基础匹配条件：算子类型、输入通道数、kernel/stride/padding
-        if op["operator_type"] != "Conv": continue
-        if op["input_channels"] != layer["in_channels"]: continue
-        if op["kernel_size"] != list(layer["kernel"]): continue
-        if op["stride"] != [layer["stride"], layer["stride"]]: continue
-        if op.get("padding", [0, 0]) != [layer.get("padding", 0), layer.get("padding", 0)]: continue
-        # 任务划分的核心：输出通道数精确匹配
-        if op["output_channels"] != target_out_channels: continue
-        # 精确匹配输入输出张量尺寸
-        if op["input_tensor_shape"][0] != layer["in_W"]: continue
-        if op["input_tensor_shape"][1] != layer["in_H"]: continue
-        if op["output_tensor_shape"][0] != layer["out_W"]: continue
-        if op["output_tensor_shape"][1] != layer["out_H"]: continue
-        return op
-    return None
-
-
-def match_pool_operator(layer, operators):
-    """匹配池化算子（按所有相关字段）"""
-    for op in operators:
-        if op["operator_type"] != "Pool": continue
-        if op["input_channels"] != layer["in_channels"]: continue
-        if op["kernel_size"] != list(layer["kernel"]): continue
-        if op["stride"] != [layer["stride"], layer["stride"]]: continue
-        if op.get("input_tensor_shape", [0, 0, 0])[0] != layer["in_W"]: continue
-        if op.get("input_tensor_shape", [0, 0, 0])[1] != layer["in_H"]: continue
-        if op.get("output_tensor_shape", [0, 0, 0])[0] != layer["out_W"]: continue
-        if op.get("output_tensor_shape", [0, 0, 0])[1] != layer["out_H"]: continue
-        if op.get("output_channels", 0) != layer["out_channels"]: continue
-        return op
-    return None
-
-
-# ================= FC SUPPORT ADDED START =================
-def match_fc_operator(layer, target_out_features, operators):
-    """匹配全连接算子"""
-    for op in operators:
-        if op["operator_type"] != "FC": continue
-        # 匹配输入特征数、isPrevFC标志 和 目标输出特征数
-        if op["in_features"][0] != layer["in_features"]: continue
-        if op["out_features"][0] != target_out_features: continue
-        if op["isPrevFC"] != layer["isPrevFC"]: continue
-        return op
-    return None
-
-
-# ================= FC SUPPORT ADDED END =================
-
-def read_operator_excitation(op_path):
-    """读取算子激励文件（op_jili.txt）内容"""
+def read_operator_library(library_path, use_cache=True):
+    """读取算子库中所有算子信息（含路径），通过清单缓存避免每次重新解析info.json"""
+    return load_library(library_path, strict=True, use_cache=use_cache)
+
+
+def read_operator_excitation(op_path, payload_cache=None):
+    """读取算子激励文件（op_jili.txt）并打包为128位字序列，传入载荷缓存时同一算子只读取一次"""
+    if payload_cache is not None:
+        return payload_cache.read_op_file(op_path, "op_jili.txt")
     excite_path = os.path.join(op_path, "op_jili.txt")
     with open(excite_path, "r", encoding="utf-8") as f:
-        return [line.rstrip("\n") for line in f.readlines()]
-
+        return pack_text(f.read())
 
-def generate_original_task_file(network, operators, output_path):
-    """生成原始任务指令配置文件（含任务划分日志）"""
-    original_lines = []
-    global_task_idx = 1  # 全局任务计数器，跨层累计
 
-    # 遍历网络结构中的每一层
-    for layer_idx, layer in enumerate(network, 1):
-        print(f"处理层 {layer_idx}: {layer}")
-
-        # 卷积层：按输出通道划分任务
-        if layer["operator"] == "Conv":
-            total_out = layer["out_channels"]
-            # 计算任务数，向上取整（例如64通道 -> (64+9)//10 = 7个任务）
-            task_count = (total_out + 9) // 10
-            print(f"  卷积层任务划分：共需 {task_count} 次任务（总输出通道 {total_out}）")
-            print(f"  任务范围：第 {global_task_idx} 到第 {global_task_idx + task_count - 1} 次任务")
-
-            # 为每个划分出的任务匹配算子
-            for task_idx in range(task_count):
-                # 计算当前任务需要处理的输出通道数（通常是10，最后一个任务可能小于10）
-                current_out = min(10, total_out - task_idx * 10)
-                matched_op = match_conv_operator(layer, current_out, operators)
-                if not matched_op:
-                    error_msg = (
-                        f"未找到匹配的卷积算子：\n"
-                        f"  算子类型：Conv，目标输出通道：{current_out}\n"
-                        f"  输入：in_W={layer['in_W']}, in_H={layer['in_H']}, in_channels={layer['in_channels']}\n"
-                        f"  输出：out_W={layer['out_W']}, out_H={layer['out_H']}\n"
-                        f"  kernel={layer['kernel']}, stride={layer['stride']}, padding={layer.get('padding', 0)}"
-                    )
-                    raise FileNotFoundError(error_msg)
-                # 读取并写入算子激励
-                excite_lines = read_operator_excitation(matched_op["op_path"])
-                original_lines.extend(excite_lines)
-                original_lines.extend(SEPARATOR_LINES)
-                global_task_idx += 1
-
-        # 池化层：固定为1次任务
-        elif layer["operator"] == "Pool":
-            task_count = 1
-            print(f"  池化层任务划分：共需 {task_count} 次任务")
-            print(f"  任务范围：第 {global_task_idx} 到第 {global_task_idx + task_count - 1} 次任务")
-
-            matched_op = match_pool_operator(layer, operators)
+def append_task(original_lines, task_table, layer_idx, task_idx, op_path, excite_lines, config_index=None):
+    """
+    将一个任务的算子激励追加到原始任务指令末尾（后接5行分隔符），并在任务表中登记该任务。
+    任务表项：layer（层号）、task（全局任务号）、op_path（算子目录）、
+    original_start（在原始任务指令中的起始行）、count（指令条数）、
+    storage_configs（存储控制器配置块在激励内的偏移及dw/work_mode，同一算子只索引一次，缓存在 config_index 中）；
+    start（在地址对齐任务区中的起始行）由地址对齐步骤填写。
+    """
+    if config_index is None:
+        config_index = {}
+    if op_path not in config_index:
+        config_index[op_path] = index_storage_configs(excite_lines)
+    entry = {
+        "layer": layer_idx,
+        "task": task_idx,
+        "op_path": op_path,
+        "original_start": len(original_lines),
+        "count": len(excite_lines) // WORD_BYTES,
+        "storage_configs": config_index[op_path],
+        "start": None,
+    }
+    task_table.append(entry)
+    original_lines.extend(excite_lines)
+    original_lines.extend_separators(TASK_SEPARATOR_COUNT)
+    return entry
+
+
+def load_layer_tasks(layer, layer_idx, catalog, first_task_idx, payload_cache):
+    """
+    划分单个网络层的任务，为每个任务匹配算子并读取算子激励（含任务划分日志）。
+    first_task_idx 为该层第一个任务的全局任务号，返回 [(算子目录, 打包后的激励), ...]。
+    各层之间互不依赖，可以并行执行。
+    """
+    layer_tasks = []
+    print(f"处理层 {layer_idx}: {layer}")
+
+    # 卷积层（含卷积+池化融合算子）：按输出通道划分任务
+    if layer["operator"] in CONV_OPERATORS:
+        total_out = layer["out_channels"]
+        # 计算任务数，向上取整（例如64通道 -> (64+9)//10 = 7个任务）
+        task_count = (total_out + 9) // 10
+        print(f"  卷积层任务划分：共需 {task_count} 次任务（总输出通道 {total_out}）")
+        print(f"  任务范围：第 {first_task_idx} 到第 {first_task_idx + task_count - 1} 次任务")
+
+        # 为每个划分出的任务匹配算子
+        for task_idx in range(task_count):
+            # 计算当前任务需要处理的输出通道数（通常是10，最后一个任务可能小于10）
+            current_out = min(10, total_out - task_idx * 10)
+            matched_op = catalog.match_conv(layer, current_out)
             if not matched_op:
                 error_msg = (
-                    f"未找到匹配的池化算子：\n"
-                    f"  算子类型：Pool\n"
+                    f"未找到匹配的卷积算子：\n"
+                    f"  算子类型：{layer['operator']}，目标输出通道：{current_out}\n"
                     f"  输入：in_W={layer['in_W']}, in_H={layer['in_H']}, in_channels={layer['in_channels']}\n"
-                    f"  输出：out_W={layer['out_W']}, out_H={layer['out_H']}, out_channels={layer['out_channels']}\n"
-                    f"  kernel={layer['kernel']}, stride={layer['stride']}"
-                )
+                    f"  输出：out_W={layer['out_W']}, out_H={layer['out_H']}\n"
+                    f"  kernel={layer['kernel']}, stride={layer['stride']}, padding={layer.get('padding', 0)}"
+                ) + catalog.describe_near_misses(layer, current_out)
                 raise FileNotFoundError(error_msg)
             # 读取并写入算子激励
-            excite_lines = read_operator_excitation(matched_op["op_path"])
-            original_lines.extend(excite_lines)
-            original_lines.extend(SEPARATOR_LINES)
-            global_task_idx += 1
-
-        # ================= FC SUPPORT ADDED START =================
-        elif layer["operator"] == "FC":
-            total_out_features = layer["out_features"]
-            # 按输出特征数划分任务，每10个为一次任务
-            task_count = (total_out_features + 9) // 10
-            print(f"  全连接层任务划分：共需 {task_count} 次任务（总输出特征 {total_out_features}）")
-            print(f"  任务范围：第 {global_task_idx} 到第 {global_task_idx + task_count - 1} 次任务")
-
-            for task_idx in range(task_count):
-                current_out = min(10, total_out_features - task_idx * 10)
-                matched_op = match_fc_operator(layer, current_out, operators)
-                if not matched_op:
-                    error_msg = (
-                        f"未找到匹配的全连接算子：\n"
-                        f"  算子类型：FC，目标输出特征：{current_out}\n"
-                        f"  输入特征：{layer['in_features']}\n"
-                        f"  isPrevFC: {layer['isPrevFC']}"
-                    )
-                    raise FileNotFoundError(error_msg)
-
-                excite_lines = read_operator_excitation(matched_op["op_path"])
-                original_lines.extend(excite_lines)
-                original_lines.extend(SEPARATOR_LINES)
-                global_task_idx += 1
-        # ================= FC SUPPORT ADDED END =================
-
-    # 写入原始文件
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(original_lines) + "\n")
-    print(f"原始总任务指令配置文件已生成: {output_path}")
-    return original_lines
-
-
-def find_tasks_in_original(original_lines):
+            excite_lines = read_operator_excitation(matched_op["op_path"], payload_cache)
+            layer_tasks.append((matched_op["op_path"], excite_lines))
+
+    # 池化层：固定为1次任务
+    elif layer["operator"] == "Pool":
+        task_count = 1
+        print(f"  池化层任务划分：共需 {task_count} 次任务")
+        print(f"  任务范围：第 {first_task_idx} 到第 {first_task_idx + task_count - 1} 次任务")
+
+        matched_op = catalog.match_pool(layer)
+        if not matched_op:
+            error_msg = (
+                f"未找到匹配的池化算子：\n"
+                f"  算子类型：Pool\n"
+                f"  输入：in_W={layer['in_W']}, in_H={layer['in_H']}, in_channels={layer['in_channels']}\n"
+                f"  输出：out_W={layer['out_W']}, out_H={layer['out_H']}, out_channels={layer['out_channels']}\n"
+                f"  kernel={layer['kernel']}, stride={layer['stride']}"
+            ) + catalog.describe_near_misses(layer)
+            raise FileNotFoundError(error_msg)
+        # 读取并写入算子激励
+        excite_lines = read_operator_excitation(matched_op["op_path"], payload_cache)
+        layer_tasks.append((matched_op["op_path"], excite_lines))
+
+    # ================= FC SUPPORT ADDED START =================
+    elif layer["operator"] in FC_OPERATORS:
+        total_out_features = layer["out_features"]
+        # 按输出特征数划分任务，每10个为一次任务
+        task_count = (total_out_features + 9) // 10
+        print(f"  全连接层任务划分：共需 {task_count} 次任务（总输出特征 {total_out_features}）")
+        print(f"  任务范围：第 {first_task_idx} 到第 {first_task_idx + task_count - 1} 次任务")
+
+        for task_idx in range(task_count):
+            current_out = min(10, total_out_features - task_idx * 10)
+            matched_op = catalog.match_fc(layer, current_out)
+            if not matched_op:
+                error_msg = (
+                    f"未找到匹配的全连接算子：\n"
+                    f"  算子类型：{layer['operator']}，目标输出特征：{current_out}\n"
+                    f"  输入特征：{layer['in_features']}\n"
+                    f"  isPrevFC: {layer['isPrevFC']}"
+                ) + catalog.describe_near_misses(layer, current_out)
+                raise FileNotFoundError(error_msg)
+
+            excite_lines = read_operator_excitation(matched_op["op_path"], payload_cache)
+            layer_tasks.append((matched_op["op_path"], excite_lines))
+    # ================= FC SUPPORT ADDED END =================
+    return layer_tasks
+
+
+def layer_task_count(layer):
+    """计算单个网络层划分出的任务数（卷积/全连接每10个输出一个任务，池化固定1个，其他算子不生成任务）"""
+    if layer["operator"] in CONV_OPERATORS:
+        return (layer["out_channels"] + 9) // 10
+    elif layer["operator"] in FC_OPERATORS:
+        return (layer["out_features"] + 9) // 10
+    elif layer["operator"] == "Pool":
+        return 1
+    return 0
+
+
+# 并行模式下工作进程内的算子索引与载荷缓存（由进程池初始化函数设置）
+_worker_catalog = None
+_worker_payload_cache = None
+
+
+def _init_layer_worker(catalog):
+    global _worker_catalog, _worker_payload_cache
+    _worker_catalog = catalog
+    _worker_payload_cache = PayloadCache()
+
+
+def _load_layer_in_worker(layer, layer_idx, first_task_idx):
+    """在工作进程中处理单层，日志先缓存为文本，由主进程按层序打印；同时交回本层实际读取文件的记录"""
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        layer_tasks = load_layer_tasks(layer, layer_idx, _worker_catalog, first_task_idx, _worker_payload_cache)
+    return log.getvalue(), layer_tasks, _worker_payload_cache.take_read_stats()
+
+
+def iter_layer_tasks_parallel(network, catalog, workers, layer_indices=None, payload_cache=None):
+    """
+    用进程池并发处理各层（layer_indices 为需要处理的层号列表，默认全部层），按层序逐层返回各层的任务列表
+    （日志也按层序打印）。某层匹配失败时，异常在轮到该层时抛出，与串行处理的报错顺序一致。
+    payload_cache 不为空时把工作进程中读取文件的记录并入其中（供性能分析统计各层I/O）。
+    """
+    first_task_indices, next_task_idx = [], 1
+    for layer in network:
+        first_task_indices.append(next_task_idx)
+        next_task_idx += layer_task_count(layer)
+
+    if layer_indices is None:
+        layer_indices = range(1, len(network) + 1)
+    layers = [network[layer_idx - 1] for layer_idx in layer_indices]
+    first_task_indices = [first_task_indices[layer_idx - 1] for layer_idx in layer_indices]
+    chunksize = max(1, len(layers) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_layer_worker, initargs=(catalog,)) as executor:
+        for log, layer_tasks, read_stats in executor.map(_load_layer_in_worker, layers, layer_indices,
+                                                         first_task_indices, chunksize=chunksize):
+            print(log, end="")
+            if payload_cache is not None:
+                payload_cache.merge_read_stats(read_stats)
+            yield layer_tasks
+
+
+def load_cached_layer_tasks(build_cache, fingerprint):
+    """从构建缓存取出一层的任务列表 [(算子目录, 打包后的激励), ...]，未命中时返回None"""
+    cached = build_cache.get(fingerprint)
+    if cached is None:
+        return None
+    data, blob = cached
+    layer_tasks, offset = [], 0
+    for op_path, count in zip(data["op_paths"], data["counts"]):
+        layer_tasks.append((op_path, blob[offset:offset + count * WORD_BYTES]))
+        offset += count * WORD_BYTES
+    return layer_tasks
+
+
+def store_layer_tasks(build_cache, fingerprint, layer_tasks):
+    """将一层的任务列表存入构建缓存，依赖文件为各任务的算子激励文件"""
+    op_paths = [op_path for op_path, _ in layer_tasks]
+    build_cache.put(
+        fingerprint,
+        files=[os.path.join(op_path, "op_jili.txt") for op_path in op_paths],
+        data={"op_paths": op_paths, "counts": [len(excite_lines) // WORD_BYTES for _, excite_lines in layer_tasks]},
+        blob=b"".join(excite_lines for _, excite_lines in layer_tasks),
+    )
+
+
+def generate_original_task_file(network, operators, output_path=None, payload_cache=None, workers=1,
+                                build_cache=None):
     """
-    在原始文件内容中识别任务边界，任务的结束标志是连续5行全'1'的分隔符。
+    生成原始任务指令配置（含任务划分日志），output_path 不为空时同时写出文件。
+    workers > 1 时用进程池并发匹配、读取各层算子，再按层序拼接，结果与串行处理逐字节一致。
+    build_cache 不为空时复用未变化层的缓存结果，只处理修改过的层，并把新结果存入缓存。
+    返回 (原始任务指令, 任务表)。
     """
-    tasks = []
-    current_start = 0
-    i = 0
-    while i < len(original_lines):
-        # 跳过文件或任务开头可能存在的全'1'行
-        while i < len(original_lines) and original_lines[i] == SEPARATOR:
-            i += 1
-        if i >= len(original_lines):
-            break
-        current_start = i
-
-        # 寻找连续5行全'1'作为任务结束的标志
-        consecutive = 0
-        j = i
-        while j < len(original_lines):
-            if original_lines[j] == SEPARATOR:
-                consecutive += 1
-                if consecutive >= 5:
-                    task_end = j - 4  # 任务内容不包括这5行分隔符
-                    tasks.append((current_start, task_end))
-                    print(f"找到任务 {len(tasks)}: 行 {current_start + 1} 到 {task_end}, 共 {task_end - current_start} 行")
-                    i = j + 1
-                    break
+    if payload_cache is None:
+        payload_cache = PayloadCache()
+    original_lines = WordBuffer()
+    task_table = []
+    config_index = {}  # 算子目录 -> 存储控制器配置索引
+    # 按匹配签名建立索引，每次匹配为O(1)查表
+    catalog = operators if isinstance(operators, OperatorCatalog) else OperatorCatalog(operators)
+
+    # 先从构建缓存取出未变化的层，其余层按层号待处理
+    fingerprints, cached_layers = {}, {}
+    if build_cache is not None:
+        catalog_fingerprint = catalog.fingerprint()
+        for layer_idx, layer in enumerate(network, 1):
+            fingerprints[layer_idx] = BuildCache.layer_fingerprint(TASK_CACHE_STAGE, layer, catalog_fingerprint)
+            layer_tasks = load_cached_layer_tasks(build_cache, fingerprints[layer_idx])
+            if layer_tasks is not None:
+                cached_layers[layer_idx] = layer_tasks
+    pending = [layer_idx for layer_idx in range(1, len(network) + 1) if layer_idx not in cached_layers]
+
+    parallel = workers > 1 and len(pending) > 1
+    if parallel:
+        pending_results = iter_layer_tasks_parallel(network, catalog, workers, pending, payload_cache)
+    else:
+        # 串行处理：生成器逐层求值，该层第一个任务号即已登记的任务数 + 1
+        pending_results = (load_layer_tasks(network[layer_idx - 1], layer_idx, catalog, len(task_table) + 1,
+                                            payload_cache)
+                           for layer_idx in pending)
+
+    # 按层序拼接各任务的算子激励
+    for layer_idx, layer in enumerate(network, 1):
+        with profile_span("stage1.layer", layer=layer_idx):
+            if layer_idx in cached_layers:
+                layer_tasks = cached_layers[layer_idx]
+                print(f"处理层 {layer_idx}: {layer}")
+                print(f"  构建缓存命中：复用 {len(layer_tasks)} 次任务的算子激励（从第 {len(task_table) + 1} 次任务开始）")
             else:
-                consecutive = 0
-            j += 1
-        else:
-            # 处理文件末尾的最后一个任务（可能没有5行分隔符结尾）
-            task_end = len(original_lines)
-            while task_end > current_start and original_lines[task_end - 1] == SEPARATOR:
-                task_end -= 1
-            if current_start < task_end:
-                tasks.append((current_start, task_end))
-                print(f"找到任务 {len(tasks)}: 行 {current_start + 1} 到 {task_end}, 共 {task_end - current_start} 行")
-            i = j
-    return tasks
-
-
-def generate_aligned_task_file(tasks, original_lines, output_path):
-    """根据找到的任务边界，生成地址对齐的文件"""
-    aligned_lines = []
+                layer_tasks = next(pending_results)
+                if build_cache is not None:
+                    store_layer_tasks(build_cache, fingerprints[layer_idx], layer_tasks)
+                profile_layer_files("stage1.layer", layer_idx,
+                                    (os.path.join(op_path, "op_jili.txt") for op_path, _ in layer_tasks))
+            for op_path, excite_lines in layer_tasks:
+                append_task(original_lines, task_table, layer_idx, len(task_table) + 1, op_path, excite_lines,
+                            config_index)
+
+    # 写入原始文件（仅在此处序列化为'0'/'1'文本）
+    if output_path:
+        original_lines.write_text(output_path)
+        print(f"原始总任务指令配置文件已生成: {output_path}")
+    if build_cache is not None:
+        print(f"构建缓存：阶段一复用 {len(cached_layers)} 层，重新生成 {len(pending)} 层")
+    if not parallel:
+        # 并行模式下激励由各工作进程读取，主进程的载荷缓存未参与
+        print(payload_cache.summary())
+    return original_lines, task_table
+
+
+def place_tasks(counts, alignment=TASK_ALIGNMENT, reorder=False):
+    """
+    规划各任务在对齐任务区中的存放位置：counts 为按执行顺序排列的各任务指令条数。
+    每个任务从 alignment 的倍数开始存放（第一个放置的任务从0开始）；reorder=True 时把对齐填充最多的任务
+    移到最后存放，省去其后的填充。返回 (存放顺序, 各任务起始行, 任务区总行数)。
+    """
+    if alignment <= 0 or CONTROL_BLOCK_LINES % alignment:
+        raise ValueError(f"对齐粒度 {alignment} 无效：须为正整数且整除控制块行数 {CONTROL_BLOCK_LINES}")
+    order = list(range(len(counts)))
+    if reorder and order:
+        # 填充最多（首个）的任务放到最后
+        last = max(order, key=lambda idx: -counts[idx] % alignment)
+        order.remove(last)
+        order.append(last)
+
+    starts = [0] * len(counts)
+    current_line = 0
+    for idx in order:
+        current_line = ((current_line + alignment - 1) // alignment) * alignment
+        starts[idx] = current_line
+        current_line += counts[idx]
+    return order, starts, current_line
+
+
+def generate_aligned_task_file(task_table, original_lines, output_path=None, alignment=TASK_ALIGNMENT, reorder=False):
+    """
+    根据任务表中记录的任务位置生成地址对齐的任务区，并回填各任务在对齐任务区中的起始行（start）。
+    alignment 为对齐粒度，reorder=True 时由放置引擎调整任务体的存放顺序（执行顺序不变）。
+    output_path 不为空时同时写出文件。
+    """
+    aligned_lines = WordBuffer()
     current_line = 0  # 当前行号，也代表地址
-
-    print(f"在原始文件中找到 {len(tasks)} 个任务，开始进行地址对齐...")
-    for task_idx, (start, end) in enumerate(tasks):
-        # 对齐处理：除了第一个任务，其他任务的起始地址都必须是256的倍数
-        if task_idx > 0:
-            # 计算下一个256倍数的地址
-            target_address = ((current_line + 255) // 256) * 256
-            # 计算需要填充的行数
-            padding = target_address - current_line
-            if padding > 0:
-                aligned_lines.extend([SEPARATOR] * padding)
-                current_line += padding
-                print(f"任务 {task_idx + 1}: 添加了 {padding} 行全1分隔符，从第 {current_line + 1} 行开始，地址为 {current_line}")
+    counts = [entry["count"] for entry in task_table]
+    order, starts, region_lines = place_tasks(counts, alignment, reorder)
+
+    print(f"任务表中共 {len(task_table)} 个任务，开始进行地址对齐...")
+    for task_idx in order:
+        entry = task_table[task_idx]
+        # 对齐处理：各任务的起始地址都必须是对齐粒度的倍数，不足处以全1分隔符填充
+        padding = starts[task_idx] - current_line
+        if padding > 0:
+            aligned_lines.extend_separators(padding)
+            current_line += padding
+            print(f"任务 {task_idx + 1}: 添加了 {padding} 行全1分隔符，从第 {current_line + 1} 行开始，地址为 {current_line}")
         else:
             print(f"任务 {task_idx + 1}: 从第 {current_line + 1} 行开始，地址为 {current_line}")
 
         # 写入任务内容
-        task_lines = original_lines[start:end]
+        start = entry["original_start"]
+        task_lines = original_lines.slice(start, start + entry["count"])
+        entry["start"] = current_line
         aligned_lines.extend(task_lines)
         current_line += len(task_lines)
         print(f"  任务 {task_idx + 1} 写入了 {len(task_lines)} 行指令")
 
+    # 报告对齐填充开销（按执行顺序存放 vs 放置引擎调整后）
+    if task_table:
+        body_lines = sum(counts)
+        in_order_padding = place_tasks(counts, alignment)[2] - body_lines
+        padding_lines = region_lines - body_lines
+        report = f"对齐填充（粒度 {alignment} 行）：{in_order_padding} 行，占任务区 {in_order_padding / (in_order_padding + body_lines):.1%}"
+        if reorder:
+            report += f"；调整存放顺序后 {padding_lines} 行，占任务区 {padding_lines / region_lines:.1%}"
+        print(report)
+
     # 保存对齐后的文件
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(aligned_lines) + "\n")
-    print(f"地址对齐的总任务指令配置文件已生成: {output_path}")
+    if output_path:
+        aligned_lines.write_text(output_path)
+        print(f"地址对齐的总任务指令配置文件已生成: {output_path}")
+    return aligned_lines
 
 
-def generate_task_instructions(network_path, library_path, original_output, aligned_output):
+def build_task_region(image, operators, payload_cache=None, original_output=None, aligned_output=None, workers=1,
+                      build_cache=None, alignment=TASK_ALIGNMENT, reorder=False):
     """
-    执行阶段一：生成原始和地址对齐的任务指令文件。
+    在内存镜像上执行阶段一：生成地址对齐的任务区并写入 image.words。
+    original_output / aligned_output 为可选的调试输出文件，workers 为并行处理各层的进程数（1为串行），
+    build_cache 为增量编译使用的构建缓存（为空时全部重新生成），
+    alignment / reorder 为任务对齐粒度及是否由放置引擎调整任务体的存放顺序。
     """
     print(f"=" * 20 + " 阶段一：生成任务指令 " + "=" * 20)
+    # 生成原始任务指令，同时得到结构化的任务表（无需再按分隔符扫描任务边界）
+    original_lines, task_table = generate_original_task_file(image.network, operators, original_output,
+                                                             payload_cache, workers, build_cache)
+
+    # 生成地址对齐的任务区，并在任务表中回填各任务的起始行
+    image.words = generate_aligned_task_file(task_table, original_lines, aligned_output, alignment, reorder)
+    image.task_table = task_table
+    return image
+
+
+def generate_task_instructions(network_path, library_path, original_output, aligned_output, payload_cache=None,
+                               workers=1):
+    """
+    执行阶段一：生成原始和地址对齐的任务指令文件。
+    """
     # 加载配置
-    network = load_network_structure(network_path)
-    operators = read_operator_library(library_path)
-    # 生成原始任务文件
-    original_lines = generate_original_task_file(network, operators, original_output)
-    # 从原始文件内容中识别任务边界
-    tasks = find_tasks_in_original(original_lines)
-
-    # 生成地址对齐的文件
-    generate_aligned_task_file(tasks, original_lines, aligned_output)
\ No newline at end of file
+    image = PipelineImage(load_network_structure(network_path))
+    catalog = OperatorCatalog(read_operator_library(library_path))
+    build_task_region(image, catalog, payload_cache, original_output, aligned_output, workers)
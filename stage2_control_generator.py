@@ -1,12 +1,15 @@
 import json
+from word128 import WordBuffer, WORD_BYTES, parse_word
+from pipeline_image import PipelineImage
+from operator_catalog import CONV_OPERATORS, FC_OPERATORS
 
 """
 阶段二模块：控制信息与FIFO管理
-- 从地址对齐的任务指令文件中提取任务边界和地址信息
+- 直接使用阶段一生成的任务表（层号、任务号、起始行、指令条数）；仅从文件读入任务区时才扫描分隔符重建任务表
 - 生成FIFO队列管理信息（包含任务起始地址和指令条数）
 - 创建1536行控制器指令配置（前512行为总控指令，513行开始为FIFO信息）
-- 将控制信息与任务指令配置合并成完整文件
-- 生成并保存任务地址映射表（task_addresses.json）
+- 将控制信息与内存镜像中的任务区合并（内部以打包的128位字存储，写文件时才序列化为文本）
+- 生成任务地址映射表（task_addresses.json），合并结果与映射表的文件输出均为可选的调试输出
 """
 
 # 全局常量：总控制器指令
@@ -17,7 +20,14 @@ total_controller_instructions = [
     "11000011000000000000000000001100110100000000000000000000000001001011010000000000000000000000000010110100000000000000000000000000",
     "10110100000000000000000000000000101101000000000000000000000000001011010000000000000000000000000011111100000000000000000000000000"
 ]
-SEPARATOR = "1" * 128
+# 控制块布局：前512行为总控指令区，其后为FIFO信息区，共1536行
+CONTROL_REGION_LINES = 512
+CONTROL_BLOCK_LINES = 1536
+# 第一行总控指令中记录FIFO信息条数的字段（第81至第96位）
+FIFO_COUNT_FIELD = (80, 95)
+# FIFO信息格式：64位(全0) + 32位(起始地址*16) + 32位(指令数)
+FIFO_ADDR_FIELD = (64, 95)
+FIFO_INSTR_COUNT_FIELD = (96, 127)
 
 
 def load_network_structure(network_path: str) -> list:
@@ -34,12 +44,12 @@ def get_task_counts_per_layer(network: list) -> list:
     """根据网络结构计算每层的任务数量"""
     task_counts = []
     for layer in network:
-        if layer["operator"] == "Conv":
-            # 卷积层按输出通道划分任务，每10个通道一个任务
+        if layer["operator"] in CONV_OPERATORS:
+            # 卷积层（含卷积+池化融合算子）按输出通道划分任务，每10个通道一个任务
             task_counts.append((layer["out_channels"] + 9) // 10)
         # ================= FC SUPPORT ADDED START =================
-        elif layer["operator"] == "FC":
-            # 全连接层按输出特征数划分任务，每10个特征一个任务
+        elif layer["operator"] in FC_OPERATORS:
+            # 全连接层（含全连接链融合算子）按输出特征数划分任务，每10个特征一个任务
             task_counts.append((layer["out_features"] + 9) // 10)
         # ================= FC SUPPORT ADDED END =================
         else:
@@ -48,7 +58,7 @@ def get_task_counts_per_layer(network: list) -> list:
     return task_counts
 
 
-def find_tasks_in_aligned_file(task_lines: list) -> list:
+def find_tasks_in_aligned_file(task_lines: WordBuffer) -> list:
     """
     在地址对齐的文件内容中查找每个任务的边界。
     由于文件已对齐，每个任务块由非分隔符行构成，块之间由分隔符行隔开。
@@ -57,7 +67,7 @@ def find_tasks_in_aligned_file(task_lines: list) -> list:
     i = 0
     while i < len(task_lines):
         # 跳过任务间的填龧分隔符
-        while i < len(task_lines) and task_lines[i] == SEPARATOR:
+        while i < len(task_lines) and task_lines.is_separator(i):
             i += 1
         if i >= len(task_lines):
             break
@@ -66,7 +76,7 @@ def find_tasks_in_aligned_file(task_lines: list) -> list:
         task_start = i
         # 寻找任务的结束行（即下一个分隔符行）
         j = i
-        while j < len(task_lines) and task_lines[j] != SEPARATOR:
+        while j < len(task_lines) and not task_lines.is_separator(j):
             j += 1
         task_end = j
         # 记录任务的（起始行号，指令条数）
@@ -75,23 +85,14 @@ def find_tasks_in_aligned_file(task_lines: list) -> list:
     return task_info
 
 
-def generate_control_module(aligned_task_file, control_task_output_file, network_path, task_address_output_file):
+def build_task_table_from_aligned(task_lines: WordBuffer, network: list) -> list:
     """
-    执行阶段二：添加控制信息和FIFO管理。
+    从地址对齐的任务区重建任务表（仅用于从文件读入任务区、没有阶段一任务表的情况）：
+    扫描分隔符得到各任务的起始行和指令条数，再按网络结构的每层任务数映射到对应层。
     """
-    print("=" * 20 + " 阶段二：生成控制模块 " + "=" * 20)
-
-    # 1. 读取地址对齐后的任务指令文件
-    with open(aligned_task_file, "r", encoding="utf-8") as f:
-        # 读取所有行并去除首尾空白，忽略空行
-        task_lines = [line.strip() for line in f.readlines() if line.strip()]
-
-    # 2. 重新分析任务指令，记录每个任务的起始行号和指令条数
     task_info = find_tasks_in_aligned_file(task_lines)
     print(f"检测到 {len(task_info)} 个任务")
 
-    # 3. 加载网络结构，用于验证任务总数并将任务映射到对应的网络层
-    network = load_network_structure(network_path)
     task_counts_per_layer = get_task_counts_per_layer(network)
     print(f"从网络结构获取到 {len(task_counts_per_layer)} 层，每层任务数: {task_counts_per_layer}")
 
@@ -100,20 +101,10 @@ def generate_control_module(aligned_task_file, control_task_output_file, network
     if len(task_info) != total_expected_tasks:
         print(f"警告: 检测到的任务数({len(task_info)})与网络结构预期的任务数({total_expected_tasks})不匹配")
 
-    # 4. 生成任务地址映射表 (task_addresses.json)
-    task_addresses = {}
+    task_table = []
     current_layer = 1
     tasks_in_current_layer = 0
     for idx, (start, count) in enumerate(task_info):
-        # 计算任务在最终文件中的绝对行号和地址
-        # 最终文件 = 1536行控制信息 + 任务指令
-        final_start_line = start + 1536 + 1  # 行号从1开始计数
-        address = final_start_line - 1  # 地址从0开始计数
-        print(f"任务 {idx + 1}: 地址对齐文件中第 {start + 1} 行, 最终文件中第 {final_start_line} 行, 地址 {address}, 指令条数 {count}")
-        print(f"  地址是否为256倍数: {address % 256 == 0}")
-
-        task_key = f"{idx + 1}_task"
-
         # 根据每层的任务数，判断当前任务属于哪一层
         if current_layer <= len(task_counts_per_layer) and tasks_in_current_layer >= task_counts_per_layer[
             current_layer - 1]:
@@ -121,59 +112,101 @@ def generate_control_module(aligned_task_file, control_task_output_file, network
             tasks_in_current_layer = 0
 
         if current_layer > len(task_counts_per_layer):
-            layer_key = f"{current_layer}_layer"
             print(f"警告: 任务 {idx + 1} 超出网络结构定义的层数({len(task_counts_per_layer)})")
-        else:
-            layer_key = f"{current_layer}_layer"
 
+        task_table.append({"layer": current_layer, "task": idx + 1, "op_path": None,
+                           "start": start, "count": count})
+        tasks_in_current_layer += 1
+    return task_table
+
+
+def build_task_addresses(task_table: list, verbose: bool = True) -> dict:
+    """根据任务表生成任务地址映射表 {层: {任务: {actual_line, origin_addr, instruction_nums}}}，verbose=True 时打印逐任务日志"""
+    task_addresses = {}
+    for entry in task_table:
+        start, count = entry["start"], entry["count"]
+        # 计算任务在最终文件中的绝对行号和地址
+        # 最终文件 = 1536行控制信息 + 任务指令
+        final_start_line = start + CONTROL_BLOCK_LINES + 1  # 行号从1开始计数
+        address = final_start_line - 1  # 地址从0开始计数
+        if verbose:
+            print(f"任务 {entry['task']}: 地址对齐文件中第 {start + 1} 行, 最终文件中第 {final_start_line} 行, 地址 {address}, 指令条数 {count}")
+            print(f"  地址是否为256倍数: {address % 256 == 0}")
+
+        layer_key = f"{entry['layer']}_layer"
+        task_key = f"{entry['task']}_task"
         if layer_key not in task_addresses:
             task_addresses[layer_key] = {}
 
         # 存储任务的关键信息：实际行号、起始地址、指令数
         task_addresses[layer_key][task_key] = {'actual_line': final_start_line, 'origin_addr': address,
                                                'instruction_nums': count}
-        tasks_in_current_layer += 1
+    return task_addresses
 
-    # 5. 生成FIFO信息
-    fifo_info = []
-    for start, count in task_info:
-        actual_start_line = start + 1536 + 1
-        # FIFO格式：64位(全0) + 32位(起始地址*16) + 32位(指令数)
-        part1 = "0" * 64
-        part2 = bin((actual_start_line - 1) * 16)[2:].zfill(32)  # 地址需乘以16
-        part3 = bin(count)[2:].zfill(32)
-        fifo_info.append(part1 + part2 + part3)
-
-    # 6. 创建1536行的控制器指令配置
-    # 修改total_controller_instructions中第一行的第81至第96位为FIFO信息条数
-    fifo_count_binary = bin(len(fifo_info))[2:].zfill(16)
-    temp_controller_instructions = total_controller_instructions[:]  # 创建副本以防修改全局变量
-    temp_controller_instructions[0] = temp_controller_instructions[0][:80] + fifo_count_binary + \
-                                      temp_controller_instructions[0][96:]
-
-    # 组装完整的1536行控制块
-    control_instructions = []
-    control_instructions.extend(temp_controller_instructions)
+
+def build_control_block(task_table: list) -> WordBuffer:
+    """生成1536行控制块：总控指令区（512行）+ FIFO信息区，FIFO信息按任务表逐项写入任务起始地址与指令条数"""
+    control_instructions = WordBuffer()
+    for line in total_controller_instructions:
+        control_instructions.append(parse_word(line))
     # 填充到512行（总控指令区）
-    while len(control_instructions) < 512:
-        control_instructions.append(SEPARATOR)
-    # 从第513行开始添加FIFO信息
-    control_instructions.extend(fifo_info)
+    control_instructions.extend_separators(CONTROL_REGION_LINES - len(control_instructions))
+    # 从第513行开始为FIFO信息（全0字，字段由下方修改表写入）
+    control_instructions.extend(bytes(WORD_BYTES * len(task_table)))
     # 继续填充到1536行
-    while len(control_instructions) < 1536:
-        control_instructions.append(SEPARATOR)
+    control_instructions.extend_separators(CONTROL_BLOCK_LINES - len(control_instructions))
+
+    # 生成FIFO信息与FIFO条数的字段修改表并批量写入
+    # 修改total_controller_instructions中第一行的第81至第96位为FIFO信息条数
+    patches = [(0, FIFO_COUNT_FIELD, len(task_table))]
+    for fifo_idx, entry in enumerate(task_table):
+        actual_start_line = entry["start"] + CONTROL_BLOCK_LINES + 1
+        line_idx = CONTROL_REGION_LINES + fifo_idx
+        patches.append((line_idx, FIFO_ADDR_FIELD, (actual_start_line - 1) * 16))  # 地址需乘以16
+        patches.append((line_idx, FIFO_INSTR_COUNT_FIELD, entry["count"]))
+    control_instructions.apply_patches(patches)
+    return control_instructions
+
+
+def build_control_module(image, control_task_output_file=None, task_address_output_file=None):
+    """
+    在内存镜像上执行阶段二：在任务区前添加控制信息和FIFO管理，并生成任务地址映射表。
+    任务的层号、起始行和指令条数直接取自阶段一生成的任务表（image.task_table）。
+    """
+    print("=" * 20 + " 阶段二：生成控制模块 " + "=" * 20)
+
+    # 1. 取出阶段一生成的地址对齐任务区
+    task_lines = image.words
 
-    # 7. 合并控制指令配置和总任务指令配置文件内容
-    new_lines = [line + "\n" for line in control_instructions] + [line + "\n" for line in task_lines]
+    # 2. 取出任务表；镜像中没有任务表时（如从文件读入任务区）才扫描分隔符重建
+    task_table = image.task_table
+    if task_table is None:
+        task_table = build_task_table_from_aligned(task_lines, image.network)
+        image.task_table = task_table
+    else:
+        print(f"任务表中共 {len(task_table)} 个任务")
 
-    # 写入新文件
-    with open(control_task_output_file, "w", encoding="utf-8") as f:
-        f.writelines(new_lines)
-    print(f"已生成 {control_task_output_file}，包含 {len(task_info)} 个任务的FIFO信息")
+    # 3. 生成任务地址映射表 (task_addresses.json)
+    task_addresses = build_task_addresses(task_table)
 
-    # 8. 保存任务指令映射表为JSON文件
-    with open(task_address_output_file, "w", encoding="utf-8") as f:
-        json.dump(task_addresses, f, indent=2, ensure_ascii=False)
+    # 4~5. 创建1536行的控制器指令配置，写入FIFO信息与FIFO条数
+    control_instructions = build_control_block(task_table)
+
+    # 6. 合并控制指令配置和总任务指令配置文件内容
+    control_instructions.extend(task_lines)
+
+    image.words = control_instructions
+    image.task_addresses = task_addresses
+    print(f"控制模块包含 {len(task_table)} 个任务的FIFO信息")
+
+    # 写入新文件（可选）
+    if control_task_output_file:
+        image.write_text(control_task_output_file)
+        print(f"已生成 {control_task_output_file}")
+
+    # 7. 保存任务指令映射表为JSON文件（可选）
+    if task_address_output_file:
+        image.write_json(task_addresses, task_address_output_file)
 
     # 打印任务指令映射表到终端
     print("\ntask_addresses = {")
@@ -188,4 +221,15 @@ def generate_control_module(aligned_task_file, control_task_output_file, network
             data_str = ", ".join([f"'{k}': {v}" for k, v in data.items()])
             print(f"    {task_key}: {{{data_str}}},")
         print(f"  }},")
-    print("}")
\ No newline at end of file
+    print("}")
+    return image
+
+
+def generate_control_module(aligned_task_file, control_task_output_file, network_path, task_address_output_file):
+    """
+    执行阶段二：添加控制信息和FIFO管理。
+    """
+    image = PipelineImage(load_network_structure(network_path))
+    # 读取地址对齐后的任务指令文件，打包为128位字并忽略空行
+    image.words = WordBuffer.from_text_file(aligned_task_file)
+    build_control_module(image, control_task_output_file, task_address_output_file)
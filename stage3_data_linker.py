@@ -2,20 +2,48 @@ import os
 import json
 import random
 from typing import List, Dict, Tuple
+from operator_catalog import OperatorCatalog, CONV_OPERATORS, FC_OPERATORS, WEIGHTED_OPERATORS
+from library_cache import load_library
+from payload_cache import PayloadCache
+from word128 import WordBuffer, pack_text_lines
+from pipeline_image import PipelineImage, SEGMENT_SEPARATORS, SEGMENT_WORDS, SEGMENT_FILE
+from binary_payload import resolve_payload_path
+from build_cache import BuildCache
+from buffer_planner import plan_activation_buffers
+from pipeline_profiler import profile_span, profile_layer_files
 
 """
 阶段三模块：数据模块链接
-- 匹配网络结构与数据库中的算子数据文件（权重、输出数据）
+- 通过算子目录索引匹配网络结构与数据库中的算子数据文件（权重、输出数据）
 - 生成第一层输入数据（随机128位二进制数据）
 - 按层链接各任务所需的权重数据和输出数据
 - 处理层间数据流：每层输入数据来自上一层输出数据
 - 生成数据地址映射表（data_addresses.json）
-- 将数据模块与任务指令文件合并，输出包含控制+任务+数据的完整配置
+- 数据区先按各文件行数规划布局与地址（不读取文件内容），再按需拼接到内存镜像的控制+任务区之后；
+  流式模式下不拼接，由最终写出时逐段读取，内存只与最大数据段成正比
+- 权重/输出数据可为文本格式（.txt）或二进制格式（.bin），同一算子目录两者都有时读取二进制格式
+- 所有层的算子匹配完成后，经载荷缓存用线程池并发预读全部权重/输出文件，逐层链接与写出时按顺序取用
+- 可选的权重去重：按内容哈希识别相同的权重文件（跨任务、跨层），每份权重在数据区只存放一次，
+  共享的任务的 weightData_addr 指向同一地址（权重只读；输出数据各任务独立，不参与去重）
+- 可选的激活缓冲区复用：网络输入与各层输出按生命周期在激活区内首次适应分配（见 buffer_planner），
+  已不再被读取的输出区域被后续层复用；激活区内只预置网络输入，其余为全1填充
+  （输出数据由硬件运行时写入，不再预置数据库中的 output_data 内容）
+- 可选的生成权重库（见 weight_generator）：由ONNX模型生成的各任务权重块按任务号替换匹配到的算子目录中的权重文件，
+  数据库中缺失的算子由生成权重库中的算子目录补齐
+- 增量编译：各层数据文件的行数按层指纹存入构建缓存，未变化的层不再统计行数，
+  地址仍逐层累加重新计算，修改某层后其后各层的数据地址自动重定位
+- 完整配置与映射表的文件输出均为可选
 """
 
 # 常量定义
-SEPARATOR = "1" * 128
-SEPARATOR_LINES = [SEPARATOR + "\n"] * 5
+SEPARATOR_COUNT = 5  # 数据块之间固定5行128bit全1分隔符
+# 算子目录中的载荷文件名（不含扩展名，.bin 二进制格式优先于 .txt 文本格式）
+WEIGHT_PAYLOAD = "weight_data"
+OUTPUT_PAYLOAD = "output_data"
+DATA_CACHE_STAGE = "data"  # 构建缓存中阶段三产物的指纹前缀
+# 生成权重库（weight_generator 的输出目录）中的清单文件与算子目录
+WEIGHT_MANIFEST_NAME = "weight_manifest.json"
+WEIGHT_LIBRARY_OPS_DIR = "ops"
 
 
 def load_network_structure(network_path: str) -> List[Dict]:
@@ -31,12 +59,12 @@ def load_network_structure(network_path: str) -> List[Dict]:
 def calculate_input_lines(first_layer: Dict) -> int:
     """计算第一层输入数据所需行数：n = ⌈in_H / 8⌉ * in_W * in_channels"""
     # 注意：此函数假设第一层为卷积或池化，对于FC层作为首层的情况需要额外适配
-    if first_layer['operator'] in ['Conv', 'Pool']:
+    if first_layer['operator'] in CONV_OPERATORS + ('Pool',):
         in_H, in_W, in_channels = first_layer["in_H"], first_layer["in_W"], first_layer["in_channels"]
         # 向上取整
         return ((in_H + 7) // 8) * in_W * in_channels
     # 为FC层作为首层预留逻辑
-    elif first_layer['operator'] == 'FC':
+    elif first_layer['operator'] in FC_OPERATORS:
         # 这里的计算逻辑需要根据硬件如何接收一维向量来确定
         # 暂时假设每行128bit，每个特征8bit
         in_features = first_layer['in_features']
@@ -44,166 +72,191 @@ def calculate_input_lines(first_layer: Dict) -> int:
     return 0
 
 
-def generate_random_input(n: int) -> List[str]:
-    """生成n行128bit随机01二进制数据（作为输入数据块）"""
-    return [''.join(random.choices(['0', '1'], k=128)) + "\n" for _ in range(n)]
-
-
-def match_conv_db_operator(layer, target_out_channels, operators):
-    """在数据库中匹配一个卷积算子（逻辑与stage1一致）"""
-    for op in operators:
-        if op["operator_type"] != "Conv": continue
-        if op["input_channels"] != layer["in_channels"]: continue
-        if op["kernel_size"] != list(layer["kernel"]): continue
-        if op["stride"] != [layer["stride"], layer["stride"]]: continue
-        if op.get("padding", [0, 0]) != [layer.get("padding", 0), layer.get("padding", 0)]: continue
-        if op["output_channels"] != target_out_channels: continue
-        if op["input_tensor_shape"][0] != layer["in_W"]: continue
-        if op["input_tensor_shape"][1] != layer["in_H"]: continue
-        if op["output_tensor_shape"][0] != layer["out_W"]: continue
-        if op["output_tensor_shape"][1] != layer["out_H"]: continue
-        return op
-    return None
-
-
-def match_pool_db_operator(layer, operators):
-    """在数据库中匹配一个池化算子（逻辑与stage1一致）"""
-    for op in operators:
-        if op["operator_type"] != "Pool": continue
-        if op["input_channels"] != layer["in_channels"]: continue
-        if op["kernel_size"] != list(layer["kernel"]): continue
-        if op["stride"] != [layer["stride"], layer["stride"]]: continue
-        if op.get("input_tensor_shape", [0, 0, 0])[0] != layer["in_W"]: continue
-        if op.get("input_tensor_shape", [0, 0, 0])[1] != layer["in_H"]: continue
-        if op.get("output_tensor_shape", [0, 0, 0])[0] != layer["out_W"]: continue
-        if op.get("output_tensor_shape", [0, 0, 0])[1] != layer["out_H"]: continue
-        if op.get("output_channels", 0) != layer["out_channels"]: continue
-        return op
-    return None
-
-# ================= FC SUPPORT ADDED START =================
-def match_fc_db_operator(layer, target_out_features, operators):
-    """在数据库中匹配一个全连接算子（逻辑与stage1一致）"""
-    for op in operators:
-        if op["operator_type"] != "FC": continue
-        if op["in_features"][0] != layer["in_features"]: continue
-        if op["out_features"][0] != target_out_features: continue
-        if op["isPrevFC"] != layer["isPrevFC"]: continue
-        return op
-    return None
-# ================= FC SUPPORT ADDED END =================
-
-
-def read_db_operators(db_root: str) -> List[Dict]:
-    """读取数据库中所有算子信息（含路径），类似stage1中的read_operator_library"""
-    operators = []
-    for op_dir in os.listdir(db_root):
-        op_path = os.path.join(db_root, op_dir)
-        if not os.path.isdir(op_path): continue
-        info_path = os.path.join(op_path, "info.json")
-        if not os.path.exists(info_path): continue
-        try:
-            with open(info_path, "r", encoding="utf-8") as f:
-                op_info = json.load(f)
-            # 记录算子路径，用于后续读取权重和输出文件
-            op_info["op_path"] = op_path
-            operators.append(op_info)
-        except Exception as e:
-            print(f"警告：读取算子信息失败 {op_path}，错误：{str(e)}")
-    return operators
-
-
-def link_layer_data(layer: Dict, layer_idx: int, db_operators: List[Dict], current_line: int, task_counter: int) -> \
-Tuple[List[str], List[Dict], Dict, int, int]:
-    """
-    链接一层中所有任务的数据（权重/输出），记录地址，并返回生成的数据内容。
-    """
-    data_content = []
-    task_records = []
-    layer_addresses = {}
+def generate_random_input(n: int) -> bytes:
+    """生成n行128bit随机01二进制数据（作为输入数据块），返回打包后的128位字序列"""
+    return pack_text_lines(''.join(random.choices(['0', '1'], k=128)) for _ in range(n))
+
+
+def read_db_operators(db_root: str, use_cache: bool = True) -> List[Dict]:
+    """读取数据库中所有算子信息（含路径），与stage1共用清单缓存，解析失败的算子仅警告并跳过"""
+    return load_library(db_root, strict=False, use_cache=use_cache)
 
+
+def resolve_layer_ops(layer: Dict, layer_idx: int, db_catalog: OperatorCatalog) -> List[Dict]:
+    """为一层中的每个任务匹配数据库中的算子，返回按任务顺序排列的算子信息列表"""
     # --- 统一确定该层的任务数量 ---
     task_count = 1
-    if layer["operator"] == "Conv":
+    if layer["operator"] in CONV_OPERATORS:
         task_count = (layer["out_channels"] + 9) // 10
         total_out = layer.get("out_channels", 0)
     # ================= FC SUPPORT ADDED START =================
-    elif layer["operator"] == "FC":
+    elif layer["operator"] in FC_OPERATORS:
         task_count = (layer["out_features"] + 9) // 10
         total_out = layer.get("out_features", 0)
     # ================= FC SUPPORT ADDED END =================
 
-    # --- 步骤1: 统一收集该层所有任务的权重和输出数据 ---
-    weight_lines_all = []
-    output_lines_all = []
-    task_op_info = []  # 用于存储每个任务匹配到的算子信息
-
+    matched_ops = []
     for task_idx in range(task_count):
         # 匹配数据库中的算子
         matched_op = None
-        if layer["operator"] == "Conv":
+        current_out = None
+        if layer["operator"] in CONV_OPERATORS:
             current_out = min(10, total_out - task_idx * 10)
-            matched_op = match_conv_db_operator(layer, current_out, db_operators)
+            matched_op = db_catalog.match_conv(layer, current_out)
         elif layer["operator"] == "Pool":
-            matched_op = match_pool_db_operator(layer, db_operators)
+            matched_op = db_catalog.match_pool(layer)
         # ================= FC SUPPORT ADDED START =================
-        elif layer["operator"] == "FC":
+        elif layer["operator"] in FC_OPERATORS:
             current_out = min(10, total_out - task_idx * 10)
-            matched_op = match_fc_db_operator(layer, current_out, db_operators)
+            matched_op = db_catalog.match_fc(layer, current_out)
         # ================= FC SUPPORT ADDED END =================
 
         if not matched_op:
             error_details = (f"层{layer_idx}任务{task_idx + 1}未找到匹配算子\n"
                              f"网络层信息：{json.dumps(layer, indent=2)}\n")
-            raise FileNotFoundError(error_details)
+            raise FileNotFoundError(error_details + db_catalog.describe_near_misses(layer, current_out))
+        matched_ops.append(matched_op)
+    return matched_ops
+
+
+def resolve_weight_paths(layer: Dict, layer_idx: int, matched_ops: List[Dict], first_task: int,
+                         weight_blocks: Dict = None) -> List[str]:
+    """
+    返回一层各任务的权重文件路径（池化层没有权重，返回空列表）。
+    first_task 为该层之前的任务总数；weight_blocks 中登记了的任务（按全局任务号）使用生成的权重块。
+    """
+    if layer["operator"] not in WEIGHTED_OPERATORS:
+        return []
+    overrides = (weight_blocks or {}).get(f"{layer_idx}_layer", {})
+    return [overrides.get(f"{first_task + task_idx + 1}_task") or resolve_payload_path(op["op_path"], WEIGHT_PAYLOAD)
+            for task_idx, op in enumerate(matched_ops)]
+
+
+def layer_payload_paths(layer: Dict, matched_ops: List[Dict], weight_paths: List[str] = None) -> List[str]:
+    """返回一层各任务需要读取的数据文件路径（按布局顺序：先全部权重，再全部输出）"""
+    paths = []
+    if weight_paths is not None:
+        paths.extend(weight_paths)
+    elif layer["operator"] in WEIGHTED_OPERATORS:
+        paths.extend(resolve_payload_path(op["op_path"], WEIGHT_PAYLOAD) for op in matched_ops)
+    paths.extend(resolve_payload_path(op["op_path"], OUTPUT_PAYLOAD) for op in matched_ops)
+    return paths
+
+
+class WeightBlockIndex:
+    """权重去重索引：权重文件内容哈希 -> 数据区中已存放的权重块地址，并统计节省的行数"""
+
+    def __init__(self, payload_cache: PayloadCache):
+        self.payload_cache = payload_cache
+        self.blocks = {}
+        self.shared_tasks = 0
+        self.saved_lines = 0
+
+    def lookup(self, path: str) -> Tuple[str, int]:
+        """返回 (内容哈希, 已存放的地址)，内容未出现过时地址为None"""
+        digest = self.payload_cache.digest(path)
+        return digest, self.blocks.get(digest)
+
+    def summary(self) -> str:
+        saved_bytes = self.saved_lines * 16
+        return (f"权重去重：{len(self.blocks)} 份不同的权重块，{self.shared_tasks} 个任务复用已有权重，"
+                f"节省 {self.saved_lines} 行（{saved_bytes / 1024:.1f} KB）")
+
+
+def link_layer_data(layer: Dict, layer_idx: int, db_catalog: OperatorCatalog, current_line: int, task_counter: int,
+                    payload_cache: PayloadCache, matched_ops: List[Dict] = None,
+                    weight_index: WeightBlockIndex = None, output_addr: int = None, weight_paths: List[str] = None
+                    ) -> Tuple[List[Tuple[str, object]], List[Dict], Dict, int, int]:
+    """
+    链接一层中所有任务的数据（权重/输出），记录地址，并返回该层数据区的布局（数据段列表）。
+    此处只经载荷缓存统计各文件的行数，文件内容在拼接或写出数据区时才读取。
+    matched_ops 为已匹配好的各任务算子（为空时在此匹配）；
+    weight_index 不为空时内容已存放过的权重不再写入，任务的权重地址指向已有的权重块；
+    output_addr 不为空时该层输出位于激活区中已分配的地址，输出数据不写入该层的布局；
+    weight_paths 不为空时为各任务的权重文件路径（见 resolve_weight_paths），否则取匹配算子目录中的权重文件。
+    """
+    layer_layout = []
+    task_records = []
+    layer_addresses = {}
 
+    if matched_ops is None:
+        matched_ops = resolve_layer_ops(layer, layer_idx, db_catalog)
+    task_count = len(matched_ops)
+
+    # --- 步骤1: 统一收集该层所有任务的权重和输出数据 ---
+    weight_files, weight_line_counts = [], []
+    output_files, output_lines_total = [], 0
+    task_op_info = []  # 用于存储每个任务匹配到的算子信息
+
+    for task_idx, matched_op in enumerate(matched_ops):
+        # 算子目录索引中已包含info.json的内容，无需重复读取
         op_path = matched_op["op_path"]
-        with open(os.path.join(op_path, "info.json"), 'r', encoding='utf-8') as f:
-            op_info = json.load(f)
+        op_info = matched_op
         task_op_info.append(op_info)
 
         # 读取权重数据（卷积层和全连接层）
-        if layer["operator"] in ["Conv", "FC"]:
-            weight_path = os.path.join(op_path, "weight_data.txt")
+        if layer["operator"] in WEIGHTED_OPERATORS:
+            library_weight_path = resolve_payload_path(op_path, WEIGHT_PAYLOAD)
+            weight_path = weight_paths[task_idx] if weight_paths is not None else library_weight_path
             if not os.path.exists(weight_path):
                 raise FileNotFoundError(f"权重文件缺失：{weight_path}")
-            with open(weight_path, "r", encoding="utf-8") as f:
-                weight_lines = [line if line.endswith("\n") else line + "\n" for line in f.readlines()]
-            if len(weight_lines) != op_info["weight_data"]:
+            weight_line_count = payload_cache.count_words(weight_path)
+            # 生成的权重块替换了算子目录中的权重，地址仍按info.json的行数布局，行数不符时必然覆盖相邻数据
+            if weight_path != library_weight_path and weight_line_count != op_info["weight_data"]:
+                raise ValueError(f"层{layer_idx}任务{task_idx + 1}的生成权重块行数({weight_line_count})与匹配算子 "
+                                 f"{op_path} 的 weight_data({op_info['weight_data']})不一致：{weight_path}")
+            if weight_line_count != op_info["weight_data"]:
                 print(
-                    f"警告：层{layer_idx}任务{task_idx + 1}的权重文件行数({len(weight_lines)})与info.json中记录的行数({op_info['weight_data']})不一致。")
-            weight_lines_all.extend(weight_lines)
+                    f"警告：层{layer_idx}任务{task_idx + 1}的权重文件行数({weight_line_count})与info.json中记录的行数({op_info['weight_data']})不一致。")
+            weight_files.append(weight_path)
+            weight_line_counts.append(weight_line_count)
 
         # 读取输出数据
-        output_path = os.path.join(op_path, "output_data.txt")
+        output_path = resolve_payload_path(op_path, OUTPUT_PAYLOAD)
         if not os.path.exists(output_path):
             raise FileNotFoundError(f"输出数据文件缺失：{output_path}")
-        with open(output_path, "r", encoding="utf-8") as f:
-            output_lines = [line if line.endswith("\n") else line + "\n" for line in f.readlines()]
-        if len(output_lines) != op_info["output_data"]:
+        output_line_count = payload_cache.count_words(output_path)
+        if output_line_count != op_info["output_data"]:
             print(
-                f"警告：层{layer_idx}任务{task_idx + 1}的输出文件行数({len(output_lines)})与info.json中记录的行数({op_info['output_data']})不一致。")
-        output_lines_all.extend(output_lines)
-
-    # --- 步骤2: 将收集到的数据块写入内容列表，并计算地址 ---
-    # 写入权重数据块
-    weight_start_addr = 0
-    if layer["operator"] in ["Conv", "FC"]:
+                f"警告：层{layer_idx}任务{task_idx + 1}的输出文件行数({output_line_count})与info.json中记录的行数({op_info['output_data']})不一致。")
+        output_files.append(output_path)
+        output_lines_total += output_line_count
+
+    # --- 步骤2: 将收集到的数据块加入布局，并计算地址 ---
+    # 权重数据块：各任务的权重地址按info.json记录的行数依次累加；去重时已存放过的权重直接复用其地址
+    task_weight_addrs = []
+    if layer["operator"] in WEIGHTED_OPERATORS:
         weight_start_addr = current_line
-        data_content.extend(weight_lines_all)
-        current_line += len(weight_lines_all)
-        data_content.extend(SEPARATOR_LINES)
-        current_line += 5
-
-    # 写入输出数据块
-    output_start_addr = current_line
-    data_content.extend(output_lines_all)
-    current_line += len(output_lines_all)
-    data_content.extend(SEPARATOR_LINES)
-    current_line += 5
+        weight_offset = 0
+        for task_idx, weight_path in enumerate(weight_files):
+            digest = None
+            if weight_index is not None:
+                digest, shared_addr = weight_index.lookup(weight_path)
+                if shared_addr is not None:
+                    task_weight_addrs.append(shared_addr)
+                    weight_index.shared_tasks += 1
+                    weight_index.saved_lines += weight_line_counts[task_idx]
+                    continue
+            task_weight_addrs.append(weight_start_addr + weight_offset)
+            if digest is not None:
+                weight_index.blocks[digest] = weight_start_addr + weight_offset
+            layer_layout.append((SEGMENT_FILE, weight_path))
+            weight_offset += task_op_info[task_idx].get("weight_data", 0)
+            current_line += weight_line_counts[task_idx]
+        layer_layout.append((SEGMENT_SEPARATORS, SEPARATOR_COUNT))
+        current_line += SEPARATOR_COUNT
+
+    # 输出数据块（激活区复用时位于已分配的地址）
+    if output_addr is not None:
+        output_start_addr = output_addr
+    else:
+        output_start_addr = current_line
+        layer_layout.extend((SEGMENT_FILE, path) for path in output_files)
+        current_line += output_lines_total
+        layer_layout.append((SEGMENT_SEPARATORS, SEPARATOR_COUNT))
+        current_line += SEPARATOR_COUNT
 
     # --- 步骤3: 为该层的每个任务分别计算并填充地址映射 ---
-    weight_offset = 0
     output_offset = 0
     for task_idx in range(task_count):
         op_info = task_op_info[task_idx]
@@ -211,10 +264,9 @@ Tuple[List[str], List[Dict], Dict, int, int]:
 
         task_weight_addr = 0
         weight_lines = 0
-        if layer["operator"] in ["Conv", "FC"]:
-            task_weight_addr = weight_start_addr + weight_offset
+        if layer["operator"] in WEIGHTED_OPERATORS:
+            task_weight_addr = task_weight_addrs[task_idx]
             weight_lines = op_info.get("weight_data", 0)
-            weight_offset += weight_lines
 
         task_output_addr = output_start_addr + output_offset
         output_lines = op_info.get("output_data", 0)
@@ -236,57 +288,120 @@ Tuple[List[str], List[Dict], Dict, int, int]:
             "output_start": task_output_addr
         })
 
-    return data_content, task_records, layer_addresses, current_line, task_counter + task_count
+    return layer_layout, task_records, layer_addresses, current_line, task_counter + task_count
+
 
+def store_layer_counts(build_cache: BuildCache, fingerprint: str, paths: List[str], payload_cache: PayloadCache):
+    """将一层各数据文件的行数及是否为规范布局存入构建缓存（均已由载荷缓存统计过，不再读取文件）"""
+    payloads = {path: [payload_cache.count_words(path), payload_cache.canonical_count(path) is not None]
+                for path in paths}
+    build_cache.put(fingerprint, files=paths, data={"payloads": payloads})
 
-def process_data_module(network: List[Dict], task_file_path: str, db_operators: List[Dict]) -> Tuple[
-    List[str], Dict, List[Dict]]:
-    """处理整个数据模块的生成：生成输入数据 + 链接各层数据 + 生成地址映射"""
-    # 读取任务指令文件内容（作为基础）
-    with open(task_file_path, "r", encoding="utf-8") as f:
-        task_content = f.readlines()
-    task_lines_count = len(task_content)
 
-    # 初始化数据内容（从任务指令末尾开始）
-    data_content = []
+def plan_data_module(network: List[Dict], task_lines_count: int, db_catalog: OperatorCatalog,
+                     payload_cache: PayloadCache, build_cache: BuildCache = None, dedup_weights: bool = False,
+                     reuse_activations: bool = False, weight_blocks: Dict = None
+                     ) -> Tuple[List[Tuple[str, object]], Dict, List[Dict]]:
+    """
+    规划整个数据模块：生成输入数据 + 链接各层数据 + 生成地址映射，返回 (数据区布局, 地址映射, 日志记录)。
+    task_lines_count 为数据区之前控制块与任务区的总行数，数据区地址从其后开始计算。
+    build_cache 不为空时复用未变化层的数据文件行数，只统计修改过的层，并把新结果存入缓存；
+    dedup_weights=True 时内容相同的权重在数据区只存放一次；
+    reuse_activations=True 时网络输入与各层输出按生命周期复用激活区，数据区只需峰值大小的激活空间；
+    weight_blocks 为生成权重库的各任务权重块（见 load_weight_library），登记了的任务使用生成的权重。
+    """
+    # 初始化数据区布局（从任务指令末尾开始）
+    data_layout = []
     # 添加任务模块与数据模块的分隔符
-    data_content.extend(SEPARATOR_LINES)
-    current_line = task_lines_count + 5
+    data_layout.append((SEGMENT_SEPARATORS, SEPARATOR_COUNT))
+    current_line = task_lines_count + SEPARATOR_COUNT
 
     # 生成第一层输入数据（整个网络唯一的随机输入）
     first_layer = network[0]
     input_lines_needed = calculate_input_lines(first_layer)
     input_data = generate_random_input(input_lines_needed)
 
-    # 记录输入数据地址并添加到数据内容中
+    # 先匹配所有层的算子，再并发预读全部数据文件（按布局顺序，受字节预算约束），
+    # 后续逐层链接时统计行数、写出数据区均直接命中缓存
+    layer_ops = [resolve_layer_ops(layer, layer_idx, db_catalog) for layer_idx, layer in enumerate(network, 1)]
+    layer_weights = []
+    first_task = 0
+    for layer_idx, (layer, matched_ops) in enumerate(zip(network, layer_ops), 1):
+        layer_weights.append(resolve_weight_paths(layer, layer_idx, matched_ops, first_task, weight_blocks))
+        first_task += len(matched_ops)
+    # 构建缓存命中的层直接登记各文件行数，预读与链接时跳过这些文件
+    fingerprints = []
+    if build_cache is not None:
+        catalog_fingerprint = db_catalog.fingerprint()
+        cached_count = 0
+        for layer in network:
+            fingerprint = BuildCache.layer_fingerprint(DATA_CACHE_STAGE, layer, catalog_fingerprint)
+            cached = build_cache.get(fingerprint)
+            fingerprints.append((fingerprint, cached is not None))
+            if cached is not None:
+                payload_cache.seed_counts(cached[0]["payloads"])
+                cached_count += 1
+        print(f"构建缓存：阶段三复用 {cached_count} 层的数据文件行数，重新统计 {len(network) - cached_count} 层")
+    prefetched = payload_cache.prefetch(
+        path for layer, matched_ops, weight_paths in zip(network, layer_ops, layer_weights)
+        for path in layer_payload_paths(layer, matched_ops, weight_paths))
+    print(f"并发预读数据文件 {prefetched} 个（并发数 {payload_cache.io_workers}）")
+
+    # 记录输入数据地址并添加到数据区布局中
     input_start_addr = current_line
-    data_content.extend(input_data)
-    current_line += input_lines_needed
-    data_content.extend(SEPARATOR_LINES)
-    current_line += 5
+    output_addrs = [None] * len(network)
+    if reuse_activations:
+        # 激活区：网络输入与各层输出按生命周期复用，每块之后保留5行分隔符
+        output_sizes = [sum(payload_cache.count_words(resolve_payload_path(op["op_path"], OUTPUT_PAYLOAD))
+                            for op in matched_ops) for matched_ops in layer_ops]
+        block_sizes = [size + SEPARATOR_COUNT for size in [input_lines_needed] + output_sizes]
+        offsets, arena_lines = plan_activation_buffers(block_sizes)
+        output_addrs = [input_start_addr + offset for offset in offsets[1:]]
+        data_layout.append((SEGMENT_WORDS, input_data))
+        data_layout.append((SEGMENT_SEPARATORS, arena_lines - input_lines_needed))
+        current_line += arena_lines
+        print(f"激活缓冲区复用：峰值占用 {arena_lines} 行（顺序存放需 {sum(block_sizes)} 行），"
+              f"数据区减少 {sum(block_sizes) - arena_lines} 行")
+    else:
+        data_layout.append((SEGMENT_WORDS, input_data))
+        current_line += input_lines_needed
+        data_layout.append((SEGMENT_SEPARATORS, SEPARATOR_COUNT))
+        current_line += SEPARATOR_COUNT
 
     # 按层处理数据
     all_addresses = {}  # 存储最终的地址映射表
     all_records = []  # 存储用于日志打印的记录
     prev_layer_output_addr = input_start_addr  # 第一层的输入是随机生成的输入数据
     task_counter = 0
+    weight_index = WeightBlockIndex(payload_cache) if dedup_weights else None
 
-    for layer_idx, layer in enumerate(network, 1):
+    for layer_idx, (layer, matched_ops) in enumerate(zip(network, layer_ops), 1):
         print(f"处理层 {layer_idx}：{layer['operator']}（输入数据起始地址：{prev_layer_output_addr}）")
-        if layer['operator'] in ['Conv', 'Pool']:
+        if layer['operator'] in CONV_OPERATORS + ('Pool',):
             print(f"  层信息：in_W={layer['in_W']}, in_H={layer['in_H']}, in_channels={layer['in_channels']}")
             print(f"          out_W={layer['out_W']}, out_H={layer['out_H']}, out_channels={layer['out_channels']}")
             if 'kernel' in layer:
                 print(f"          kernel={layer['kernel']}, stride={layer['stride']}, padding={layer.get('padding', 0)}")
-        elif layer['operator'] == 'FC':
+            if 'pool_kernel' in layer:
+                print(f"          pool_kernel={layer['pool_kernel']}, pool_stride={layer['pool_stride']}")
+        elif layer['operator'] in FC_OPERATORS:
              print(f"  层信息：in_features={layer['in_features']}, out_features={layer['out_features']}, isPrevFC={layer['isPrevFC']}")
+             if 'hidden_features' in layer:
+                 print(f"          hidden_features={layer['hidden_features']}")
 
         # 链接当前层所有任务的数据（权重+输出）
-        layer_data, task_records, layer_addresses, current_line, task_counter = link_layer_data(
-            layer, layer_idx, db_operators, current_line, task_counter)
+        with profile_span("stage3.layer", layer=layer_idx):
+            layer_layout, task_records, layer_addresses, current_line, task_counter = link_layer_data(
+                layer, layer_idx, db_catalog, current_line, task_counter, payload_cache, matched_ops,
+                weight_index, output_addrs[layer_idx - 1], layer_weights[layer_idx - 1])
 
-        data_content.extend(layer_data)
+        data_layout.extend(layer_layout)
         all_records.extend(task_records)
+        payload_paths = layer_payload_paths(layer, matched_ops, layer_weights[layer_idx - 1])
+        # 本层载荷的实际读取可能发生在预读线程或阶段四写出时，按文件登记到本层
+        profile_layer_files("stage3.layer", layer_idx, payload_paths)
+        if build_cache is not None and not fingerprints[layer_idx - 1][1]:
+            store_layer_counts(build_cache, fingerprints[layer_idx - 1][0], payload_paths, payload_cache)
 
         # 核心逻辑：更新当前层所有任务的输入地址，使其指向上一层的输出地址
         for task_key in layer_addresses:
@@ -299,8 +414,27 @@ def process_data_module(network: List[Dict], task_file_path: str, db_operators:
         first_task_key_in_layer = sorted(layer_addresses.keys(), key=lambda k: int(k.split('_')[0]))[0]
         prev_layer_output_addr = layer_addresses[first_task_key_in_layer]["outputData_addr"]
 
-    # 返回合并后的完整文件内容和地址信息
-    return task_content + data_content, all_addresses, all_records
+    if weight_index is not None:
+        print(weight_index.summary())
+
+    # 返回数据区布局和地址信息
+    return data_layout, all_addresses, all_records
+
+
+def process_data_module(network: List[Dict], task_lines_count: int, db_catalog: OperatorCatalog,
+                        payload_cache: PayloadCache = None) -> Tuple[WordBuffer, Dict, List[Dict]]:
+    """
+    处理整个数据模块的生成，返回拼接好的数据区内容、地址映射和日志记录。
+    """
+    if payload_cache is None:
+        payload_cache = PayloadCache()
+    data_layout, all_addresses, all_records = plan_data_module(network, task_lines_count, db_catalog, payload_cache)
+
+    image = PipelineImage(network)
+    image.words = WordBuffer()
+    image.data_layout, image.payload_cache = data_layout, payload_cache
+    image.materialize_data()
+    return image.words, all_addresses, all_records
 
 
 def print_data_records(records: List[Dict], addresses: Dict):
@@ -329,33 +463,93 @@ def print_data_records(records: List[Dict], addresses: Dict):
     print("}")
 
 
-def link_data_module(control_task_file, full_output_file, network_path, db_root, data_address_output_file):
-    """
-    执行阶段三：链接数据模块并生成数据地址映射表
-    """
-    print("=" * 20 + " 阶段三：链接数据模块 " + "=" * 20)
+def load_db_catalog(db_root: str) -> OperatorCatalog:
+    """读取数据库中所有算子并建立与阶段一共用的签名索引"""
     # 验证数据库目录是否存在
     if not os.path.exists(db_root):
         raise FileNotFoundError(f"数据库目录不存在：{os.path.abspath(db_root)}")
-
-    network = load_network_structure(network_path)
     db_operators = read_db_operators(db_root)
     if not db_operators:
         raise ValueError(f"在数据文件库 {db_root} 中未找到有效的算子")
+    return OperatorCatalog(db_operators)
 
-    # 执行数据处理核心逻辑
-    full_content, data_addresses, all_records = process_data_module(
-        network, control_task_file, db_operators)
-
-    # 合并任务指令与数据模块，写入完整文件
-    with open(full_output_file, "w", encoding="utf-8") as f:
-        f.writelines(full_content)
 
-    # 保存地址映射为JSON
-    with open(data_address_output_file, "w", encoding="utf-8") as f:
-        json.dump(data_addresses, f, indent=2, ensure_ascii=False)
+def load_weight_library(weight_library_root: str, network: List[Dict]) -> Tuple[List[Dict], Dict]:
+    """
+    读取生成权重库（weight_generator 的输出目录），返回 (补齐的算子列表, 各任务权重块路径)。
+    权重块路径按 {"<层号>_layer": {"<任务号>_task": 路径}} 组织，与数据地址映射表的键一致。
+    权重块按任务号替换，因此要求编译的网络与生成权重库时的网络结构完全一致，否则抛出 ValueError。
+    """
+    manifest_path = os.path.join(weight_library_root, WEIGHT_MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"生成权重库清单不存在：{os.path.abspath(manifest_path)}")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    network_path = os.path.join(weight_library_root, manifest["network_structure"])
+    if not os.path.exists(network_path):
+        raise FileNotFoundError(f"生成权重库的网络结构文件不存在：{os.path.abspath(network_path)}")
+    if load_network_structure(network_path) != network:
+        raise ValueError(f"编译的网络结构与生成权重库 {weight_library_root} 时的网络结构（{network_path}）不一致，"
+                         f"请用该网络重新生成权重库")
+    weight_blocks = {layer_key: {task_key: os.path.join(weight_library_root, path) for task_key, path in tasks.items()}
+                     for layer_key, tasks in manifest["weight_blocks"].items()}
+
+    ops_root = os.path.join(weight_library_root, WEIGHT_LIBRARY_OPS_DIR)
+    operators = read_db_operators(ops_root) if os.path.isdir(ops_root) else []
+    return operators, weight_blocks
+
+
+def build_data_module(image: PipelineImage, db_catalog: OperatorCatalog, payload_cache: PayloadCache = None,
+                      full_output_file: str = None, data_address_output_file: str = None,
+                      streaming: bool = False, build_cache: BuildCache = None,
+                      dedup_weights: bool = False, reuse_activations: bool = False,
+                      weight_blocks: Dict = None) -> PipelineImage:
+    """
+    在内存镜像上执行阶段三：链接数据模块并生成数据地址映射表。
+    streaming=True 时数据区只以布局形式挂在镜像上，由写出文件时逐段读取，不拼接进 image.words；
+    build_cache 为增量编译使用的构建缓存（为空时全部重新统计），dedup_weights=True 时对权重按内容去重，
+    reuse_activations=True 时按生命周期复用各层输出的激活区，weight_blocks 为生成权重库的各任务权重块。
+    """
+    print("=" * 20 + " 阶段三：链接数据模块 " + "=" * 20)
+    if payload_cache is None:
+        payload_cache = PayloadCache()
+
+    # 执行数据处理核心逻辑，数据区紧接在控制块与任务区之后
+    data_layout, data_addresses, all_records = plan_data_module(
+        image.network, len(image.words), db_catalog, payload_cache, build_cache, dedup_weights,
+        reuse_activations, weight_blocks)
+    image.data_layout, image.payload_cache = data_layout, payload_cache
+    if not streaming:
+        image.materialize_data()
+    image.data_addresses = data_addresses
+
+    # 写入包含控制+任务+数据的完整文件（可选）
+    if full_output_file:
+        image.write_text(full_output_file)
+
+    # 保存地址映射为JSON（可选）
+    if data_address_output_file:
+        image.write_json(data_addresses, data_address_output_file)
 
     # 打印日志
     print_data_records(all_records, data_addresses)
-    print(f"\n数据模块处理完成，输出文件：{full_output_file}")
-    print(f"地址映射已保存：{data_address_output_file}")
\ No newline at end of file
+    print(payload_cache.summary())
+    print("\n数据模块处理完成")
+    if full_output_file:
+        print(f"输出文件：{full_output_file}")
+    if data_address_output_file:
+        print(f"地址映射已保存：{data_address_output_file}")
+    return image
+
+
+def link_data_module(control_task_file, full_output_file, network_path, db_root, data_address_output_file,
+                     payload_cache=None):
+    """
+    执行阶段三：链接数据模块并生成数据地址映射表
+    """
+    db_catalog = load_db_catalog(db_root)
+    image = PipelineImage(load_network_structure(network_path))
+    # 读取控制+任务指令文件内容（作为基础）
+    image.words = WordBuffer.from_text_file(control_task_file)
+    build_data_module(image, db_catalog, payload_cache, full_output_file, data_address_output_file)
@@ -1,12 +1,21 @@
 import json
+from word128 import WordBuffer
+from pipeline_image import PipelineImage
+from storage_config import (INITIAL_ADDR_HIGH_14BIT, INITIAL_ADDR_LOW_13BIT, config_data_type,
+                            index_storage_configs)
 
 """
 阶段四模块：存储控制配置地址修改
 - 加载任务地址和数据地址映射文件
-- 解析任务指令中的存储控制器配置（识别011开头的配置行）
-- 根据数据类型（输入/权重/输出）和工作模式，修改相应的地址字段
-- 将数据地址转换为27位二进制格式，拆分为高14位和低13位
-- 更新存储控制器配置中的地址信息，输出最终可执行的激励文件
+- 存储控制器配置块（011开头的3行配置）的位置取自阶段一任务表中按算子索引好的结果，
+  不再逐任务扫描指令；从文件读入镜像时才对各任务指令做一次索引（不限制任务长度）
+- 根据数据类型（输入/权重/输出）和工作模式，生成 (行号, 字段, 值) 地址修改表，
+  由 WordBuffer.apply_patches 批量应用（与阶段二的FIFO字段共用）
+- 将数据地址转换为27位地址，拆分为高14位和低13位（位字段修改为整数运算）
+- 直接在内存镜像上更新存储控制器配置中的地址信息，输出最终可执行的激励文件
+- 地址修改只涉及控制+任务区，数据区可以不在内存中（流式写出时由镜像逐段读取数据文件）
+- 最终镜像可同时输出为'0'/'1'文本、二进制（.bin，大端或小端序）与十六进制文本（.hex），三者均可选
+- 多个任务共享同一任务体时（见 task_dedup），该任务体只修改一次
 """
 
 
@@ -19,17 +28,13 @@ def load_json_files(task_addresses_file, data_addresses_file):
     return task_addresses, data_addresses
 
 
-def replace_bits(binary_str, start, end, new_bits):
-    """替换二进制字符串的一个切片"""
-    return binary_str[:start] + new_bits + binary_str[end + 1:]
-
-
-def addr_to_27bit_binary(addr):
-    """将地址转换为27位二进制，并拆分为高14位和低13位"""
+def addr_to_27bit_fields(addr):
+    """将地址转换为27位地址，并拆分为高14位和低13位的整数值"""
     full_addr = addr * 16  # 地址需要乘以16
-    binary_27bit = format(full_addr, '027b')  # 转换为27位二进制字符串
-    high_14bit = binary_27bit[:14]  # 高14位
-    low_13bit = binary_27bit[14:]  # 低13位
+    if full_addr >> 27:
+        raise ValueError(f"地址 {addr} 乘16后超出27位地址范围")
+    high_14bit = full_addr >> 13  # 高14位
+    low_13bit = full_addr & ((1 << 13) - 1)  # 低13位
     return high_14bit, low_13bit
 
 
@@ -42,82 +47,61 @@ def get_task_data_addresses(layer_idx, task_idx, data_addresses):
     return None
 
 
-def modify_task_storage_config(lines, start_line_1_based, task_data_addrs):
+def build_task_patches(task_start, storage_configs, task_data_addrs, verbose=False):
     """
-    修改单个任务指令块中的存储控制器配置地址字段。
-    此函数会直接修改传入的 `lines` 列表。
+    根据单个任务的存储控制器配置索引生成地址修改项 [(0-based行号, 字段, 值), ...]。
+    task_start 为任务第一条指令在镜像中的0-based行号，storage_configs 为 (偏移, dw, work_mode) 列表。
+    verbose=True 时逐项打印地址拆分细节。
     """
-    # 将1-based的行号转换为0-based的列表索引
-    i = start_line_1_based - 1
-
-    # 设定一个扫描范围，假设一个任务的指令不超过180行，以提高效率
-    scan_end = min(i + 180, len(lines))
-
-    # 遍历任务指令，寻找 '011' 开头的存储控制器配置块（3行一组）
-    while i <= scan_end - 3:
-        line1 = lines[i].strip()
-        if len(line1) == 128 and line1.startswith('011'):
-            line3 = lines[i + 2].strip()
-
-            # 从指令中提取关键字段：数据位宽(dw)和工作模式(work_mode)
-            dw = int(line1[23:25], 2)
-            work_mode = int(line3[113:115], 2)
-
-            addr_to_use = None
-            data_type = "未知"
-            # 根据工作模式和数据位宽，判断当前指令对应的数据类型
-            if work_mode == 0:  # DDR_TO_MC (从DDR读)
-                if dw == 2:
-                    addr_to_use = task_data_addrs['inputData_addr']
-                    data_type = "输入"
-                elif dw == 1:
-                    addr_to_use = task_data_addrs['weightData_addr']
-                    data_type = "权重"
-            elif work_mode == 2:  # MC_TO_DDR (写到DDR)
-                if dw == 2:
-                    addr_to_use = task_data_addrs['outputData_addr']
-                    data_type = "输出"
-
-            # 如果成功匹配到需要修改的地址
-            if addr_to_use is not None and addr_to_use >= 0:
-                print(f"  修改{data_type}数据配置，地址: {addr_to_use}")
-                # 将地址转换为高14位和低13位的二进制
-                high_14bit, low_13bit = addr_to_27bit_binary(addr_to_use)
-
-                # 替换第3行指令中的地址字段
-                # 修改 initial_addr_height_14bit (bits 50-63)
-                modified_line3 = replace_bits(line3, 50, 63, high_14bit)
-                # 修改 initial_addr_low_13bit (bits 115-127)
-                modified_line3 = replace_bits(modified_line3, 115, 127, low_13bit)
-
-                # 更新列表中的行内容
-                lines[i + 2] = modified_line3 + '\n'
-
-                print(f"    原始地址: {addr_to_use}, 乘16后: {addr_to_use * 16}")
-                print(f"    27位二进制: {format(addr_to_use * 16, '027b')}")
-                print(f"    高14位: {high_14bit}, 低13位: {low_13bit}")
-
-            # 跳过这个已处理的3行指令块
-            i += 3
-        else:
-            i += 1
-
-
-def modify_final_addresses(input_file, final_output_file, task_addresses_file, data_addresses_file):
+    patches = []
+    for offset, dw, work_mode in storage_configs:
+        # 根据工作模式和数据位宽，判断当前配置块对应的数据类型
+        addr_key, data_type = config_data_type(dw, work_mode)
+        if addr_key is None:
+            continue
+        addr_to_use = task_data_addrs[addr_key]
+        # 如果成功匹配到需要修改的地址
+        if addr_to_use is None or addr_to_use < 0:
+            continue
+        # 将地址转换为高14位和低13位
+        high_14bit, low_13bit = addr_to_27bit_fields(addr_to_use)
+
+        # 地址字段位于配置块的第3行
+        line_idx = task_start + offset + 2
+        # 修改 initial_addr_height_14bit (bits 50-63)
+        patches.append((line_idx, INITIAL_ADDR_HIGH_14BIT, high_14bit))
+        # 修改 initial_addr_low_13bit (bits 115-127)
+        patches.append((line_idx, INITIAL_ADDR_LOW_13BIT, low_13bit))
+
+        if verbose:
+            print(f"  修改{data_type}数据配置，地址: {addr_to_use}")
+            print(f"    原始地址: {addr_to_use}, 乘16后: {addr_to_use * 16}")
+            print(f"    27位二进制: {format(addr_to_use * 16, '027b')}")
+            print(f"    高14位: {high_14bit:014b}, 低13位: {low_13bit:013b}")
+    return patches
+
+
+def apply_final_addresses(image, final_output_file=None, verbose=False, binary_output_file=None,
+                          hex_output_file=None, byteorder="big"):
     """
-    执行阶段四：在最终文件中修改存储控制器的地址
+    在内存镜像上执行阶段四：修改存储控制器的地址，final_output_file 不为空时写出最终文本文件，
+    binary_output_file / hex_output_file 不为空时另外写出二进制镜像（byteorder 为字内字节序）与十六进制文本。
+    verbose=True 时逐项打印每个地址字段的修改细节。
     """
     print("=" * 20 + " 阶段四：修改最终地址 " + "=" * 20)
     print("开始修改存储控制器配置中的地址字段...")
 
-    # 1. 加载任务和数据地址映射文件
-    task_addresses, data_addresses = load_json_files(task_addresses_file, data_addresses_file)
+    # 1. 取出内存镜像中的地址映射表和包含控制、任务和数据的完整配置
+    task_addresses, data_addresses = image.task_addresses, image.data_addresses
+    lines = image.words
 
-    # 2. 读取包含控制、任务和数据的完整配置文件
-    with open(input_file, "r", encoding="utf-8") as f:
-        lines = f.readlines()
+    # 阶段一任务表中按算子索引好的存储控制器配置位置（任务号 -> 配置索引）
+    task_configs = {entry["task"]: entry["storage_configs"] for entry in image.task_table or []
+                    if entry.get("storage_configs") is not None}
 
-    # 3. 按层和任务遍历，逐个修改地址
+    # 2. 按层和任务遍历，生成地址修改表
+    patches = []
+    patched_starts = {}  # 已修改的任务体起始行 -> 任务号（共享任务体时多个任务指向同一起始行，只修改一次）
     global_task_counter = 1
     # 按层号排序遍历
     for layer_key in sorted(task_addresses.keys(), key=lambda k: int(k.split('_')[0])):
@@ -145,13 +129,44 @@ def modify_final_addresses(input_file, final_output_file, task_addresses_file, d
             print(f"    权重地址: {task_data_addrs['weightData_addr']}")
             print(f"    输出地址: {task_data_addrs['outputData_addr']}")
 
-            # 调用函数，修改当前任务的存储控制器配置
-            modify_task_storage_config(lines, actual_line, task_data_addrs)
+            # 取出当前任务的存储控制器配置索引；没有任务表时对该任务的指令索引一次（覆盖整个任务，不限长度）
+            start = actual_line - 1
+            if start in patched_starts:
+                print(f"    与任务{patched_starts[start]}共享任务体，地址已修改")
+                global_task_counter += 1
+                continue
+            patched_starts[start] = task_idx
+            storage_configs = task_configs.get(task_idx)
+            if storage_configs is None:
+                storage_configs = index_storage_configs(
+                    lines.slice(start, start + task_info['instruction_nums']).data)
+            patches.extend(build_task_patches(start, storage_configs, task_data_addrs, verbose))
             global_task_counter += 1
 
+    # 3. 一次性应用地址修改表（按行合并字段，每行只读写一次）
+    patched_lines = lines.apply_patches(patches)
+    print(f"\n共修改 {len(patches)} 个地址字段，涉及 {patched_lines} 行")
+
     # 4. 写入修改后的文件
-    with open(final_output_file, "w", encoding="utf-8") as f:
-        f.writelines(lines)
+    if final_output_file:
+        image.write_text(final_output_file)
+        print(f"\n地址修改完成！输出文件: {final_output_file}")
+    if binary_output_file:
+        image.write_binary(binary_output_file, byteorder)
+        print(f"二进制镜像（{byteorder}）: {binary_output_file}")
+    if hex_output_file:
+        image.write_hex(hex_output_file)
+        print(f"十六进制镜像: {hex_output_file}")
+    return image
+
 
-    print(f"\n地址修改完成！输出文件: {final_output_file}")
+def modify_final_addresses(input_file, final_output_file, task_addresses_file, data_addresses_file):
+    """
+    执行阶段四：在最终文件中修改存储控制器的地址
+    """
+    # 加载任务和数据地址映射文件，以及包含控制、任务和数据的完整配置文件
+    image = PipelineImage(network=[])
+    image.task_addresses, image.data_addresses = load_json_files(task_addresses_file, data_addresses_file)
+    image.words = WordBuffer.from_text_file(input_file)
+    apply_final_addresses(image, final_output_file, verbose=True)
 
@@ -3,70 +3,163 @@ import stage1_task_generator
 import stage2_control_generator
 import stage3_data_linker
 import stage4_address_modifier
-
-
-def run_pipeline():
-
-    NETWORK_PATH = "network_structure_zengliang999.json"
-    OP_LIBRARY_PATH = "Op_Library"
-    DATA_DB_ROOT = "Data_Library"
-    # 中间及输出文件路径
-    OUTPUT_DIR = "pipeline_output"
-
-    # 阶段一输出
-    ORIGINAL_TASK_FILE = os.path.join(OUTPUT_DIR, "1_original_tasks.txt")
-    ALIGNED_TASK_FILE = os.path.join(OUTPUT_DIR, "1_aligned_tasks.txt")
-
-    # 阶段二输出
-    CONTROL_TASK_FILE = os.path.join(OUTPUT_DIR, "2_control_and_tasks.txt")
-    TASK_ADDRESSES_JSON = os.path.join(OUTPUT_DIR, "task_addresses.json")
-
-    # 阶段三输出
-    FULL_CONFIG_FILE = os.path.join(OUTPUT_DIR, "3_full_config_with_data.txt")
-    DATA_ADDRESSES_JSON = os.path.join(OUTPUT_DIR, "data_addresses.json")
-
-    # 阶段四输出
-    FINAL_OUTPUT_FILE = os.path.join(OUTPUT_DIR, "final_executable_config.txt")
-    # ==================================================
+import task_dedup
+from operator_catalog import OperatorCatalog
+from payload_cache import PayloadCache, DEFAULT_IO_WORKERS
+from pipeline_image import PipelineImage
+from build_cache import BuildCache
+from pipeline_profiler import PipelineProfiler, activate, profile_span
+
+NETWORK_PATH = "network_structure_zengliang999.json"
+OP_LIBRARY_PATH = "Op_Library"
+DATA_DB_ROOT = "Data_Library"
+# 中间及输出文件路径
+OUTPUT_DIR = "pipeline_output"
+
+# 阶段一输出（调试用中间文件）
+ORIGINAL_TASK_NAME = "1_original_tasks.txt"
+ALIGNED_TASK_NAME = "1_aligned_tasks.txt"
+# 阶段二输出
+CONTROL_TASK_NAME = "2_control_and_tasks.txt"
+TASK_ADDRESSES_NAME = "task_addresses.json"
+# 阶段三输出
+FULL_CONFIG_NAME = "3_full_config_with_data.txt"
+DATA_ADDRESSES_NAME = "data_addresses.json"
+# 阶段四输出
+FINAL_OUTPUT_NAME = "final_executable_config.txt"
+FINAL_BINARY_NAME = "final_executable_config.bin"
+FINAL_HEX_NAME = "final_executable_config.hex"
+# 性能分析输出（可选）
+PROFILE_REPORT_NAME = "profile_report.json"
+PROFILE_TRACE_NAME = "profile_trace.json"
+
+
+def compile_network(network_path=NETWORK_PATH, op_library_path=OP_LIBRARY_PATH, data_db_root=DATA_DB_ROOT,
+                    output_dir=OUTPUT_DIR, dump_intermediate=False, streaming=True, workers=1,
+                    io_workers=DEFAULT_IO_WORKERS, incremental=True,
+                    share_tasks=False, dedup_weights=False, task_alignment=stage1_task_generator.TASK_ALIGNMENT,
+                    reorder_tasks=False, reuse_activations=False, profile=False, profile_trace=False,
+                    emit_text=True, emit_binary=False, emit_hex=False, byteorder="big", weight_library=None):
+    """
+    以内存镜像方式执行阶段一至阶段四，返回编译完成的 PipelineImage。
+    各阶段直接传递镜像对象，只在最后写一次可执行文件和两份地址映射表；
+    dump_intermediate=True 时额外输出各阶段的中间文件用于调试。
+    streaming=True 时数据区不拼接进内存镜像，写出可执行文件时逐段读取权重/输出数据，
+    峰值内存只与控制+任务区及最大的单个数据段成正比。
+    workers > 1 时阶段一用多进程并行处理各层（输出与串行逐字节一致）；
+    io_workers 为并发读取算子/数据文件的线程数（1为同步逐个读取）。
+    incremental=True 时在输出目录下维护按层的构建缓存，只重新生成修改过的层（其余层只重定位地址）。
+    share_tasks=True 时在阶段三之后合并修改地址后完全相同的任务体，多个FIFO信息指向同一份指令；
+    dedup_weights=True 时内容相同的权重在数据区只存放一次，共享的任务指向同一权重地址。
+    task_alignment 为任务起始地址的对齐粒度；reorder_tasks=True 时由放置引擎调整任务体的存放位置以减少对齐填充
+    （FIFO顺序即执行顺序不变）；reuse_activations=True 时各层输出按生命周期复用DDR激活区。
+    profile=True 时按阶段、按层记录耗时/CPU/内存/I/O，在输出目录写出 profile_report.json，
+    profile_trace=True 时另写出 Chrome trace 格式的 profile_trace.json。报告的 layer_io 为各层实际读取的载荷
+    （含阶段一工作进程与阶段四写出时的读取），区间自身的I/O计数只覆盖本进程在区间内的读写。
+    emit_text / emit_binary / emit_hex 选择最终镜像的输出格式：'0'/'1'文本、二进制（byteorder 为字内字节序）、
+    十六进制文本（$readmemh 格式），三者均由内存镜像直接写出。
+    weight_library 为 weight_generator 由ONNX模型生成的权重库目录：各任务使用生成的权重块，
+    数据库中缺失的算子由其中的算子目录补齐（数据库中已有的算子优先）。
+    """
+    def debug_path(name):
+        return os.path.join(output_dir, name) if dump_intermediate else None
 
     # 确保输出目录存在
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-
+    os.makedirs(output_dir, exist_ok=True)
+    # 单次运行内共享的算子文件内容缓存
+    payload_cache = PayloadCache(io_workers=io_workers)
+    # 跨运行的按层构建缓存（增量编译）
+    build_cache = BuildCache.for_output_dir(output_dir) if incremental else None
+
+    profiler = PipelineProfiler() if profile or profile_trace else None
+    if profiler is not None:
+        profiler.attach_payload_cache(payload_cache)
+    activate(profiler)
     try:
+        # 加载网络结构与算子目录
+        with profile_span("load"):
+            image = PipelineImage(stage1_task_generator.load_network_structure(network_path))
+            op_catalog = OperatorCatalog(stage1_task_generator.read_operator_library(op_library_path))
+            db_catalog = stage3_data_linker.load_db_catalog(data_db_root)
+            weight_blocks = None
+            if weight_library:
+                generated_ops, weight_blocks = stage3_data_linker.load_weight_library(weight_library, image.network)
+                db_catalog = OperatorCatalog(db_catalog.operators + generated_ops)
+
         # 生成任务指令与任务地址对齐
-        stage1_task_generator.generate_task_instructions(
-            network_path=NETWORK_PATH,
-            library_path=OP_LIBRARY_PATH,
-            original_output=ORIGINAL_TASK_FILE,
-            aligned_output=ALIGNED_TASK_FILE
-        )
+        with profile_span("stage1"):
+            stage1_task_generator.build_task_region(
+                image, op_catalog, payload_cache,
+                original_output=debug_path(ORIGINAL_TASK_NAME),
+                aligned_output=debug_path(ALIGNED_TASK_NAME),
+                workers=workers,
+                build_cache=build_cache,
+                alignment=task_alignment,
+                reorder=reorder_tasks
+            )
 
         # 生成控制模块和FIFO
-        stage2_control_generator.generate_control_module(
-            aligned_task_file=ALIGNED_TASK_FILE,
-            control_task_output_file=CONTROL_TASK_FILE,
-            network_path=NETWORK_PATH,
-            task_address_output_file=TASK_ADDRESSES_JSON
-        )
+        with profile_span("stage2"):
+            stage2_control_generator.build_control_module(
+                image,
+                control_task_output_file=debug_path(CONTROL_TASK_NAME),
+                task_address_output_file=os.path.join(output_dir, TASK_ADDRESSES_NAME)
+            )
 
         # 链接数据模块
-        stage3_data_linker.link_data_module(
-            control_task_file=CONTROL_TASK_FILE,
-            full_output_file=FULL_CONFIG_FILE,
-            network_path=NETWORK_PATH,
-            db_root=DATA_DB_ROOT,
-            data_address_output_file=DATA_ADDRESSES_JSON
-        )
-
-        # 修改最终地址
-        stage4_address_modifier.modify_final_addresses(
-            input_file=FULL_CONFIG_FILE,
-            final_output_file=FINAL_OUTPUT_FILE,
-            task_addresses_file=TASK_ADDRESSES_JSON,
-            data_addresses_file=DATA_ADDRESSES_JSON
-        )
-
-        print(f"最终可执行文件位于: {FINAL_OUTPUT_FILE}")
+        with profile_span("stage3"):
+            stage3_data_linker.build_data_module(
+                image, db_catalog, payload_cache,
+                full_output_file=debug_path(FULL_CONFIG_NAME),
+                data_address_output_file=os.path.join(output_dir, DATA_ADDRESSES_NAME),
+                streaming=streaming,
+                build_cache=build_cache,
+                dedup_weights=dedup_weights,
+                reuse_activations=reuse_activations,
+                weight_blocks=weight_blocks
+            )
+
+        # 合并修改地址后完全相同的任务体（可选），重新写出两份地址映射表
+        if share_tasks:
+            with profile_span("share_tasks"):
+                task_dedup.share_identical_tasks(
+                    image,
+                    task_address_output_file=os.path.join(output_dir, TASK_ADDRESSES_NAME),
+                    data_address_output_file=os.path.join(output_dir, DATA_ADDRESSES_NAME),
+                    alignment=task_alignment,
+                    reorder=reorder_tasks
+                )
+
+        # 修改最终地址并写出可执行文件
+        with profile_span("stage4"):
+            stage4_address_modifier.apply_final_addresses(
+                image,
+                final_output_file=os.path.join(output_dir, FINAL_OUTPUT_NAME) if emit_text else None,
+                binary_output_file=os.path.join(output_dir, FINAL_BINARY_NAME) if emit_binary else None,
+                hex_output_file=os.path.join(output_dir, FINAL_HEX_NAME) if emit_hex else None,
+                byteorder=byteorder
+            )
+    finally:
+        activate(None)
+
+    if build_cache is not None:
+        build_cache.save()
+        print(build_cache.summary())
+    if profiler is not None:
+        profiler.print_summary()
+        profiler.write_report(os.path.join(output_dir, PROFILE_REPORT_NAME))
+        if profile_trace:
+            profiler.write_chrome_trace(os.path.join(output_dir, PROFILE_TRACE_NAME))
+    return image
+
+
+def run_pipeline(network_path=NETWORK_PATH, op_library_path=OP_LIBRARY_PATH, data_db_root=DATA_DB_ROOT,
+                 output_dir=OUTPUT_DIR, dump_intermediate=False, streaming=True, workers=1, incremental=True,
+                 profile=False):
+    try:
+        compile_network(network_path, op_library_path, data_db_root, output_dir, dump_intermediate, streaming,
+                        workers, incremental=incremental, profile=profile)
+        print(f"最终可执行文件位于: {os.path.join(output_dir, FINAL_OUTPUT_NAME)}")
 
     except Exception as e:
         print(f"\n发生错误，错误详情: {e}")
@@ -74,4 +167,3 @@ def run_pipeline():
 
 if __name__ == "__main__":
     run_pipeline()
-
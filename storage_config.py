@@ -0,0 +1,56 @@
+from typing import List, Tuple
+from word128 import WORD_BYTES, get_field
+
+"""
+存储控制器配置索引模块：定位算子激励中的存储控制器配置块
+- 存储控制器配置为3行一组，第1行以 '011' 开头
+- 数据位宽 dw 位于第1行第 23-24 位，工作模式 work_mode 位于第3行第 113-114 位
+- 每个算子的激励只需索引一次，得到各配置块在激励内的偏移及其 dw / work_mode，
+  阶段四据此直接生成地址修改表，无需再扫描任务指令
+"""
+
+# 存储控制器配置第1行的操作码（前3位）
+STORAGE_CONFIG_OPCODE = 0b011
+STORAGE_CONFIG_OPCODE_FIELD = (0, 2)
+# 数据位宽（第1行）与工作模式（第3行）字段
+DW_FIELD = (23, 24)
+WORK_MODE_FIELD = (113, 114)
+# 配置第3行中的地址字段
+INITIAL_ADDR_HIGH_14BIT = (50, 63)
+INITIAL_ADDR_LOW_13BIT = (115, 127)
+
+# 工作模式
+WORK_MODE_DDR_TO_MC = 0  # 从DDR读
+WORK_MODE_MC_TO_DDR = 2  # 写到DDR
+
+
+def index_storage_configs(words: bytes) -> List[Tuple[int, int, int]]:
+    """
+    扫描一段打包的任务指令，返回其中所有存储控制器配置块的 (第1行偏移, dw, work_mode)。
+    扫描规则与逐行查找一致：命中 '011' 后跳过整个3行配置块，否则前进1行；不足3行的尾部不构成配置块。
+    """
+    configs = []
+    count = len(words) // WORD_BYTES
+    i = 0
+    while i <= count - 3:
+        line1 = int.from_bytes(words[i * WORD_BYTES:(i + 1) * WORD_BYTES], "big")
+        if get_field(line1, *STORAGE_CONFIG_OPCODE_FIELD) == STORAGE_CONFIG_OPCODE:
+            line3 = int.from_bytes(words[(i + 2) * WORD_BYTES:(i + 3) * WORD_BYTES], "big")
+            configs.append((i, get_field(line1, *DW_FIELD), get_field(line3, *WORK_MODE_FIELD)))
+            i += 3
+        else:
+            i += 1
+    return configs
+
+
+def config_data_type(dw: int, work_mode: int):
+    """根据工作模式和数据位宽判断配置块对应的数据类型，返回 (地址键, 数据类型名)，无需修改时返回 (None, None)"""
+    if work_mode == WORK_MODE_DDR_TO_MC:
+        if dw == 2:
+            return "inputData_addr", "输入"
+        if dw == 1:
+            return "weightData_addr", "权重"
+    elif work_mode == WORK_MODE_MC_TO_DDR:
+        if dw == 2:
+            return "outputData_addr", "输出"
+    return None, None
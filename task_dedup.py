@@ -0,0 +1,121 @@
+from typing import Dict, List, Optional, Tuple
+from word128 import WordBuffer, WORD_BYTES
+from storage_config import config_data_type, index_storage_configs
+from stage2_control_generator import CONTROL_BLOCK_LINES, build_control_block, build_task_addresses
+from stage1_task_generator import TASK_ALIGNMENT, place_tasks
+
+"""
+任务体共享模块：地址修改感知的任务指令去重（可选）
+- 相同算子的多个任务在任务区中各占一份激励，并各自按对齐粒度（默认256行）对齐；若两个任务经阶段四修改地址后的指令完全相同，
+  只需在任务区保留一份，由多个FIFO信息指向同一起始地址
+- 阶段四会把各任务的输入/权重/输出数据地址写入存储控制器配置，因此判断是否可共享时以
+  (任务指令内容, 各配置块将被写入的数据地址) 为键，而非只比较算子激励：地址不同的任务不会被合并
+- 在阶段三之后、阶段四之前执行：压缩任务区、重建控制块中的FIFO信息，数据区整体前移，
+  所有数据地址按相同的偏移量修正（相同地址修正后仍然相同，共享关系不变）
+- 被合并的任务在任务表中记录 shared_with（共享的任务号），阶段四对同一任务体只修改一次
+"""
+
+
+def task_patch_addresses(entry: Dict, body: bytes, data_addresses: Dict) -> Tuple:
+    """返回阶段四将写入该任务各存储控制器配置块的 (配置偏移, 地址) 序列，与 build_task_patches 的取值规则一致"""
+    task_data_addrs = data_addresses.get(f"{entry['layer']}_layer", {}).get(f"{entry['task']}_task")
+    if task_data_addrs is None:
+        return ()
+    storage_configs = entry.get("storage_configs")
+    if storage_configs is None:
+        storage_configs = index_storage_configs(body)
+    addresses = []
+    for offset, dw, work_mode in storage_configs:
+        addr_key, _ = config_data_type(dw, work_mode)
+        if addr_key is None:
+            continue
+        addr = task_data_addrs[addr_key]
+        if addr is None or addr < 0:
+            continue
+        addresses.append((offset, addr))
+    return tuple(addresses)
+
+
+def find_shared_tasks(task_lines: WordBuffer, task_table: List[Dict], data_addresses: Dict) -> Dict[int, int]:
+    """
+    找出修改地址后与前面某个任务完全相同的任务，返回 {任务表下标: 共享的任务表下标}。
+    task_lines 为控制块之后的任务区（行号与任务表中的 start 一致）。
+    """
+    first_by_key = {}
+    shared = {}
+    for idx, entry in enumerate(task_table):
+        body = task_lines.slice(entry["start"], entry["start"] + entry["count"]).data
+        key = (bytes(body), task_patch_addresses(entry, body, data_addresses))
+        if key in first_by_key:
+            shared[idx] = first_by_key[key]
+        else:
+            first_by_key[key] = idx
+    return shared
+
+
+def shift_data_addresses(data_addresses: Dict, delta: int):
+    """数据区整体移动 delta 行后修正数据地址映射表（没有权重数据的任务，其权重地址占位为0，保持不变）"""
+    for layer_tasks in data_addresses.values():
+        for addrs in layer_tasks.values():
+            addrs["inputData_addr"] += delta
+            addrs["outputData_addr"] += delta
+            if addrs["weight_lines"] > 0:
+                addrs["weightData_addr"] += delta
+
+
+def share_identical_tasks(image, task_address_output_file: Optional[str] = None,
+                          data_address_output_file: Optional[str] = None, alignment: int = TASK_ALIGNMENT,
+                          reorder: bool = False):
+    """
+    在阶段三之后对镜像执行任务体共享：修改地址后完全相同的任务只保留第一份，任务区经放置引擎重新对齐
+    （alignment / reorder 与阶段一一致），重建FIFO信息并前移数据区，修正任务/数据地址映射表
+    （给出输出路径时重新写出）。返回被合并的任务数。
+    """
+    print("=" * 20 + " 任务体共享（地址修改感知） " + "=" * 20)
+    task_table = image.task_table or []
+    if not task_table:
+        print("任务表为空，跳过")
+        return 0
+
+    words = image.words
+    task_region_end = max(entry["start"] + entry["count"] for entry in task_table)
+    task_lines = words.slice(CONTROL_BLOCK_LINES, CONTROL_BLOCK_LINES + task_region_end)
+    shared = find_shared_tasks(task_lines, task_table, image.data_addresses)
+    if not shared:
+        print(f"共 {len(task_table)} 个任务，未发现修改地址后完全相同的任务体，任务区保持不变")
+        return 0
+
+    # 1. 重建任务区：只存放未被合并的任务（由放置引擎对齐），被合并的任务指向共享的任务体
+    kept = [idx for idx in range(len(task_table)) if idx not in shared]
+    order, starts, _ = place_tasks([task_table[idx]["count"] for idx in kept], alignment, reorder)
+    new_task_lines = WordBuffer()
+    for pos in order:
+        entry = task_table[kept[pos]]
+        new_task_lines.extend_separators(starts[pos] - len(new_task_lines))
+        new_task_lines.extend(task_lines.slice(entry["start"], entry["start"] + entry["count"]))
+        entry["start"] = starts[pos]
+    for idx, shared_idx in shared.items():
+        task_table[idx]["start"] = task_table[shared_idx]["start"]
+        task_table[idx]["shared_with"] = task_table[shared_idx]["task"]
+
+    # 2. 重建控制块（FIFO条数不变，被合并任务的FIFO信息指向共享的任务体），数据区紧随新任务区之后
+    delta = len(new_task_lines) - task_region_end
+    new_words = build_control_block(task_table)
+    new_words.extend(new_task_lines)
+    new_words.extend(words.slice(CONTROL_BLOCK_LINES + task_region_end, len(words)))
+    image.words = new_words
+
+    # 3. 修正地址映射表
+    image.task_addresses = build_task_addresses(task_table, verbose=False)
+    shift_data_addresses(image.data_addresses, delta)
+    if task_address_output_file:
+        image.write_json(image.task_addresses, task_address_output_file)
+    if data_address_output_file:
+        image.write_json(image.data_addresses, data_address_output_file)
+
+    for idx, shared_idx in sorted(shared.items()):
+        print(f"任务 {task_table[idx]['task']} 与任务 {task_table[shared_idx]['task']} 共享任务体"
+              f"（地址 {task_table[idx]['start'] + CONTROL_BLOCK_LINES}）")
+    print(f"共合并 {len(shared)} 个任务，任务区由 {task_region_end} 行缩减为 {len(new_task_lines)} 行"
+          f"（减少 {-delta} 行，{-delta * WORD_BYTES / 1024:.1f} KB），数据地址前移 {-delta} 行")
+    return len(shared)
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import numpy as np
+from typing import Dict, Optional
+from word128 import WORD_BYTES
+from binary_payload import write_binary_payload, read_binary_payload
+from operator_catalog import OperatorCatalog, layer_signature, CONV_OPERATORS, WEIGHTED_OPERATORS
+from stage0_onnx_to_json import ONNXToNetworkStructure
+from stage3_data_linker import (WEIGHT_MANIFEST_NAME, WEIGHT_LIBRARY_OPS_DIR, WEIGHT_PAYLOAD, OUTPUT_PAYLOAD,
+                                load_db_catalog)
+
+"""
+权重生成模块：由ONNX模型的initializer直接生成各任务的权重块（生成权重库），无需手工在 Data_Library 中预置权重
+- 复用阶段零的转换器：网络结构与ONNX节点一一对应，权重按需逐个张量读取（外部数据只在此时读入）
+- 权重量化为int8：int8/uint8权重（ConvInteger、MatMulInteger）原样使用，浮点权重按输出通道对称量化
+- 与阶段一/三相同按每10个输出通道（特征）切分任务；每个任务的权重块每行128位，对应一个输入位置：
+    卷积按 (ky, kx, 输入通道) 顺序共 kernel_h*kernel_w*in_channels 行，全连接按输入特征顺序共 in_features 行，
+    行内依次为该任务各输出通道的8位权重（第一个通道在最高字节），不足16字节的部分补0
+- 生成权重库目录：
+    weights/        各任务的权重块（二进制载荷格式），内容未变化时不重写
+    ops/            数据库中缺失的算子目录（info.json + 权重 + 全0输出数据），与 Data_Library 格式相同
+    weight_manifest.json   各任务权重块路径（按层号/全局任务号，与数据地址映射表的键一致）
+    network_structure.json 阶段零转换得到的网络结构
+- 卷积+池化融合层（ConvPool）的权重即其中卷积的权重；全连接链融合层（FCChain）的权重布局由硬件算子决定，暂不支持生成
+- 编译时以 compile_network(weight_library=...) 使用：各任务使用生成的权重块，缺失的算子由 ops/ 补齐
+"""
+
+ONNX_MODEL_PATH = "Resnet640_cifar10_no_Normalize_int0810.onnx"
+DATA_DB_ROOT = "Data_Library"
+WEIGHT_LIBRARY_ROOT = "Weight_Library"
+WEIGHT_BLOCKS_DIR = "weights"
+NETWORK_STRUCTURE_NAME = "network_structure.json"
+# 每个任务处理的输出通道（特征）数，与阶段一/三的任务切分一致
+TASK_OUT_CHANNELS = 10
+INT8_MAX = 127
+
+
+def quantize_int8(matrix: np.ndarray) -> np.ndarray:
+    """将权重矩阵（每行一个输出通道）量化为int8；已是8位整数的权重原样返回"""
+    if matrix.dtype in (np.int8, np.uint8):
+        return np.ascontiguousarray(matrix)
+    if not np.issubdtype(matrix.dtype, np.floating):
+        raise ValueError(f"不支持的权重数据类型：{matrix.dtype}")
+    # 按输出通道对称量化，全0的通道缩放系数取1
+    scale = np.abs(matrix).max(axis=1) / INT8_MAX
+    scale[scale == 0] = 1
+    return np.clip(np.rint(matrix / scale[:, None]), -INT8_MAX, INT8_MAX).astype(np.int8)
+
+
+def layer_weight_matrix(converter: ONNXToNetworkStructure, node) -> np.ndarray:
+    """读取节点的权重initializer，整理为 (输出通道数, 每个任务的权重行数) 的int8矩阵"""
+    weight_name = node.input[1]
+    weights = converter.get_initializer_array(weight_name)
+    if weights is None:
+        raise ValueError(f"节点 {node.name or node.op_type} 的权重 {weight_name} 不是initializer，无法生成权重")
+
+    if node.op_type in ["Conv", "ConvInteger"]:
+        # [out, in, kh, kw] -> [out, (kh, kw, in)]
+        matrix = weights.transpose(0, 2, 3, 1).reshape(weights.shape[0], -1)
+    elif node.op_type == "Gemm":
+        attrs = {attr.name: attr for attr in node.attribute}
+        trans_b = attrs['transB'].i if 'transB' in attrs else 0
+        # transB=1 时权重为 [out, in]，否则为 [in, out]
+        matrix = weights if trans_b else weights.T
+    else:
+        # MatMul / MatMulInteger：[in, out]
+        matrix = weights.T
+    return quantize_int8(matrix)
+
+
+def expected_weight_lines(layer: Dict) -> int:
+    """按网络层参数计算每个任务的权重行数（与 Data_Library 中 info.json 的 weight_data 一致）"""
+    if layer["operator"] in CONV_OPERATORS:
+        kernel = layer["kernel"]
+        return kernel[0] * kernel[1] * layer["in_channels"]
+    return layer["in_features"]
+
+
+def output_line_count(layer: Dict, out_count: int) -> int:
+    """
+    计算单个任务的输出数据行数：特征图与第一层输入数据的布局相同，为 ⌈out_H / 8⌉ * out_W * 通道数；
+    全连接输出每行8个特征
+    """
+    if layer["operator"] in CONV_OPERATORS + ("Pool",):
+        return ((layer["out_H"] + 7) // 8) * layer["out_W"] * out_count
+    return (out_count + 7) // 8
+
+
+def pack_task_weights(matrix: np.ndarray, out_start: int, out_count: int) -> bytes:
+    """取出一个任务的输出通道，打包为128位字序列（每行一个输入位置，行内依次为各输出通道的8位权重）"""
+    block = matrix[out_start:out_start + out_count]
+    lines = np.zeros((block.shape[1], WORD_BYTES), dtype=np.uint8)
+    lines[:, :out_count] = block.view(np.uint8).T
+    return lines.tobytes()
+
+
+def task_op_info(layer: Dict, out_count: int) -> Dict:
+    """按 Data_Library 的 info.json 格式生成单个任务的算子信息（签名字段与 operator_catalog 一致）"""
+    if layer["operator"] == "FC":
+        return {
+            "operator_type": "FC",
+            "isPrevFC": layer["isPrevFC"],
+            "in_features": [layer["in_features"]],
+            "out_features": [out_count],
+            "weight_data": expected_weight_lines(layer),
+            "output_data": output_line_count(layer, out_count),
+        }
+
+    padding = layer.get("padding", 0)
+    info = {
+        "operator_type": layer["operator"],
+        "kernel_size": list(layer["kernel"]),
+        "stride": [layer["stride"], layer["stride"]],
+        "padding": [padding, padding],
+        "input_channels": layer["in_channels"],
+        "input_tensor_shape": [layer["in_W"], layer["in_H"], layer["in_channels"]],
+        "output_channels": out_count,
+        "output_tensor_shape": [layer["out_W"], layer["out_H"], out_count],
+    }
+    if layer["operator"] == "ConvPool":
+        info["pool_kernel_size"] = list(layer["pool_kernel"])
+        info["pool_stride"] = [layer["pool_stride"], layer["pool_stride"]]
+    if layer["operator"] in CONV_OPERATORS:
+        info["weight_data"] = expected_weight_lines(layer)
+    info["output_data"] = output_line_count(layer, out_count)
+    return info
+
+
+def op_dir_name(info: Dict) -> str:
+    """按 Data_Library 的命名习惯生成算子目录名"""
+    if info["operator_type"] == "FC":
+        name = f"fc_{info['in_features'][0]}_{info['out_features'][0]}"
+        return name + "_prevfc" if info["isPrevFC"] else name
+    kernel = info["kernel_size"]
+    kernel_name = str(kernel[0]) if kernel[0] == kernel[1] else f"{kernel[0]}x{kernel[1]}"
+    in_shape, out_shape = info["input_tensor_shape"], info["output_tensor_shape"]
+    return (f"{info['operator_type'].lower()}_{in_shape[0]}x{in_shape[1]}x{in_shape[2]}_"
+            f"{out_shape[0]}x{out_shape[1]}x{out_shape[2]}_k{kernel_name}_s{info['stride'][0]}_p{info['padding'][0]}")
+
+
+def write_payload_if_changed(path: str, words: bytes) -> bool:
+    """写出二进制载荷；已有文件内容相同时不重写（保留文件状态，构建缓存仍可命中），返回是否写入"""
+    if os.path.exists(path):
+        try:
+            if read_binary_payload(path) == words:
+                return False
+        except (OSError, ValueError):
+            pass
+    write_binary_payload(path, words)
+    return True
+
+
+def write_op_dir(ops_root: str, info: Dict, weight_words: Optional[bytes]) -> str:
+    """在生成权重库中写出一个算子目录（info.json、权重、全0输出数据），返回目录名"""
+    name = op_dir_name(info)
+    op_path = os.path.join(ops_root, name)
+    os.makedirs(op_path, exist_ok=True)
+    with open(os.path.join(op_path, "info.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    if weight_words is not None:
+        write_payload_if_changed(os.path.join(op_path, WEIGHT_PAYLOAD + ".bin"), weight_words)
+    write_payload_if_changed(os.path.join(op_path, OUTPUT_PAYLOAD + ".bin"), bytes(info["output_data"] * WORD_BYTES))
+    return name
+
+
+def generate_weight_library(converter: ONNXToNetworkStructure, output_root: str = WEIGHT_LIBRARY_ROOT,
+                            db_catalog: OperatorCatalog = None) -> Dict:
+    """
+    由已转换的ONNX模型生成权重库：写出各任务的权重块与清单、网络结构，
+    并为 db_catalog 中缺失的算子（db_catalog 为空时为全部算子）写出算子目录。返回清单内容。
+    """
+    print("=" * 20 + " 由ONNX模型生成权重 " + "=" * 20)
+    start_time = time.perf_counter()
+    if not converter.network_structure:
+        converter.convert()
+    network = converter.network_structure
+
+    blocks_root = os.path.join(output_root, WEIGHT_BLOCKS_DIR)
+    ops_root = os.path.join(output_root, WEIGHT_LIBRARY_OPS_DIR)
+    os.makedirs(blocks_root, exist_ok=True)
+
+    weight_blocks = {}
+    generated_ops = []
+    generated_signatures = set()
+    written, unchanged, total_lines = 0, 0, 0
+    task_counter = 0
+    for layer_idx, (layer, node) in enumerate(zip(network, converter.layer_nodes), 1):
+        if layer["operator"] == "FCChain":
+            raise ValueError(f"层{layer_idx}为全连接链融合层，暂不支持由ONNX生成其权重（可在阶段零关闭融合）")
+        has_weights = layer["operator"] in WEIGHTED_OPERATORS
+        if has_weights:
+            total_out = layer["out_channels"] if layer["operator"] in CONV_OPERATORS else layer["out_features"]
+            matrix = layer_weight_matrix(converter, node)
+            if matrix.shape != (total_out, expected_weight_lines(layer)):
+                raise ValueError(f"层{layer_idx}的权重形状 {matrix.shape} 与网络层参数不符"
+                                 f"（需要 {(total_out, expected_weight_lines(layer))}）")
+            out_counts = [min(TASK_OUT_CHANNELS, total_out - start) for start in range(0, total_out, TASK_OUT_CHANNELS)]
+        else:
+            matrix = None
+            out_counts = [layer["out_channels"]]
+
+        layer_blocks = {}
+        for task_idx, out_count in enumerate(out_counts):
+            task_num = task_counter + task_idx + 1
+            words = None
+            if has_weights:
+                words = pack_task_weights(matrix, task_idx * TASK_OUT_CHANNELS, out_count)
+                relative_path = os.path.join(WEIGHT_BLOCKS_DIR, f"layer{layer_idx}_task{task_num}.bin")
+                if write_payload_if_changed(os.path.join(output_root, relative_path), words):
+                    written += 1
+                else:
+                    unchanged += 1
+                total_lines += len(words) // WORD_BYTES
+                layer_blocks[f"{task_num}_task"] = relative_path
+
+            # 数据库中缺失的算子：写出算子目录（同一签名只写一次，权重取第一个任务的权重块）
+            signature = layer_signature(layer, out_count if has_weights else None)
+            missing = db_catalog is None or db_catalog.lookup(signature) is None
+            if missing and signature not in generated_signatures:
+                generated_signatures.add(signature)
+                generated_ops.append(write_op_dir(ops_root, task_op_info(layer, out_count), words))
+
+        if layer_blocks:
+            weight_blocks[f"{layer_idx}_layer"] = layer_blocks
+        task_counter += len(out_counts)
+
+    manifest = {
+        "model": os.path.abspath(converter.model_path),
+        "network_structure": NETWORK_STRUCTURE_NAME,
+        "weight_blocks": weight_blocks,
+        "generated_ops": generated_ops,
+    }
+    with open(os.path.join(output_root, WEIGHT_MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    converter.save_to_json(os.path.join(output_root, NETWORK_STRUCTURE_NAME))
+
+    print(f"权重块：{written + unchanged} 个（写入 {written} 个，内容未变化 {unchanged} 个），"
+          f"共 {total_lines} 行（{total_lines * WORD_BYTES / 1024:.1f} KB）")
+    if generated_ops:
+        print(f"补齐数据库中缺失的算子 {len(generated_ops)} 个：{', '.join(generated_ops)}")
+    print(f"生成权重库：{os.path.abspath(output_root)}（{len(network)} 层，{task_counter} 个任务，"
+          f"耗时 {(time.perf_counter() - start_time) * 1000:.1f} ms）")
+    return manifest
+
+
+def main():
+    converter = ONNXToNetworkStructure(ONNX_MODEL_PATH)
+    converter.convert()
+    generate_weight_library(converter, WEIGHT_LIBRARY_ROOT, load_db_catalog(DATA_DB_ROOT))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+from array import array
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+"""
+128位字模块：指令/数据行的紧凑二进制表示
+- 各阶段内部统一以 16 字节大端序的打包字存储每一行 128bit 指令/数据，
+  替代原先每行 129 字节的 '0'/'1' 字符串，内存约为原来的 1/8
+- 位字段编号沿用文本行的下标约定：第 0 位为最左侧（最高位）字符，区间 [start, end] 为闭区间，
+  与原先按字符串切片修改字段（如第3行的 50-63 位）的写法一一对应
+- 位字段修改为整数运算，不再重建整行字符串；批量修改时先按行合并各字段的掩码和值，每行只读写一次
+  （阶段二的FIFO字段与阶段四的地址字段共用同一套批量修改接口）
+- 仅在最终序列化时才转换回 '0'/'1' 文本；也可直接输出二进制镜像（大端/小端序）或十六进制文本（$readmemh 格式）
+"""
+
+WORD_BITS = 128
+WORD_BYTES = WORD_BITS // 8
+WORD_MASK = (1 << WORD_BITS) - 1
+
+# 128bit全1分隔符
+SEPARATOR_WORD = WORD_MASK
+SEPARATOR_BYTES = SEPARATOR_WORD.to_bytes(WORD_BYTES, "big")
+
+# 批量文本编解码时每次处理的行数：以分块大整数完成 '0'/'1' 与字节之间的转换，
+# 基数为2时 int()/format() 为线性复杂度，比逐行转换快数倍
+TEXT_CHUNK_LINES = 4096
+
+
+def parse_word(text: str) -> int:
+    """将128个'0'/'1'字符组成的文本行转换为整数"""
+    text = text.strip()
+    if len(text) != WORD_BITS:
+        raise ValueError(f"指令/数据行长度应为{WORD_BITS}位，实际为{len(text)}位：{text[:32]}...")
+    return int(text, 2)
+
+
+def field_mask(start: int, end: int) -> int:
+    """返回文本下标闭区间 [start, end] 对应的位掩码（已移位）"""
+    width = end - start + 1
+    return ((1 << width) - 1) << (WORD_BITS - 1 - end)
+
+
+def get_field(word: int, start: int, end: int) -> int:
+    """读取文本下标闭区间 [start, end] 的位字段值"""
+    width = end - start + 1
+    return (word >> (WORD_BITS - 1 - end)) & ((1 << width) - 1)
+
+
+def set_field(word: int, start: int, end: int, value: int) -> int:
+    """写入文本下标闭区间 [start, end] 的位字段值，返回新的字"""
+    width = end - start + 1
+    if value < 0 or value >> width:
+        raise ValueError(f"字段值 {value} 超出 {width} 位范围（位 {start}-{end}）")
+    shift = WORD_BITS - 1 - end
+    return (word & ~(((1 << width) - 1) << shift)) | (value << shift)
+
+
+def merge_field_patches(patches: Iterable[Tuple[int, Tuple[int, int], int]]) -> Dict[int, Tuple[int, int]]:
+    """
+    将 (行号, (start, end), 值) 形式的字段修改按行合并为 {行号: (清除掩码, 写入值)}。
+    值超出字段位宽或同一行内字段重叠时抛出 ValueError。
+    """
+    merged = {}
+    for line_idx, (start, end), value in patches:
+        width = end - start + 1
+        if value < 0 or value >> width:
+            raise ValueError(f"字段值 {value} 超出 {width} 位范围（第 {line_idx} 行，位 {start}-{end}）")
+        mask = field_mask(start, end)
+        clear, bits = merged.get(line_idx, (0, 0))
+        if clear & mask:
+            raise ValueError(f"第 {line_idx} 行的位字段 {start}-{end} 与同批次其他字段重叠")
+        merged[line_idx] = (clear | mask, bits | (value << (WORD_BITS - 1 - end)))
+    return merged
+
+
+def pack_text(content: str) -> bytes:
+    """将'0'/'1'文本内容（多行）打包为连续的16字节字序列，空行被忽略"""
+    lines = content.split()
+    bad_lengths = set(map(len, lines)) - {WORD_BITS}
+    if bad_lengths:
+        bad = next(line for line in lines if len(line) != WORD_BITS)
+        raise ValueError(f"指令/数据行长度应为{WORD_BITS}位，实际为{len(bad)}位：{bad[:32]}...")
+    packed = bytearray()
+    for start in range(0, len(lines), TEXT_CHUNK_LINES):
+        chunk = lines[start:start + TEXT_CHUNK_LINES]
+        packed += int("".join(chunk), 2).to_bytes(len(chunk) * WORD_BYTES, "big")
+    return bytes(packed)
+
+
+def pack_text_lines(lines: Iterable[str]) -> bytes:
+    """将文本行打包为连续的16字节字序列，空行被忽略"""
+    return pack_text("\n".join(lines))
+
+
+def unpack_text(data) -> Iterator[str]:
+    """将打包的字节序列按块转换为'0'/'1'文本（每行128位并以换行符结尾）"""
+    chunk_bytes = TEXT_CHUNK_LINES * WORD_BYTES
+    for offset in range(0, len(data), chunk_bytes):
+        chunk = data[offset:offset + chunk_bytes]
+        bits = format(int.from_bytes(chunk, "big"), f"0{len(chunk) * 8}b")
+        yield "\n".join([bits[i:i + WORD_BITS] for i in range(0, len(bits), WORD_BITS)]) + "\n"
+
+
+def swap_word_bytes(data) -> bytes:
+    """将大端序的16字节字序列逐字反转字节序（转为小端序），字的先后顺序不变"""
+    halves = array("Q", bytes(data))
+    # 先反转每个8字节半字内部的字节序，再交换每个字的高低两个半字
+    halves.byteswap()
+    halves[0::2], halves[1::2] = halves[1::2], halves[0::2]
+    return halves.tobytes()
+
+
+def unpack_hex(data) -> Iterator[str]:
+    """将打包的字节序列按块转换为十六进制文本（每行32个十六进制字符，高位在前，即 $readmemh 格式）"""
+    chunk_bytes = TEXT_CHUNK_LINES * WORD_BYTES
+    hex_digits = WORD_BYTES * 2
+    for offset in range(0, len(data), chunk_bytes):
+        text = bytes(data[offset:offset + chunk_bytes]).hex()
+        yield "\n".join([text[i:i + hex_digits] for i in range(0, len(text), hex_digits)]) + "\n"
+
+
+class WordBuffer:
+    """
+    打包的128位字序列，底层为 bytearray（每个字16字节，大端序）。
+    下标以行为单位，从0开始。
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data=b""):
+        self.data = bytearray(data)
+
+    def __len__(self) -> int:
+        return len(self.data) // WORD_BYTES
+
+    @classmethod
+    def from_text_file(cls, path: str) -> "WordBuffer":
+        """读取'0'/'1'文本文件，忽略空行"""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(pack_text(f.read()))
+
+    def get(self, idx: int) -> int:
+        offset = idx * WORD_BYTES
+        return int.from_bytes(self.data[offset:offset + WORD_BYTES], "big")
+
+    def set(self, idx: int, word: int):
+        offset = idx * WORD_BYTES
+        self.data[offset:offset + WORD_BYTES] = word.to_bytes(WORD_BYTES, "big")
+
+    def get_field(self, idx: int, start: int, end: int) -> int:
+        return get_field(self.get(idx), start, end)
+
+    def set_field(self, idx: int, start: int, end: int, value: int):
+        self.set(idx, set_field(self.get(idx), start, end, value))
+
+    def apply_patches(self, patches: Iterable[Tuple[int, Tuple[int, int], int]]) -> int:
+        """
+        批量应用字段修改 [(行号, (start, end), 值), ...]：按行合并后每行只解码、编码一次。
+        返回被修改的行数。
+        """
+        merged = merge_field_patches(patches)
+        data = self.data
+        for line_idx, (clear, bits) in merged.items():
+            offset = line_idx * WORD_BYTES
+            if line_idx < 0 or offset + WORD_BYTES > len(data):
+                raise IndexError(f"字段修改的行号 {line_idx} 超出范围（共 {len(self)} 行）")
+            word = int.from_bytes(data[offset:offset + WORD_BYTES], "big")
+            data[offset:offset + WORD_BYTES] = ((word & ~clear) | bits).to_bytes(WORD_BYTES, "big")
+        return len(merged)
+
+    def is_separator(self, idx: int) -> bool:
+        offset = idx * WORD_BYTES
+        return self.data[offset:offset + WORD_BYTES] == SEPARATOR_BYTES
+
+    def append(self, word: int):
+        self.data += word.to_bytes(WORD_BYTES, "big")
+
+    def extend(self, words):
+        """追加另一个WordBuffer或打包好的字节序列"""
+        self.data += words.data if isinstance(words, WordBuffer) else words
+
+    def extend_separators(self, count: int):
+        self.data += SEPARATOR_BYTES * count
+
+    def slice(self, start: int, end: int) -> "WordBuffer":
+        return WordBuffer(self.data[start * WORD_BYTES:end * WORD_BYTES])
+
+    def words(self) -> List[int]:
+        return [int.from_bytes(self.data[i:i + WORD_BYTES], "big")
+                for i in range(0, len(self.data), WORD_BYTES)]
+
+    def iter_text(self) -> Iterator[str]:
+        """分块生成'0'/'1'文本（每行以换行符结尾），仅在序列化时使用"""
+        return unpack_text(self.data)
+
+    def write_text(self, path: str):
+        """序列化为'0'/'1'文本文件，每行128位"""
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(self.iter_text())